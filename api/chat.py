@@ -1,136 +1,59 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import os
+import sys
 import logging
-import google.generativeai as genai
+import threading
+
+# Make the shared backend package importable from the Vercel function
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.catalog import known_limits
+from backend.profiling import create_profiler
+from backend.providers import PROVIDERS, call_provider, initialize_clients, open_provider_stream
+from backend.responses import create_response_encoder, dumps, loads
+from backend.scheduler import RateLimitExceeded
+from backend.streaming import SSE_HEADERS, events_to_sse
+from backend.tokenizers import ContextLengthExceeded, create_context_budget
+from backend.tracing import annotate, create_tracer, span
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize clients
-clients = {}
+# Check configured providers; SDKs are imported on the first request that needs them
+clients = initialize_clients()
 
-def initialize_clients():
-    """Initialize API clients with keys from environment variables"""
-    global clients
-    
-    # Clear proxy environment variables that might interfere
-    proxy_vars = ['HTTP_PROXY', 'HTTPS_PROXY', 'http_proxy', 'https_proxy', 'NO_PROXY', 'no_proxy']
-    for var in proxy_vars:
-        if var in os.environ:
-            del os.environ[var]
-    
-    # OpenAI client
-    openai_api_key = os.getenv('OPENAI_API_KEY')
-    if openai_api_key and openai_api_key != 'your_openai_api_key_here':
-        import openai
-        openai.api_key = openai_api_key
-        clients['openai'] = openai
-        logger.info("OpenAI client initialized")
-    else:
-        logger.warning("OpenAI API key not found or not configured")
-    
-    # Google AI client
-    google_api_key = os.getenv('GOOGLE_API_KEY')
-    if google_api_key and google_api_key != 'your_google_api_key_here':
-        genai.configure(api_key=google_api_key)
-        clients['google'] = genai
-        logger.info("Google AI client initialized")
-    else:
-        logger.warning("Google AI API key not found or not configured")
-    
-    return clients
+# Per-request phase timing reported in Server-Timing and a JSON log line
+tracer = create_tracer()
 
-def call_openai(model, message, system_prompt, temperature, max_tokens, top_p, seed):
-    """Call OpenAI API"""
-    if 'openai' not in clients:
-        raise Exception("OpenAI client not initialized. Please check your API key.")
-    
-    try:
-        messages = []
-        
-        # Add system prompt if provided
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        
-        # Add user message
-        messages.append({"role": "user", "content": message})
-        
-        # Prepare parameters
-        params = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "top_p": top_p
-        }
-        
-        # Add seed if provided
-        if seed:
-            params["seed"] = int(seed)
-        
-        # Make API call using legacy format
-        response = clients['openai'].ChatCompletion.create(**params)
-        return response.choices[0].message.content
-        
-    except Exception as e:
-        logger.error(f"OpenAI API error: {str(e)}")
-        raise Exception(f"OpenAI API error: {str(e)}")
+# Opt-in profiling of single requests, written to PROFILE_DIR (see backend.profiling)
+profiler = create_profiler()
 
-def call_google_ai(model, message, system_prompt, temperature, max_tokens, top_p, seed):
-    """Call Google AI API"""
-    if 'google' not in clients:
-        raise Exception("Google AI client not initialized. Please check your API key.")
-    
-    try:
-        # Get the model
-        genai_model = genai.GenerativeModel(model)
-        
-        # Prepare the prompt
-        full_prompt = message
-        if system_prompt:
-            full_prompt = f"System: {system_prompt}\n\nUser: {message}"
-        
-        # Make API call - use the same simple approach that worked in debug
-        response = genai_model.generate_content(full_prompt)
-        
-        # Handle response safely - the Google AI API response.text works perfectly
-        try:
-            # Check if response was blocked by safety filters
-            if hasattr(response, 'candidates') and response.candidates and len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'finish_reason'):
-                    if candidate.finish_reason == 'SAFETY':
-                        return "I'm sorry, but I can't provide a response to that request due to safety guidelines."
-                    elif candidate.finish_reason == 'RECITATION':
-                        return "I'm sorry, but I can't provide a response to that request due to content policy restrictions."
-            
-            # Use the direct text property - this works perfectly
-            if response and hasattr(response, 'text') and response.text:
-                return response.text
-            
-            # Fallback to candidates if text is not available
-            if hasattr(response, 'candidates') and response.candidates and len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and candidate.content:
-                    if hasattr(candidate.content, 'parts') and candidate.content.parts and len(candidate.content.parts) > 0:
-                        part = candidate.content.parts[0]
-                        if hasattr(part, 'text') and part.text:
-                            return part.text
-            
-            return "Sorry, I couldn't generate a response. Please try again."
-            
-        except Exception as e:
-            logger.error(f"Error accessing response content: {e}")
-            return "Sorry, I encountered an error processing the response. Please try again."
-        
-    except Exception as e:
-        logger.error(f"Google AI API error: {str(e)}")
-        raise Exception(f"Google AI API error: {str(e)}")
+# Fast JSON and compression for clients that accept it
+response_encoder = create_response_encoder()
+
+# Local token counts checked against the model's known limits before the provider call
+context_budget = create_context_budget(lambda provider, model: known_limits(model))
 
-# Initialize clients
-initialize_clients()
+# Long system prompts cached on the provider's side while this instance stays warm. Built by the first
+# request with a system prompt; registrations run inline and expire on a short TTL (see backend.prefix_cache)
+prefix_cache = None
+prefix_cache_lock = threading.Lock()
+prefix_cache_built = False
+
+def prefix_lookup(provider, model, system_prompt):
+    """The prefix cache entry for a provider call, or None to send the system prompt in full"""
+    global prefix_cache, prefix_cache_built
+    if not system_prompt:
+        return None
+    if not prefix_cache_built:
+        with prefix_cache_lock:
+            if not prefix_cache_built:
+                from backend.prefix_cache import create_prefix_cache
+                prefix_cache = create_prefix_cache(context_budget.counter.count if context_budget is not None else None,
+                                                   serverless=True)
+                prefix_cache_built = True
+    return prefix_cache.lookup(provider, model, system_prompt) if prefix_cache is not None else None
 
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
@@ -138,16 +61,21 @@ class handler(BaseHTTPRequestHandler):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Request-ID, X-Profile, X-Profile-Mode')
         self.end_headers()
     
     def do_POST(self):
         """Handle POST requests"""
+        self.trace = tracer.start('POST /api/chat', self.headers.get('X-Request-ID'))
+        if profiler is not None:
+            profiler.start(self.trace, self.headers.get('X-Profile'), self.headers.get('X-Profile-Mode'))
+        self.status = None
         try:
             # Read request body
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                data = loads(post_data)
             
             # Extract parameters
             provider = data.get('provider', 'openai')
@@ -158,51 +86,98 @@ class handler(BaseHTTPRequestHandler):
             max_tokens = int(data.get('max_tokens', 1000))
             top_p = float(data.get('top_p', 1.0))
             seed = data.get('seed')
+            annotate(provider=provider, model=model)
             
             # Validate required fields
             if not message:
-                self.send_response(400)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': 'Message is required'}).encode())
+                self.send_json(400, {'error': 'Message is required'})
                 return
             
-            # Call appropriate API
-            if provider == 'openai':
-                response_text = call_openai(model, message, system_prompt, temperature, max_tokens, top_p, seed)
-            elif provider == 'google':
-                response_text = call_google_ai(model, message, system_prompt, temperature, max_tokens, top_p, seed)
-            else:
-                self.send_response(400)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': f'Unsupported provider: {provider}'}).encode())
+            if provider not in PROVIDERS:
+                self.send_json(400, {'error': f'Unsupported provider: {provider}'})
                 return
             
-            # Return response
+            requested_max_tokens = max_tokens
+            if context_budget is not None:
+                with span('tokenize'):
+                    max_tokens = context_budget.fit(provider, model, message, system_prompt, max_tokens)
+            
+            prefix = prefix_lookup(provider, model, system_prompt)
+            
+            # Stream tokens as Server-Sent Events when requested
+            if data.get('stream'):
+                events = open_provider_stream(provider, model, message, system_prompt, temperature, max_tokens, top_p, seed,
+                                              prefix=prefix)
+                self.send_stream(events)
+                return
+            
+            # Call appropriate API
+            result = call_provider(provider, model, message, system_prompt, temperature, max_tokens, top_p, seed, prefix=prefix)
+            
+            # Return response with the token usage the provider reported
             response_data = {
-                'response': response_text,
+                'response': result['text'],
                 'model': model,
                 'provider': provider,
-                'usage': {
-                    'temperature': temperature,
-                    'max_tokens': max_tokens,
-                    'top_p': top_p
-                }
+                'usage': dict(result['usage'], temperature=temperature, max_tokens=max_tokens, top_p=top_p)
             }
+            if max_tokens != requested_max_tokens:
+                response_data['usage']['requested_max_tokens'] = requested_max_tokens
             
-            self.send_response(200)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_data).encode())
+            self.send_json(200, response_data)
             
+        except ContextLengthExceeded as e:
+            logger.info(f"Chat request too long: {str(e)}")
+            self.send_json(400, {'error': str(e), 'code': 'context_length_exceeded', 'prompt_tokens': e.prompt_tokens,
+                                 'context_window': e.context_window})
+        except RateLimitExceeded as e:
+            logger.warning(f"Chat rate limited: {str(e)}")
+            self.send_json(429, {'error': str(e), 'retry_after': e.retry_after}, {'Retry-After': str(e.retry_after)})
         except Exception as e:
             logger.error(f"Chat error: {str(e)}")
-            self.send_response(500)
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': f'Internal server error: {str(e)}'}).encode())
\ No newline at end of file
+            self.send_json(500, {'error': f'Internal server error: {str(e)}'})
+        finally:
+            tracer.finish(self.trace, self.status)
+    
+    def send_json(self, status, payload, headers=None):
+        """Serialize payload and send it with the trace headers"""
+        with span('serialize'):
+            status, encoded_headers, body = response_encoder.respond(status, dumps(payload), 'application/json', self.headers)
+        self.send_response(status)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in dict(encoded_headers, **(headers or {})).items():
+            self.send_header(name, value)
+        self.send_trace_headers()
+        self.end_headers()
+        self.wfile.write(body)
+        self.status = status
+    
+    def send_trace_headers(self):
+        self.send_header('X-Request-ID', self.trace.request_id)
+        self.send_header('Access-Control-Expose-Headers', 'Server-Timing, X-Request-ID, X-Profile-ID')
+        if self.trace.profile is not None:
+            self.send_header('X-Profile-ID', self.trace.profile.id)
+        if tracer.server_timing:
+            self.send_header('Server-Timing', self.trace.server_timing())
+            self.send_header('Timing-Allow-Origin', '*')
+    
+    def send_stream(self, events):
+        """Write normalised stream events to the client as Server-Sent Events"""
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Content-Type', 'text/event-stream')
+        for name, value in SSE_HEADERS.items():
+            self.send_header(name, value)
+        self.send_trace_headers()
+        self.end_headers()
+        self.status = 200
+        
+        sse = events_to_sse(events)
+        try:
+            for payload in sse:
+                self.wfile.write(payload.encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client disconnected, closing the provider stream")
+        finally:
+            sse.close()
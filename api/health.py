@@ -1,6 +1,13 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import os
+import sys
+
+# Make the shared backend package importable from the Vercel function
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.responses import create_response_encoder, dumps
+
+response_encoder = create_response_encoder()
 
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
@@ -22,13 +29,18 @@ class handler(BaseHTTPRequestHandler):
         if os.getenv('GOOGLE_API_KEY') and os.getenv('GOOGLE_API_KEY') != 'your_google_api_key_here':
             available_clients.append('google')
         
+        if os.getenv('LOCAL_BASE_URL'):
+            available_clients.append('local')
+        
         health_data = {
             'status': 'healthy',
             'available_clients': available_clients
         }
         
-        self.send_response(200)
+        status, headers, body = response_encoder.respond(200, dumps(health_data), 'application/json', self.headers)
+        self.send_response(status)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(json.dumps(health_data).encode())
\ No newline at end of file
+        self.wfile.write(body)
\ No newline at end of file
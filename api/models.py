@@ -1,5 +1,22 @@
 from http.server import BaseHTTPRequestHandler
-import json
+import os
+import sys
+
+# Make the shared backend package importable from the Vercel function
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.catalog import create_model_catalog
+from backend.providers import initialize_clients
+from backend.responses import create_response_encoder
+
+initialize_clients()
+
+# Cached in memory and in /tmp; stale lists are refreshed in the background while still being served
+model_catalog = create_model_catalog()
+model_catalog.refresh_stale()
+
+# Compression for clients that accept it, 304 for unchanged catalogs
+response_encoder = create_response_encoder()
 
 class handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
@@ -12,24 +29,13 @@ class handler(BaseHTTPRequestHandler):
     
     def do_GET(self):
         """Get available models"""
-        models_data = {
-            'openai': [
-                {'value': 'gpt-4o', 'text': 'GPT-4o'},
-                {'value': 'gpt-4o-mini', 'text': 'GPT-4o Mini'},
-                {'value': 'gpt-4-turbo', 'text': 'GPT-4 Turbo'},
-                {'value': 'gpt-4', 'text': 'GPT-4'},
-                {'value': 'gpt-3.5-turbo', 'text': 'GPT-3.5 Turbo'}
-            ],
-            'google': [
-                {'value': 'gemini-2.5-flash', 'text': 'Gemini 2.5 Flash'},
-                {'value': 'gemini-2.0-flash', 'text': 'Gemini 2.0 Flash'},
-                {'value': 'gemini-flash-latest', 'text': 'Gemini Flash Latest'},
-                {'value': 'gemini-pro-latest', 'text': 'Gemini Pro Latest'}
-            ]
-        }
+        body, etag = model_catalog.snapshot()
+        status, headers, body = response_encoder.respond(200, body, 'application/json', self.headers, etag, conditional=True)
         
-        self.send_response(200)
+        self.send_response(status)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Cache-Control', model_catalog.cache_control())
         self.end_headers()
-        self.wfile.write(json.dumps(models_data).encode())
\ No newline at end of file
+        self.wfile.write(body)
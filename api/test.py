@@ -1,21 +1,26 @@
 from http.server import BaseHTTPRequestHandler
-import json
+import os
+import sys
+
+# Make the shared backend package importable from the Vercel function
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.responses import create_response_encoder, dumps
+
+response_encoder = create_response_encoder()
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        
-        response = {'message': 'API is working!', 'status': 'success'}
-        self.wfile.write(json.dumps(response).encode())
+        self.send_json({'message': 'API is working!', 'status': 'success'})
     
     def do_POST(self):
-        self.send_response(200)
+        self.send_json({'message': 'POST request received!', 'status': 'success'})
+    
+    def send_json(self, payload):
+        status, headers, body = response_encoder.respond(200, dumps(payload), 'application/json', self.headers)
+        self.send_response(status)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
         self.end_headers()
-        
-        response = {'message': 'POST request received!', 'status': 'success'}
-        self.wfile.write(json.dumps(response).encode())
+        self.wfile.write(body)
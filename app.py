@@ -1,63 +1,421 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g, send_file, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
-import openai
-import google.generativeai as genai
-import json
 import logging
+import threading
+import time
+
+from backend.asgi import create_asgi_app
+from backend.batch import BATCH_MAX_CONCURRENCY, BATCH_MAX_ITEMS, default_concurrency, normalize_item, parse_jsonl, run_batch
+from backend.cache import cache_bypassed, cache_key, cache_opted_in, cacheable_request, create_response_cache
+from backend.cancellation import CancelRegistry, RequestCancelled
+from backend.catalog import create_model_catalog
+from backend.coalesce import create_coalescer
+from backend.history import ROLES, create_history_store
+from backend.jobs import FINISHED, JobNotRunningHere, JobsBusy, create_job_manager
+from backend.metrics import Metrics
+from backend.compare import compare_results, compare_streams
+from backend.prefix_cache import create_prefix_cache
+from backend.profiling import create_profiler
+from backend.providers import PROVIDERS, call_provider, initialize_clients, open_provider_stream, preload
+from backend.resilience import ProviderTimeout, ProviderUnavailable, create_resilience
+from backend.responses import create_response_encoder, dumps, etag, loads, weak
+from backend.scheduler import RateLimitExceeded, create_scheduler
+from backend.semantic_cache import create_semantic_cache, semantic_scope
+from backend.sessions import create_session_store, estimate_tokens
+from backend.streaming import SSE_HEADERS, events_to_sse
+from backend.tokenizers import ContextLengthExceeded, create_context_budget
+from backend.tracing import create_tracer, span
+from backend.usage import create_usage_ledger, totals
 
 # Load environment variables
 load_dotenv()
 
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify and request.get_json through backend.responses (orjson when installed)"""
+    
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return loads(s)
+    
+    def response(self, *args, **kwargs):
+        return self._app.response_class(dumps(self._prepare_response_obj(args, kwargs)), mimetype=self.mimetype)
+
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)  # Enable CORS for frontend communication
+app.json = FastJSONProvider(app)
+CORS(app, expose_headers=['Server-Timing', 'X-Request-ID', 'X-Profile-ID'])  # Enable CORS for frontend communication
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize API clients
-def initialize_clients():
-    """Initialize API clients with keys from environment variables"""
-    clients = {}
-    
-    # Clear proxy environment variables that might interfere
-    proxy_vars = ['HTTP_PROXY', 'HTTPS_PROXY', 'http_proxy', 'https_proxy', 'NO_PROXY', 'no_proxy']
-    for var in proxy_vars:
-        if var in os.environ:
-            del os.environ[var]
-    
-    # OpenAI client
-    openai_api_key = os.getenv('OPENAI_API_KEY')
-    if openai_api_key and openai_api_key != 'your_openai_api_key_here':
-        import openai
-        openai.api_key = openai_api_key
-        clients['openai'] = openai
-        logger.info("OpenAI client initialized")
-    else:
-        logger.warning("OpenAI API key not found or not configured")
-    
-    # Google AI client
-    google_api_key = os.getenv('GOOGLE_API_KEY')
-    if google_api_key and google_api_key != 'your_google_api_key_here':
-        genai.configure(api_key=google_api_key)
-        clients['google'] = genai
-        logger.info("Google AI client initialized")
+# Initialize clients; SDKs are imported on first use, preloaded here off the request path
+clients = initialize_clients()
+threading.Thread(target=preload, daemon=True).start()
+
+# Ledger of every provider call with real token counts and cost, written in batches off the request path
+usage_ledger = create_usage_ledger()
+
+# Request, provider and latency metrics served at /api/metrics; provider calls also go to the ledger
+metrics = Metrics(ledger=usage_ledger)
+
+def metrics_endpoint():
+    """Route pattern rather than path, so IDs in URLs do not create new series"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    if request.path.startswith('/api/'):
+        g.metrics_start = metrics.start_request(metrics_endpoint())
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        # Chat endpoints set g.metrics_labels; streamed bodies are timed until they finish
+        provider, model = g.get('metrics_labels', ('', ''))
+        endpoint, status = metrics_endpoint(), response.status_code
+        response.call_on_close(lambda: metrics.finish_request(endpoint, provider, model, status, start))
+    return response
+
+# Per-request phase timing: Server-Timing header, JSON trace log line, optional OTLP span file
+tracer = create_tracer()
+
+@app.before_request
+def start_request_trace():
+    if request.path.startswith('/api/'):
+        g.trace = tracer.start(f'{request.method} {metrics_endpoint()}', request.headers.get('X-Request-ID'))
+
+@app.after_request
+def finish_request_trace(response):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        provider, model = g.get('metrics_labels', ('', ''))
+        if provider:
+            trace.attributes.update(provider=provider, model=model)
+        response.headers['X-Request-ID'] = trace.request_id
+        if tracer.server_timing:
+            response.headers['Server-Timing'] = trace.server_timing()
+            response.headers['Timing-Allow-Origin'] = '*'
+        status = response.status_code
+        response.call_on_close(lambda: tracer.finish(trace, status))
+    return response
+
+# Opt-in profiling of single requests (X-Profile header or sampling); no hooks at all unless enabled
+profiler = create_profiler()
+
+if profiler is not None:
+    @app.before_request
+    def start_request_profile():
+        trace = g.get('trace')
+        # The profile endpoints take the same header as their credential; never profile them
+        if trace is not None and not request.path.startswith('/api/profiles'):
+            profiler.start(trace, request.headers.get('X-Profile'), request.headers.get('X-Profile-Mode'))
+    
+    @app.after_request
+    def add_profile_header(response):
+        trace = g.get('trace')
+        if trace is not None and trace.profile is not None:
+            response.headers['X-Profile-ID'] = trace.profile.id
+        return response
+
+# Compression for clients that accept it, ETags and 304s for GETs; runs before the hooks above see the response
+response_encoder = create_response_encoder()
+
+@app.after_request
+def encode_response(response):
+    if response.direct_passthrough:
+        return response  # Files from send_file answer conditional requests themselves
+    if request.method == 'GET' and response.status_code == 200 and not response.is_streamed:
+        if 'ETag' not in response.headers:
+            response.headers['ETag'] = etag(response.get_data())
+        response.make_conditional(request)
+    if response.status_code in (204, 304) or not response_encoder.compressible(response.content_type, response.is_streamed):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = response_encoder.negotiate(request.headers.get('Accept-Encoding'))
+    if encoding is None or 'Content-Encoding' in response.headers:
+        return response
+    if response.is_streamed:
+        # Batch results: compressed line by line, still delivered as they finish
+        response.response = response_encoder.compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
     else:
-        logger.warning("Google AI API key not found or not configured")
+        compressed = response_encoder.compress(response.get_data(), encoding)
+        if compressed is None:
+            return response
+        response.set_data(compressed)
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = weak(response.headers['ETag'])
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# Running chat requests by request id, so they can be aborted and their upstream calls closed
+cancellations = CancelRegistry()
+
+def cancel_token():
+    """Register the current request for cancellation under its request id (X-Request-ID)"""
+    trace = g.get('trace')
+    return cancellations.register(trace.request_id if trace is not None else request.headers.get('X-Request-ID'))
+
+# Exact-match response cache shared by the streaming and non-streaming paths
+response_cache = create_response_cache()
+
+# Opt-in near-duplicate cache: serves a stored answer for a paraphrased prompt
+semantic_cache = create_semantic_cache()
+
+def cache_allowed(data):
+    """True unless caching is off or the client asked to bypass it for this request"""
+    if response_cache is None and semantic_cache is None:
+        return False
+    if cache_bypassed(data, request.headers):
+        if response_cache is not None:
+            response_cache.record_bypass()
+        return False
+    return True
+
+def semantic_lookup(scope, message, history, use_cache):
+    """Return (value, similarity) for a paraphrase of a cached single-turn prompt, or None"""
+    if not use_cache or history or semantic_cache is None:
+        return None
+    with span('semantic_cache'):
+        return semantic_cache.get(scope, message)
+
+# Single-flight coalescing: concurrent identical requests share one upstream call
+coalescer = create_coalescer()
+
+def run_coalesced(key, fn, token=None):
+    """Run fn once for all concurrent requests with the same key"""
+    if coalescer is None:
+        return fn()
+    return coalescer.do(key, fn, token)
+
+def stream_coalesced(key, factory, token=None):
+    """Share one upstream stream between concurrent requests with the same key"""
+    if coalescer is None:
+        return factory()
+    return coalescer.stream(key, factory, token)
+
+# Server-side conversation history keyed by conversation_id
+session_store = create_session_store()
+
+def conversation_context(data, system_prompt, message):
+    """Return (history, context info) for a conversation turn, or ([], None) without a conversation_id"""
+    conversation_id = data.get('conversation_id')
+    if not conversation_id:
+        return [], None
+    return session_store.context(str(conversation_id), system_prompt, message)
+
+# Persistent chat history for the sidebar: SQLite + FTS5, written in batches off the request path
+history_store = create_history_store()
+
+HISTORY_PAGE_MAX = 100
+HISTORY_APPEND_MAX = 500
+
+def history_client():
+    """The X-Client-ID that scopes history to one browser, or an error response when missing"""
+    client_id = (request.headers.get('X-Client-ID') or '').strip()
+    if not client_id or len(client_id) > 128:
+        return None, (jsonify({'error': 'An X-Client-ID header (up to 128 characters) is required'}), 400)
+    return client_id, None
+
+def page_size(default):
+    """Clamp the ?limit= query parameter to 1..HISTORY_PAGE_MAX"""
+    return max(1, min(request.args.get('limit', default, type=int), HISTORY_PAGE_MAX))
+
+# Rate limiting and priority queueing in front of every provider call
+scheduler = create_scheduler()
+
+def request_tokens(message, system_prompt, max_tokens, history=None):
+    """Estimate the tokens a request counts against a provider's tokens-per-minute limit"""
+    prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(message)
+    prompt_tokens += sum(estimate_tokens(turn['content']) for turn in history or [])
+    return prompt_tokens + max_tokens
+
+def rate_limited_response(e):
+    """429 with Retry-After for requests the scheduler or provider turned away"""
+    return jsonify({'error': str(e), 'retry_after': e.retry_after}), 429, {'Retry-After': str(e.retry_after)}
+
+# Timeouts, circuit breakers, hedged requests and cross-provider fallback
+resilience = create_resilience()
+
+# Model lists from the providers' APIs, cached in memory and on disk, refreshed in the background
+model_catalog = create_model_catalog()
+model_catalog.refresh_stale()
+
+def model_limits(provider, model):
+    entry = model_catalog.lookup(provider, model)
+    return entry['context_window'], entry['max_output_tokens']
+
+# Local token counts checked against the model's limits before any provider call
+context_budget = create_context_budget(model_limits)
+
+def fit_max_tokens(provider, model, message, system_prompt, max_tokens, history=None):
+    """max_tokens clamped to the model's limits; raises ContextLengthExceeded for requests that cannot fit"""
+    if context_budget is None:
+        return max_tokens
+    with span('tokenize'):
+        return context_budget.fit(provider, model, message, system_prompt, max_tokens, history)
+
+# Long system prompts are cached on the provider's side and referenced on later calls
+prefix_cache = create_prefix_cache(context_budget.counter.count if context_budget is not None else None)
+
+def prompt_prefix(provider, model, system_prompt):
+    """The prefix cache entry to pass to a provider call, or None to send the system prompt in full"""
+    return prefix_cache.lookup(provider, model, system_prompt) if prefix_cache is not None else None
+
+def context_length_response(e):
+    """400 for prompts rejected before reaching the provider"""
+    return jsonify({'error': str(e), 'code': 'context_length_exceeded', 'prompt_tokens': e.prompt_tokens,
+                    'context_window': e.context_window}), 400
+
+def run_job(params, progress, token):
+    """Run a queued chat job through the streaming path, reporting the text generated so far"""
+    events = open_chat_stream(params['provider'], params['model'], params['message'], params['system_prompt'],
+                              params['temperature'], params['max_tokens'], params['top_p'], params['seed'],
+                              use_cache=params['use_cache'], priority='batch', token=token,
+                              cache_sampled=params.get('cache_sampled', False))
+    parts = []
+    result = {}
+    try:
+        for event in events:
+            token.check()
+            if event['type'] == 'delta':
+                parts.append(event['text'])
+                progress(parts)
+            elif event['type'] == 'done':
+                result = {key: value for key, value in event.items() if key != 'type'}
+    finally:
+        events.close()  # Closes the provider stream when the job was cancelled
+    token.check()
+    result['response'] = ''.join(parts)
+    return result
+
+# Background jobs for long generations: submit, then poll or subscribe for the result
+job_manager = create_job_manager(run_job, cancellations)
+
+for subsystem, component in (('cache', response_cache), ('coalescing', coalescer), ('sessions', session_store),
+                             ('scheduler', scheduler), ('resilience', resilience), ('catalog', model_catalog),
+                             ('semantic_cache', semantic_cache), ('history', history_store),
+                             ('jobs', job_manager), ('cancellation', cancellations), ('usage', usage_ledger),
+                             ('profiling', profiler), ('tokens', context_budget),
+                             ('responses', response_encoder), ('prefix_cache', prefix_cache)):
+    if component is not None:
+        metrics.register_stats(subsystem, component.stats)
+
+def unavailable_response(e):
+    """503 with Retry-After while a provider's circuit is open, 504 when it timed out"""
+    if isinstance(e, ProviderTimeout):
+        return jsonify({'error': str(e)}), 504
+    return jsonify({'error': str(e), 'retry_after': e.retry_after}), 503, {'Retry-After': str(e.retry_after)}
+
+def complete_chat(provider, model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None, use_cache=True, priority='interactive', token=None, cache_sampled=False):
+    """Return (response, usage, cache_hit, served_by) for a completion, going through the response caches and coalescer.
     
-    return clients
+    The caches only take part for deterministic requests (temperature 0 or a seed) unless cache_sampled is set;
+    use_cache=False skips the lookup but still stores the fresh result.
+    
+    usage holds the token counts the provider reported (those of the original call for a cache hit).
+    cache_hit is None for a fresh completion, otherwise the fields to merge into the result:
+    {'cached': True}, plus the prompt similarity for a semantic cache hit.
+    served_by is None unless a fallback model answered because the requested provider's circuit was open.
+    Raises RequestCancelled when the token is cancelled while waiting for the provider.
+    """
+    cacheable = cacheable_request(temperature, seed, cache_sampled)
+    use_cache = use_cache and cacheable
+    key = cache_key(provider, model, system_prompt, message, temperature, top_p, max_tokens, seed, history)
+    if use_cache and response_cache is not None:
+        with span('cache'):
+            cached = response_cache.get(key)
+        if cached is not None:
+            return cached['response'], cached.get('usage', {}), {'cached': True}, None
+    
+    scope = semantic_scope(provider, model, system_prompt, temperature, top_p, max_tokens, seed) if semantic_cache is not None else None
+    similar = semantic_lookup(scope, message, history, use_cache)
+    if similar is not None:
+        value, similarity = similar
+        return value['response'], value.get('usage', {}), {'cached': True, 'similarity': similarity}, None
+    
+    tokens = request_tokens(message, system_prompt, max_tokens, history)
+    
+    def admit(target_provider, target_model):
+        with span('queue'):
+            scheduler.acquire(target_provider, target_model, tokens, priority)
+    
+    def attempt(target_provider, target_model):
+        prefix = prompt_prefix(target_provider, target_model, system_prompt)
+        return metrics.call_provider(target_provider, target_model, lambda: call_provider(
+            target_provider, target_model, message, system_prompt, temperature, max_tokens, top_p, seed,
+            history, timeout=resilience.timeout, prefix=prefix))
+    
+    def complete():
+        result, served_provider, served_model = resilience.call(provider, model, attempt, token, admit=admit)
+        if (served_provider, served_model) != (provider, model):
+            return result, {'provider': served_provider, 'model': served_model}
+        
+        value = {'response': result['text'], 'finish_reason': result['finish_reason'], 'usage': result['usage']}
+        if response_cache is not None and cacheable:
+            response_cache.set(key, value)
+        if semantic_cache is not None and cacheable and not history:
+            semantic_cache.set(scope, message, value)
+        return result, None
+    
+    result, served_by = run_coalesced(f'chat:{key}', complete, token)
+    return result['text'], result['usage'], None, served_by
 
-# Initialize clients
-clients = initialize_clients()
+def open_chat_stream(provider, model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None, use_cache=True, priority='interactive', token=None, cache_sampled=False):
+    """Return normalised stream events for a completion, replaying cached responses as a single chunk.
+    
+    Caching follows the same rules as complete_chat.
+    Closing the returned generator closes the provider stream (once no coalesced request shares it);
+    a cancelled token ends a coalesced subscription at once.
+    """
+    cacheable = cacheable_request(temperature, seed, cache_sampled)
+    use_cache = use_cache and cacheable
+    key = cache_key(provider, model, system_prompt, message, temperature, top_p, max_tokens, seed, history)
+    if use_cache and response_cache is not None:
+        with span('cache'):
+            cached = response_cache.get(key)
+        if cached is not None:
+            return response_cache.replay_events(cached)
+    
+    scope = semantic_scope(provider, model, system_prompt, temperature, top_p, max_tokens, seed) if semantic_cache is not None else None
+    similar = semantic_lookup(scope, message, history, use_cache)
+    if similar is not None:
+        return semantic_cache.replay_events(*similar)
+    
+    tokens = request_tokens(message, system_prompt, max_tokens, history)
+    
+    def admit(target_provider, target_model):
+        with span('queue'):
+            scheduler.acquire(target_provider, target_model, tokens, priority)
+    
+    def open_target(target_provider, target_model):
+        upstream = open_provider_stream(target_provider, target_model, message, system_prompt, temperature, max_tokens,
+                                        top_p, seed, history, prefix=prompt_prefix(target_provider, target_model, system_prompt))
+        return metrics.record_stream(target_provider, target_model, upstream, max_tokens)
+    
+    def open_upstream():
+        upstream = resilience.open_stream(provider, model, open_target, admit=admit)
+        if response_cache is not None and cacheable:
+            upstream = response_cache.record_stream(key, upstream)
+        if semantic_cache is not None and cacheable and not history:
+            upstream = semantic_cache.record_stream(scope, message, upstream)
+        return upstream
+    
+    return stream_coalesced(f'stream:{key}', open_upstream, token)
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Main chat endpoint that routes to appropriate model"""
     try:
-        data = request.get_json()
+        with span('parse'):
+            data = request.get_json()
         
         # Extract parameters
         provider = data.get('provider', 'openai')
@@ -69,154 +427,526 @@ def chat():
         top_p = float(data.get('top_p', 1.0))
         seed = data.get('seed')
         
+        g.metrics_labels = (provider if provider in PROVIDERS else 'invalid', model)
+        
         if not message:
             return jsonify({'error': 'Message is required'}), 400
         
-        # Route to appropriate model
-        if provider == 'openai':
-            response = call_openai(model, message, system_prompt, temperature, max_tokens, top_p, seed)
-        elif provider == 'google':
-            response = call_google(model, message, system_prompt, temperature, max_tokens, top_p, seed)
-        else:
+        # Hand off to the SSE endpoint when the client asks for a stream
+        if data.get('stream'):
+            return chat_stream()
+        
+        if provider not in PROVIDERS:
             return jsonify({'error': f'Unsupported provider: {provider}'}), 400
         
-        return jsonify({
+        # Prior turns for server-side conversations
+        with span('context'):
+            history, context = conversation_context(data, system_prompt, message)
+        
+        requested_max_tokens = max_tokens
+        max_tokens = fit_max_tokens(provider, model, message, system_prompt, max_tokens, history)
+        usage = {
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'top_p': top_p
+        }
+        if max_tokens != requested_max_tokens:
+            usage['requested_max_tokens'] = requested_max_tokens
+        
+        token = cancel_token()
+        try:
+            response, reported, cache_hit, served_by = complete_chat(provider, model, message, system_prompt, temperature,
+                                                                     max_tokens, top_p, seed, history,
+                                                                     use_cache=cache_allowed(data), token=token,
+                                                                     cache_sampled=cache_opted_in(data))
+        finally:
+            cancellations.unregister(token)
+        
+        result = {
             'response': response,
             'provider': provider,
             'model': model,
-            'usage': {
-                'temperature': temperature,
-                'max_tokens': max_tokens,
-                'top_p': top_p
-            }
-        })
+            'usage': dict(reported, **usage)
+        }
+        if cache_hit:
+            result.update(cache_hit)
+        if served_by:
+            result['served_by'] = served_by
+        if context is not None:
+            session_store.append(context['conversation_id'], message, response)
+            result['context'] = context
+        
+        with span('serialize'):
+            return jsonify(result)
         
+    except ContextLengthExceeded as e:
+        logger.info(f"Chat request too long: {str(e)}")
+        return context_length_response(e)
+    except RequestCancelled as e:
+        logger.info(f"Chat request cancelled: {str(e)}")
+        return jsonify({'error': str(e)}), 499
+    except RateLimitExceeded as e:
+        logger.warning(f"Chat request rate limited: {str(e)}")
+        return rate_limited_response(e)
+    except (ProviderUnavailable, ProviderTimeout) as e:
+        logger.warning(f"Chat request failed fast: {str(e)}")
+        return unavailable_response(e)
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
-def call_openai(model, message, system_prompt, temperature, max_tokens, top_p, seed):
-    """Call OpenAI API"""
-    if 'openai' not in clients:
-        raise Exception("OpenAI client not initialized. Please check your API key.")
-    
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming chat endpoint that forwards tokens as Server-Sent Events"""
     try:
-        messages = []
-        
-        # Add system prompt if provided
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        
-        # Add user message
-        messages.append({"role": "user", "content": message})
-        
-        # Prepare parameters
-        params = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "top_p": top_p
-        }
+        with span('parse'):
+            data = request.get_json()
+        
+        # Extract parameters
+        provider = data.get('provider', 'openai')
+        model = data.get('model', 'gpt-3.5-turbo')
+        message = data.get('message', '')
+        system_prompt = data.get('system_prompt', '')
+        temperature = float(data.get('temperature', 0.7))
+        max_tokens = int(data.get('max_tokens', 1000))
+        top_p = float(data.get('top_p', 1.0))
+        seed = data.get('seed')
+        
+        g.metrics_labels = (provider if provider in PROVIDERS else 'invalid', model)
+        
+        if not message:
+            return jsonify({'error': 'Message is required'}), 400
+        
+        if provider not in PROVIDERS:
+            return jsonify({'error': f'Unsupported provider: {provider}'}), 400
+        
+        # Prior turns for server-side conversations
+        with span('context'):
+            history, context = conversation_context(data, system_prompt, message)
+        
+        max_tokens = fit_max_tokens(provider, model, message, system_prompt, max_tokens, history)
+        
+        token = cancel_token()
+        try:
+            events = open_chat_stream(provider, model, message, system_prompt, temperature, max_tokens, top_p, seed,
+                                      history, use_cache=cache_allowed(data), token=token, cache_sampled=cache_opted_in(data))
+        except Exception:
+            cancellations.unregister(token)
+            raise
+        
+        if context is not None:
+            events = session_store.record_stream(context['conversation_id'], message, events)
+        
+        # Stops on POST /api/chat/abort or when the client disconnects, closing the provider stream
+        events = cancellations.stream(token, events)
         
-        # Add seed if provided
-        if seed:
-            params["seed"] = int(seed)
+        def generate():
+            yield from events_to_sse(events)
         
-        # Make API call using legacy format
-        response = clients['openai'].ChatCompletion.create(**params)
-        return response.choices[0].message.content
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
         
+    except ContextLengthExceeded as e:
+        logger.info(f"Chat stream too long: {str(e)}")
+        return context_length_response(e)
+    except RequestCancelled as e:
+        logger.info(f"Chat stream cancelled: {str(e)}")
+        return jsonify({'error': str(e)}), 499
+    except RateLimitExceeded as e:
+        logger.warning(f"Chat stream rate limited: {str(e)}")
+        return rate_limited_response(e)
+    except (ProviderUnavailable, ProviderTimeout) as e:
+        logger.warning(f"Chat stream failed fast: {str(e)}")
+        return unavailable_response(e)
     except Exception as e:
-        logger.error(f"OpenAI API error: {str(e)}")
-        raise Exception(f"OpenAI API error: {str(e)}")
+        logger.error(f"Error in chat stream endpoint: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
-def call_google(model, message, system_prompt, temperature, max_tokens, top_p, seed):
-    """Call Google AI API"""
-    if 'google' not in clients:
-        raise Exception("Google AI client not initialized. Please check your API key.")
-    
+# Upper bound on models per comparison request
+COMPARE_MAX_TARGETS = int(os.getenv('COMPARE_MAX_TARGETS', 8))
+
+@app.route('/api/chat/abort', methods=['POST'])
+def abort_chat():
+    """Cancel a running chat request or job by the request id it was sent with (X-Request-ID)"""
+    data = request.get_json(silent=True) or {}
+    request_id = data.get('request_id')
+    if not request_id:
+        return jsonify({'error': 'request_id is required'}), 400
+    if not cancellations.cancel(str(request_id)):
+        # With several worker processes the request may be running in another one
+        return jsonify({'error': 'No running request with this id in this worker process',
+                        'request_id': request_id}), 404
+    return jsonify({'request_id': request_id, 'cancelled': True})
+
+@app.route('/api/chat/compare', methods=['POST'])
+def chat_compare():
+    """Send one prompt to several models concurrently, streaming each result as it finishes"""
     try:
-        # Get the model
-        genai_model = genai.GenerativeModel(model)
+        data = request.get_json()
+        
+        # Extract parameters
+        message = data.get('message', '')
+        system_prompt = data.get('system_prompt', '')
+        temperature = float(data.get('temperature', 0.7))
+        max_tokens = int(data.get('max_tokens', 1000))
+        top_p = float(data.get('top_p', 1.0))
+        seed = data.get('seed')
+        targets = data.get('targets') or []
+        
+        if not message:
+            return jsonify({'error': 'Message is required'}), 400
+        if not isinstance(targets, list) or not targets:
+            return jsonify({'error': 'At least one target is required'}), 400
+        if len(targets) > COMPARE_MAX_TARGETS:
+            return jsonify({'error': f'At most {COMPARE_MAX_TARGETS} targets are allowed'}), 400
+        for target in targets:
+            if not isinstance(target, dict) or not target.get('model'):
+                return jsonify({'error': 'Each target needs a provider and a model'}), 400
+            if target.get('provider') not in PROVIDERS:
+                return jsonify({'error': f"Unsupported provider: {target.get('provider')}"}), 400
+        targets = [{'provider': t['provider'], 'model': t['model']} for t in targets]
         
-        # Prepare the prompt
-        full_prompt = message
-        if system_prompt:
-            full_prompt = f"System: {system_prompt}\n\nUser: {message}"
+        use_cache = cache_allowed(data)
+        cache_sampled = cache_opted_in(data)
         
-        # Make API call - use the same simple approach that worked in debug
-        response = genai_model.generate_content(full_prompt)
+        if data.get('stream_tokens'):
+            # Forward every model's tokens as they arrive, tagged with the target index
+            events = compare_streams(targets, lambda t: open_chat_stream(
+                t['provider'], t['model'], message, system_prompt, temperature,
+                fit_max_tokens(t['provider'], t['model'], message, system_prompt, max_tokens), top_p, seed, use_cache=use_cache,
+                cache_sampled=cache_sampled))
+        else:
+            events = compare_results(targets, lambda t: complete_chat(
+                t['provider'], t['model'], message, system_prompt, temperature,
+                fit_max_tokens(t['provider'], t['model'], message, system_prompt, max_tokens), top_p, seed, use_cache=use_cache,
+                cache_sampled=cache_sampled))
         
-        # Handle response safely - the Google AI API response.text works perfectly
-        try:
-            # Check if response was blocked by safety filters
-            if hasattr(response, 'candidates') and response.candidates and len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'finish_reason'):
-                    if candidate.finish_reason == 'SAFETY':
-                        return "I'm sorry, but I can't provide a response to that request due to safety guidelines."
-                    elif candidate.finish_reason == 'RECITATION':
-                        return "I'm sorry, but I can't provide a response to that request due to content policy restrictions."
-            
-            # Use the direct text property - this works perfectly
-            if response and hasattr(response, 'text') and response.text:
-                return response.text
-            
-            # Fallback to candidates if text is not available
-            if hasattr(response, 'candidates') and response.candidates and len(response.candidates) > 0:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and candidate.content:
-                    if hasattr(candidate.content, 'parts') and candidate.content.parts and len(candidate.content.parts) > 0:
-                        part = candidate.content.parts[0]
-                        if hasattr(part, 'text') and part.text:
-                            return part.text
-            
-            return "Sorry, I couldn't generate a response. Please try again."
-            
-        except Exception as e:
-            logger.error(f"Error accessing response content: {e}")
-            return "Sorry, I encountered an error processing the response. Please try again."
+        if data.get('stream') is False:
+            results = []
+            summary = None
+            for event in events:
+                if event['type'] == 'result':
+                    results.append(event)
+                elif event['type'] == 'done':
+                    summary = event
+            return jsonify({'results': sorted(results, key=lambda r: r['index']), 'summary': summary})
+        
+        def generate():
+            yield from events_to_sse(events)
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
         
     except Exception as e:
-        logger.error(f"Google AI API error: {str(e)}")
-        raise Exception(f"Google AI API error: {str(e)}")
+        logger.error(f"Error in chat compare endpoint: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """Run a JSONL batch of chat requests, streaming JSONL results in completion order"""
+    try:
+        items = parse_jsonl(request.get_data(as_text=True))
+        if not items:
+            return jsonify({'error': 'Batch is empty'}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'At most {BATCH_MAX_ITEMS} items are allowed per batch'}), 400
+        
+        # Per-provider concurrency, overridable per request with ?concurrency_openai=N
+        concurrency = default_concurrency()
+        for provider in concurrency:
+            override = request.args.get(f'concurrency_{provider}', type=int)
+            if override:
+                concurrency[provider] = max(1, min(override, BATCH_MAX_CONCURRENCY))
+        
+        use_cache = cache_allowed({'cache': request.args.get('cache') != 'false'})
+        # ?cache=true also caches sampled items, like "cache": true on an item
+        cache_sampled = request.args.get('cache') == 'true'
+        
+        def complete(params):
+            max_tokens = fit_max_tokens(params['provider'], params['model'], params['message'], params['system_prompt'],
+                                        params['max_tokens'])
+            return complete_chat(params['provider'], params['model'], params['message'], params['system_prompt'],
+                                 params['temperature'], max_tokens, params['top_p'], params['seed'],
+                                 use_cache=use_cache, priority='batch',
+                                 cache_sampled=cache_sampled or params['cache_sampled'])
+        
+        def generate():
+            for result in run_batch(items, complete, concurrency):
+                yield dumps(result) + b'\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache'})
+        
+    except Exception as e:
+        logger.error(f"Error in chat batch endpoint: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a chat completion and return its job id without waiting for the provider"""
+    if job_manager is None:
+        return jsonify({'error': 'Job mode is disabled'}), 404
+    try:
+        data = request.get_json() or {}
+        params = normalize_item(data, PROVIDERS)
+        params['max_tokens'] = fit_max_tokens(params['provider'], params['model'], params['message'],
+                                              params['system_prompt'], params['max_tokens'])
+        params['use_cache'] = cache_allowed(data)
+        job_id = job_manager.submit(params)
+        status_url = f'/api/jobs/{job_id}'
+        return jsonify({'job_id': job_id, 'state': 'queued', 'status_url': status_url,
+                        'events_url': f'{status_url}/events'}), 202, {'Location': status_url}
+    except ContextLengthExceeded as e:
+        return context_length_response(e)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except JobsBusy as e:
+        logger.warning(f"Job rejected: {str(e)}")
+        return jsonify({'error': str(e), 'retry_after': e.retry_after}), 503, {'Retry-After': str(e.retry_after)}
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job state with the text generated so far; ?wait=N blocks up to N seconds for a change after ?since="""
+    if job_manager is None:
+        return jsonify({'error': 'Job mode is disabled'}), 404
+    wait = min(max(request.args.get('wait', 0, type=float), 0), 30)
+    if wait:
+        job = job_manager.wait(job_id, request.args.get('since', 0, type=float), wait)
+    else:
+        job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job; the text generated so far stays readable"""
+    if job_manager is None:
+        return jsonify({'error': 'Job mode is disabled'}), 404
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    if job['state'] in FINISHED:
+        return jsonify({'error': f"Job already {job['state']}", 'state': job['state']}), 409
+    try:
+        job_manager.cancel(job_id)
+    except JobNotRunningHere as e:
+        job = job_manager.get(job_id) or job
+        if job['state'] in FINISHED:  # It finished in the meantime
+            return jsonify({'error': f"Job already {job['state']}", 'state': job['state']}), 409
+        return jsonify({'error': str(e), 'state': job['state']}), 409
+    return jsonify({'job_id': job_id, 'state': 'cancelling'}), 202
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Subscribe to a job as Server-Sent Events: state changes, text deltas, then done or error"""
+    if job_manager is None:
+        return jsonify({'error': 'Job mode is disabled'}), 404
+    if job_manager.get(job_id) is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    
+    def generate():
+        yield from events_to_sse(job_manager.events(job_id))
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
 
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'clients': {
-            'openai': 'openai' in clients,
-            'google': 'google' in clients
-        }
+        'clients': {provider: provider in clients for provider in PROVIDERS},
+        'cache': response_cache.stats() if response_cache is not None else None,
+        'coalescing': coalescer.stats() if coalescer is not None else None,
+        'sessions': session_store.stats(),
+        'scheduler': scheduler.stats(),
+        'resilience': resilience.stats(),
+        'catalog': model_catalog.stats(),
+        'semantic_cache': semantic_cache.stats() if semantic_cache is not None else None,
+        'history': history_store.stats() if history_store is not None else None,
+        'jobs': job_manager.stats() if job_manager is not None else None,
+        'cancellation': cancellations.stats(),
+        'usage': usage_ledger.stats() if usage_ledger is not None else None,
+        'profiling': profiler.stats() if profiler is not None else None,
+        'tokens': context_budget.stats() if context_budget is not None else None,
+        'responses': response_encoder.stats(),
+        'prefix_cache': prefix_cache.stats() if prefix_cache is not None else None
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Metrics in the Prometheus text exposition format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Longest timeline a single request may return, in buckets
+USAGE_MAX_BUCKETS = 2000
+
+def usage_window():
+    """(since, until) from ?since= and ?until= in seconds since the epoch; the last 24 hours by default"""
+    until = request.args.get('until', type=float) or time.time()
+    since = request.args.get('since', type=float)
+    if since is None:
+        since = until - 86400
+    return since, until
+
+@app.route('/api/usage/models', methods=['GET'])
+def usage_by_model():
+    """Provider calls, tokens, cost and latency per model over a time window"""
+    if usage_ledger is None:
+        return jsonify({'error': 'Usage ledger is disabled'}), 404
+    since, until = usage_window()
+    models = usage_ledger.by_model(since, until)
+    return jsonify({'since': since, 'until': until, 'models': models, 'totals': totals(models)})
+
+@app.route('/api/usage/timeline', methods=['GET'])
+def usage_timeline():
+    """Provider calls, tokens, cost and latency per time bucket (?bucket= seconds, default 3600)"""
+    if usage_ledger is None:
+        return jsonify({'error': 'Usage ledger is disabled'}), 404
+    since, until = usage_window()
+    bucket = request.args.get('bucket', 3600, type=int)
+    if bucket < 60:
+        return jsonify({'error': 'bucket must be at least 60 seconds'}), 400
+    if (until - since) / bucket > USAGE_MAX_BUCKETS:
+        return jsonify({'error': f'At most {USAGE_MAX_BUCKETS} buckets are allowed; use a larger bucket or a shorter window'}), 400
+    buckets = usage_ledger.timeline(since, until, bucket, request.args.get('provider'), request.args.get('model'))
+    return jsonify({'since': since, 'until': until, 'bucket': bucket, 'buckets': buckets, 'totals': totals(buckets)})
+
+def profiles_forbidden():
+    """Error response unless profiling is on and the request carries the profile token, else None"""
+    if profiler is None:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    if not profiler.authorized(request.headers.get('X-Profile')):
+        return jsonify({'error': 'A valid X-Profile token is required'}), 403
+    return None
+
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    """Recent request profiles, newest first"""
+    error = profiles_forbidden()
+    if error:
+        return error
+    return jsonify({'profiles': profiler.list(max(1, min(request.args.get('limit', 50, type=int), 200)))})
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Download a profile: pstats for cprofile mode, collapsed stacks for sample mode"""
+    error = profiles_forbidden()
+    if error:
+        return error
+    path = profiler.path(profile_id)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, as_attachment=True, mimetype='text/plain' if path.endswith('.collapsed') else 'application/octet-stream')
+
+@app.route('/api/conversations/<conversation_id>', methods=['GET'])
+def get_conversation(conversation_id):
+    """Return the server-side history of a conversation"""
+    turns = session_store.get(conversation_id)
+    if turns is None:
+        return jsonify({'error': 'Conversation not found'}), 404
+    return jsonify({'conversation_id': conversation_id, 'turns': turns})
+
+@app.route('/api/conversations/<conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    """Forget a server-side conversation"""
+    session_store.delete(conversation_id)
+    return jsonify({'conversation_id': conversation_id, 'deleted': True})
+
+@app.route('/api/history', methods=['GET'])
+def list_history():
+    """Newest conversations first; pass next_cursor back as ?cursor= for the next page"""
+    if history_store is None:
+        return jsonify({'error': 'Chat history is disabled'}), 404
+    client_id, error = history_client()
+    if error:
+        return error
+    try:
+        conversations, next_cursor = history_store.list_conversations(client_id, page_size(50), request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'conversations': conversations, 'next_cursor': next_cursor})
+
+@app.route('/api/history/search', methods=['GET'])
+def search_history():
+    """Full-text search over stored messages, best matches first"""
+    if history_store is None:
+        return jsonify({'error': 'Chat history is disabled'}), 404
+    client_id, error = history_client()
+    if error:
+        return error
+    results, next_offset = history_store.search(client_id, request.args.get('q', ''), page_size(20),
+                                                max(0, request.args.get('offset', 0, type=int)))
+    return jsonify({'results': results, 'next_offset': next_offset})
+
+@app.route('/api/history/<conversation_id>', methods=['GET'])
+def get_history(conversation_id):
+    """A stored conversation with its newest messages; pass next_before as ?before= for older ones"""
+    if history_store is None:
+        return jsonify({'error': 'Chat history is disabled'}), 404
+    client_id, error = history_client()
+    if error:
+        return error
+    found = history_store.get_conversation(client_id, conversation_id, page_size(HISTORY_PAGE_MAX), request.args.get('before', type=int))
+    if found is None:
+        return jsonify({'error': 'Conversation not found'}), 404
+    conversation, messages, next_before = found
+    return jsonify({'conversation': conversation, 'messages': messages, 'next_before': next_before})
+
+@app.route('/api/history/<conversation_id>/messages', methods=['POST'])
+def append_history(conversation_id):
+    """Append new messages to a stored conversation; written in the background"""
+    if history_store is None:
+        return jsonify({'error': 'Chat history is disabled'}), 404
+    client_id, error = history_client()
+    if error:
+        return error
+    data = request.get_json() or {}
+    messages = data.get('messages') or []
+    if not isinstance(messages, list) or not messages:
+        return jsonify({'error': 'At least one message is required'}), 400
+    if len(messages) > HISTORY_APPEND_MAX:
+        return jsonify({'error': f'At most {HISTORY_APPEND_MAX} messages are allowed per request'}), 400
+    for message in messages:
+        if not isinstance(message, dict) or message.get('role') not in ROLES or not isinstance(message.get('content'), str):
+            return jsonify({'error': f"Each message needs a role ({', '.join(ROLES)}) and content"}), 400
+    
+    messages = [{'role': m['role'], 'content': m['content']} for m in messages]
+    if not history_store.append(client_id, conversation_id, messages, title=data.get('title'), provider=data.get('provider'),
+                                model=data.get('model'), params=data.get('params')):
+        return jsonify({'error': 'History is busy, try again shortly', 'retry_after': 1}), 503, {'Retry-After': '1'}
+    return jsonify({'conversation_id': conversation_id, 'queued': len(messages)}), 202
+
+@app.route('/api/history/<conversation_id>', methods=['DELETE'])
+def delete_history(conversation_id):
+    """Remove a stored conversation and its messages"""
+    if history_store is None:
+        return jsonify({'error': 'Chat history is disabled'}), 404
+    client_id, error = history_client()
+    if error:
+        return error
+    if not history_store.delete(client_id, conversation_id):
+        return jsonify({'error': 'History is busy, try again shortly', 'retry_after': 1}), 503, {'Retry-After': '1'}
+    return jsonify({'conversation_id': conversation_id, 'deleted': True})
+
 @app.route('/api/models', methods=['GET'])
 def get_models():
-    """Get available models for each provider"""
-    return jsonify({
-        'openai': [
-            {'value': 'gpt-4o', 'text': 'GPT-4o'},
-            {'value': 'gpt-4o-mini', 'text': 'GPT-4o Mini'},
-            {'value': 'gpt-4-turbo', 'text': 'GPT-4 Turbo'},
-            {'value': 'gpt-4', 'text': 'GPT-4'},
-            {'value': 'gpt-3.5-turbo', 'text': 'GPT-3.5 Turbo'}
-        ],
-        'google': [
-            {'value': 'gemini-2.5-flash', 'text': 'Gemini 2.5 Flash'},
-            {'value': 'gemini-2.0-flash', 'text': 'Gemini 2.0 Flash'},
-            {'value': 'gemini-flash-latest', 'text': 'Gemini Flash Latest'},
-            {'value': 'gemini-pro-latest', 'text': 'Gemini Pro Latest'}
-        ]
-    })
+    """Get available models for each provider, from the cached catalog"""
+    body, catalog_etag = model_catalog.snapshot()
+    # encode_response answers If-None-Match with a 304
+    return Response(body, mimetype='application/json',
+                    headers={'ETag': catalog_etag, 'Cache-Control': model_catalog.cache_control()})
+
+# ASGI variant for high-concurrency deployments: chat runs on the async
+# provider gateway, all other routes are served by this Flask app.
+# Run with: uvicorn app:asgi_app --port 5003
+asgi_app = create_asgi_app(app, cache=response_cache, coalescer=coalescer, sessions=session_store,
+                           scheduler=scheduler, resilience=resilience, metrics=metrics, semantic_cache=semantic_cache,
+                           cancellations=cancellations, budget=context_budget, prefix_cache=prefix_cache, tracer=tracer,
+                           profiler=profiler, encoder=response_encoder)
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5003))  # Changed default port to 5003
     debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     
     logger.info(f"Starting Flask server on port {port}")
-    logger.info(f"Available clients: {list(clients.keys())}")
+    logger.info(f"Available clients: {sorted(clients)}")
     
     app.run(host='0.0.0.0', port=port, debug=debug)
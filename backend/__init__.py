@@ -0,0 +1,3 @@
+"""
+Shared backend helpers for the LLM Playground (Flask app and Vercel functions)
+"""
@@ -0,0 +1,522 @@
+"""
+ASGI entry point: async chat endpoints on the provider gateway, Flask for the rest.
+
+    uvicorn app:asgi_app --port 5003
+
+POST /api/chat and /api/chat/stream are served natively on the event loop via
+ProviderGateway; every other request is delegated to the Flask app through
+asgiref's WSGI adapter, so both entry points expose the same API. The adapter
+runs Flask requests on a pool of WSGI_THREADS threads (default 32) instead of
+asgiref's single shared thread, so a long poll or job event stream does not
+hold up every other Flask route.
+
+Chat requests run in their own task, which is cancelled when the client
+disconnects (http.disconnect) or the request is aborted through
+POST /api/chat/abort; cancelling it closes the upstream provider connection.
+
+Given the Flask app's tracer, profiler and response encoder, native chat
+requests get the same X-Request-ID echo, Server-Timing header, trace log line
+and spans, profiles and compressed JSON as the Flask routes. Profiles are
+always sampled here: cProfile hooks a thread, and the event loop thread is
+shared by every request in flight, so a profile also shows the requests that
+ran alongside the profiled one.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from backend.cache import cache_bypassed, cache_key, cache_opted_in, cacheable_request
+from backend.cancellation import CancelRegistry
+from backend.gateway import ProviderError, ProviderGateway, build_messages
+from backend.providers import PROVIDERS
+from backend.resilience import ProviderTimeout, ProviderUnavailable
+from backend.responses import dumps, loads
+from backend.scheduler import RateLimitExceeded
+from backend.semantic_cache import semantic_scope
+from backend.sessions import estimate_tokens
+from backend.streaming import SSE_HEADERS, format_sse
+from backend.tokenizers import ContextLengthExceeded
+from backend.tracing import annotate, span, trace_async_stream
+
+logger = logging.getLogger(__name__)
+
+ASYNC_ROUTES = ('/api/chat', '/api/chat/stream')
+
+EXPOSED_HEADERS = b'Server-Timing, X-Request-ID, X-Profile-ID'
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """WSGI adapter running each request on a thread pool rather than one thread shared by all requests"""
+
+    def __init__(self, wsgi_application, threads=32):
+        super().__init__(wsgi_application)
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+        run = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func  # The undecorated method
+
+        class Instance(WsgiToAsgiInstance):
+            run_wsgi_app = sync_to_async(run, thread_sensitive=False, executor=executor)
+
+        self.instance_class = Instance
+
+    async def __call__(self, scope, receive, send):
+        await self.instance_class(self.wsgi_application)(scope, receive, send)
+
+
+class AsyncChatApp:
+    """ASGI application serving chat through the async gateway"""
+
+    def __init__(self, wsgi_app, gateway=None, cache=None, coalescer=None, sessions=None, scheduler=None, resilience=None, metrics=None,
+                 semantic_cache=None, cancellations=None, budget=None, prefix_cache=None, tracer=None, profiler=None,
+                 encoder=None, wsgi_threads=32):
+        self.wsgi = ThreadedWsgiToAsgi(wsgi_app, wsgi_threads)
+        self.gateway = gateway or ProviderGateway()
+        self.cache = cache
+        self.coalescer = coalescer
+        self.sessions = sessions
+        self.scheduler = scheduler
+        self.resilience = resilience
+        self.metrics = metrics
+        self.semantic_cache = semantic_cache
+        self.cancellations = cancellations or CancelRegistry()
+        self.budget = budget
+        self.prefix_cache = prefix_cache
+        self.tracer = tracer
+        self.profiler = profiler
+        self.encoder = encoder
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in ASYNC_ROUTES:
+            if self.metrics is None:
+                await self.chat(scope, receive, send)
+            else:
+                await self.measured(self.chat, scope, receive, send)
+            return
+
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                logger.info(f"Async gateway ready for: {self.gateway.available_providers()}")
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.gateway.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def measured(self, handler, scope, receive, send):
+        """Run a handler while recording request metrics, timing streams until they finish"""
+        start = self.metrics.start_request(scope['path'])
+        status = 500
+
+        async def send_tracked(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await handler(scope, receive, send_tracked)
+        finally:
+            provider, model = scope.get('metrics_labels', ('', ''))
+            self.metrics.finish_request(scope['path'], provider, model, status, start)
+
+    async def chat(self, scope, receive, send):
+        """Serve a chat request, cancelling it when the client disconnects or it is aborted by request id"""
+        body = await read_body(receive)
+        headers = request_headers(scope)
+        trace = None
+        if self.tracer is not None:
+            # Started before the handler task, which inherits it
+            trace = self.tracer.start(f"POST {scope['path']}", headers.get('X-Request-Id'))
+            if self.profiler is not None:
+                self.profiler.start(trace, headers.get('X-Profile'), 'sample')
+        token = self.cancellations.register(trace.request_id if trace is not None else headers.get('X-Request-Id'))
+        response = {'started': False, 'complete': False, 'status': None}
+
+        async def send_tracked(message):
+            if message['type'] == 'http.response.start':
+                response['started'] = True
+                response['status'] = message['status']
+                if trace is not None:
+                    message = dict(message, headers=list(message.get('headers', [])) + self.trace_headers(trace))
+            elif not message.get('more_body'):
+                response['complete'] = True
+            await send(message)
+
+        loop = asyncio.get_running_loop()
+        handler = asyncio.ensure_future(self.respond(scope, body, send_tracked))
+        # Aborts arrive on a Flask worker thread
+        token.on_cancel(lambda: loop.call_soon_threadsafe(handler.cancel))
+        watcher = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            await asyncio.wait((handler, watcher), return_when=asyncio.FIRST_COMPLETED)
+            if not handler.done():
+                token.cancel('disconnect')
+            try:
+                await handler
+            except asyncio.CancelledError:
+                if not token.cancelled:
+                    raise
+                logger.info(f"Async chat request cancelled ({token.reason})")
+                await finish_cancelled(send_tracked, response, token)
+        finally:
+            watcher.cancel()
+            handler.cancel()
+            self.cancellations.unregister(token)
+            if trace is not None:
+                provider, model = scope.get('metrics_labels', ('', ''))
+                if provider:
+                    trace.attributes.update(provider=provider, model=model)
+                self.tracer.finish(trace, response['status'])
+
+    def trace_headers(self, trace):
+        """X-Request-ID, Server-Timing and X-Profile-ID response headers, as the Flask app sends them"""
+        headers = [(b'x-request-id', trace.request_id.encode('latin-1')),
+                   (b'access-control-expose-headers', EXPOSED_HEADERS)]
+        if self.tracer.server_timing:
+            headers.append((b'server-timing', trace.server_timing().encode()))
+            headers.append((b'timing-allow-origin', b'*'))
+        if trace.profile is not None:
+            headers.append((b'x-profile-id', trace.profile.id.encode()))
+        return headers
+
+    async def send_json(self, scope, send, status, payload, headers=None):
+        """send_json() through the response encoder, compressing for clients that accept it"""
+        with span('serialize'):
+            body = dumps(payload)
+        await send_json(send, status, body, headers, self.encoder, request_headers(scope))
+
+    async def respond(self, scope, body, send):
+        """Async counterpart of app.chat / app.chat_stream"""
+        try:
+            with span('parse'):
+                data = loads(body or b'{}')
+
+            # Extract parameters
+            provider = data.get('provider', 'openai')
+            model = data.get('model', 'gpt-3.5-turbo')
+            message = data.get('message', '')
+            system_prompt = data.get('system_prompt', '')
+            temperature = float(data.get('temperature', 0.7))
+            max_tokens = int(data.get('max_tokens', 1000))
+            top_p = float(data.get('top_p', 1.0))
+            seed = data.get('seed')
+            scope['metrics_labels'] = (provider if provider in PROVIDERS else 'invalid', model)
+            annotate(provider=provider, model=model)
+
+            if not message:
+                await self.send_json(scope, send, 400, {'error': 'Message is required'})
+                return
+            if provider not in PROVIDERS:
+                await self.send_json(scope, send, 400, {'error': f'Unsupported provider: {provider}'})
+                return
+
+            # Prior turns for server-side conversations
+            history, context = [], None
+            if data.get('conversation_id') and self.sessions is not None:
+                with span('context'):
+                    history, context = self.sessions.context(str(data['conversation_id']), system_prompt, message)
+
+            # Clamp max_tokens to the model's limits, reject prompts that cannot fit
+            requested_max_tokens = max_tokens
+            if self.budget is not None:
+                with span('tokenize'):
+                    max_tokens = self.budget.fit(provider, model, message, system_prompt, max_tokens, history)
+
+            messages = build_messages(message, system_prompt, history)
+            stream = data.get('stream') or scope['path'] == '/api/chat/stream'
+            tokens = sum(estimate_tokens(msg['content']) for msg in messages) + max_tokens
+
+            # Serve identical deterministic requests from the shared response cache
+            key = cache_key(provider, model, system_prompt, message, temperature, top_p, max_tokens, seed, history)
+            cacheable = cacheable_request(temperature, seed, cache_opted_in(data))
+            response_cache = self.cache if cacheable else None
+            cached = None
+            bypassed = cache_bypassed(data, request_headers(scope))
+            if response_cache is not None:
+                if bypassed:
+                    response_cache.record_bypass()
+                else:
+                    with span('cache'):
+                        cached = response_cache.get(key)
+
+            # Paraphrases of single-turn prompts from the semantic cache
+            semantic = self.semantic_cache if cacheable and not history else None
+            similar = None
+            if semantic is not None:
+                semantic_key = semantic_scope(provider, model, system_prompt, temperature, top_p, max_tokens, seed)
+                if cached is None and not bypassed:
+                    with span('semantic_cache'):
+                        similar = semantic.get(semantic_key, message)
+
+            if stream:
+                if cached is not None:
+                    events = as_async(response_cache.replay_events(cached))
+                elif similar is not None:
+                    events = as_async(semantic.replay_events(*similar))
+                else:
+                    async def admit(target_provider, target_model):
+                        await self.admit(target_provider, target_model, tokens)
+
+                    async def open_target(target_provider, target_model):
+                        upstream = trace_async_stream(self.gateway.stream(
+                            target_provider, target_model, messages, temperature, max_tokens, top_p, seed,
+                            self.prefix(target_provider, target_model, system_prompt)))
+                        if self.metrics is not None:
+                            upstream = self.metrics.record_async_stream(target_provider, target_model, upstream, max_tokens)
+                        return upstream
+
+                    async def open_upstream():
+                        if self.resilience is not None:
+                            upstream = await self.resilience.open_stream_async(provider, model, open_target, admit)
+                        else:
+                            await admit(provider, model)
+                            upstream = await open_target(provider, model)
+                        if response_cache is not None:
+                            upstream = response_cache.record_async_stream(key, upstream)
+                        if semantic is not None:
+                            upstream = semantic.record_async_stream(semantic_key, message, upstream)
+                        return upstream
+
+                    if self.coalescer is not None:
+                        events = self.coalescer.stream_async(f'stream:{key}', open_upstream)
+                    else:
+                        events = await open_upstream()
+                if context is not None:
+                    events = self.sessions.record_async_stream(context['conversation_id'], message, events)
+                await send_event_stream(send, events)
+                return
+
+            usage = {'temperature': temperature, 'max_tokens': max_tokens, 'top_p': top_p}
+            if max_tokens != requested_max_tokens:
+                usage['requested_max_tokens'] = requested_max_tokens
+            if cached is None and similar is not None:
+                cached = similar[0]
+            if cached is not None:
+                result = {
+                    'response': cached['response'],
+                    'provider': provider,
+                    'model': model,
+                    'usage': dict(cached.get('usage', {}), **usage),
+                    'cached': True
+                }
+                if similar is not None:
+                    result['similarity'] = similar[1]
+                if context is not None:
+                    self.sessions.append(context['conversation_id'], message, cached['response'])
+                    result['context'] = context
+                await self.send_json(scope, send, 200, result)
+                return
+
+            async def admit(target_provider, target_model):
+                await self.admit(target_provider, target_model, tokens)
+
+            async def attempt(target_provider, target_model):
+                start = time.perf_counter()
+                try:
+                    with span('provider'):
+                        result = await self.gateway.chat(target_provider, target_model, messages, temperature, max_tokens,
+                                                         top_p, seed, self.prefix(target_provider, target_model, system_prompt))
+                except Exception:
+                    if self.metrics is not None:
+                        self.metrics.observe_provider(target_provider, target_model, time.perf_counter() - start, error=True)
+                    raise
+                except asyncio.CancelledError:
+                    # Cancelling closed the connection, so the provider stops generating
+                    if self.metrics is not None:
+                        self.metrics.observe_cancelled(target_provider, target_model, 0, max_tokens,
+                                                       time.perf_counter() - start)
+                    raise
+                if self.metrics is not None:
+                    reported = result['usage'].get('completion_tokens')
+                    self.metrics.observe_provider(target_provider, target_model, time.perf_counter() - start,
+                                                  reported if reported is not None else estimate_tokens(result['text']),
+                                                  prompt_tokens=result['usage'].get('prompt_tokens'),
+                                                  estimated=reported is None)
+                return result
+
+            async def complete():
+                served_by = None
+                if self.resilience is not None:
+                    result, served_provider, served_model = await self.resilience.call_async(provider, model, attempt, admit)
+                    if (served_provider, served_model) != (provider, model):
+                        served_by = {'provider': served_provider, 'model': served_model}
+                else:
+                    await admit(provider, model)
+                    result = await attempt(provider, model)
+                if served_by is not None:
+                    return dict(result, served_by=served_by)
+                value = {'response': result['text'], 'finish_reason': result['finish_reason'], 'usage': result['usage']}
+                if response_cache is not None:
+                    response_cache.set(key, value)
+                if semantic is not None:
+                    semantic.set(semantic_key, message, value)
+                return result
+
+            if self.coalescer is not None:
+                result = await self.coalescer.do_async(f'chat:{key}', complete)
+            else:
+                result = await complete()
+            response = {
+                'response': result['text'],
+                'provider': provider,
+                'model': model,
+                'usage': dict(result['usage'], **usage)
+            }
+            if result.get('served_by'):
+                response['served_by'] = result['served_by']
+            if context is not None:
+                self.sessions.append(context['conversation_id'], message, result['text'])
+                response['context'] = context
+            await self.send_json(scope, send, 200, response)
+
+        except ContextLengthExceeded as e:
+            logger.info(f"Async chat request too long: {str(e)}")
+            await self.send_json(scope, send, 400, {'error': str(e), 'code': 'context_length_exceeded', 'prompt_tokens': e.prompt_tokens,
+                                        'context_window': e.context_window})
+        except RateLimitExceeded as e:
+            logger.warning(f"Async chat request rate limited: {str(e)}")
+            await self.send_json(scope, send, 429, {'error': str(e), 'retry_after': e.retry_after}, {'Retry-After': e.retry_after})
+        except ProviderUnavailable as e:
+            logger.warning(f"Async chat request failed fast: {str(e)}")
+            await self.send_json(scope, send, 503, {'error': str(e), 'retry_after': e.retry_after}, {'Retry-After': e.retry_after})
+        except ProviderTimeout as e:
+            logger.warning(f"Async chat request timed out: {str(e)}")
+            await self.send_json(scope, send, 504, {'error': str(e)})
+        except ProviderError as e:
+            logger.error(f"Error in async chat endpoint: {str(e)}")
+            if e.status_code == 429:
+                retry_after = RateLimitExceeded(str(e), float(e.retry_after or 1)).retry_after
+                await self.send_json(scope, send, 429, {'error': str(e), 'retry_after': retry_after}, {'Retry-After': retry_after})
+            else:
+                await self.send_json(scope, send, 500, {'error': f'Internal server error: {str(e)}'})
+        except Exception as e:
+            logger.error(f"Error in async chat endpoint: {str(e)}")
+            await self.send_json(scope, send, 500, {'error': f'Internal server error: {str(e)}'})
+
+    async def admit(self, provider, model, tokens):
+        """Wait for rate-limit capacity before calling the provider"""
+        if self.scheduler is not None:
+            with span('queue'):
+                await self.scheduler.acquire_async(provider, model, tokens)
+
+    def prefix(self, provider, model, system_prompt):
+        """The prefix cache entry for a gateway call, or None to send the system prompt in full"""
+        if self.prefix_cache is None:
+            return None
+        return self.prefix_cache.lookup(provider, model, system_prompt)
+
+
+def request_headers(scope):
+    """Decode ASGI headers into a dict keyed like HTTP header names"""
+    return {name.decode('latin-1').title(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+async def as_async(events):
+    """Adapt a synchronous event generator to an async iterator"""
+    for event in events:
+        yield event
+
+
+async def wait_disconnect(receive):
+    """Return once the client has gone away; call after the request body has been read"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def finish_cancelled(send, response, token):
+    """End the response of a cancelled request: 499 before it started, a cancelled done event mid-stream"""
+    try:
+        if not response['started']:
+            await send_json(send, 499, {'error': f'Request cancelled ({token.reason})'})
+        elif not response['complete']:
+            await send({
+                'type': 'http.response.body',
+                'body': format_sse('done', {'type': 'done', 'finish_reason': 'cancelled', 'usage': {}}).encode(),
+                'more_body': True
+            })
+            await send({'type': 'http.response.body', 'body': b''})
+    except OSError:
+        pass  # The client is already gone
+
+
+async def read_body(receive):
+    """Read the full request body from an ASGI receive channel"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, status, payload, headers=None, encoder=None, request_headers=None):
+    """Send a JSON response; payload may be serialized already, encoder compresses it when the client accepts it"""
+    body = payload if isinstance(payload, bytes) else dumps(payload)
+    if encoder is not None:
+        status, encoded_headers, body = encoder.respond(status, body, 'application/json', request_headers or {})
+    else:
+        encoded_headers = {'Content-Type': 'application/json', 'Content-Length': str(len(body))}
+    response_headers = [(name.lower().encode(), value.encode()) for name, value in encoded_headers.items()]
+    response_headers.append((b'access-control-allow-origin', b'*'))
+    for name, value in (headers or {}).items():
+        response_headers.append((name.lower().encode(), str(value).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_event_stream(send, events):
+    """Forward normalised stream events to the client as Server-Sent Events"""
+    headers = [
+        (b'content-type', b'text/event-stream'),
+        (b'access-control-allow-origin', b'*')
+    ]
+    for name, value in SSE_HEADERS.items():
+        headers.append((name.lower().encode(), value.encode()))
+
+    started = False
+    try:
+        async for event in events:
+            if not started:
+                # Defer the headers until the provider accepted the request,
+                # so upstream errors can still be reported as a JSON status
+                await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+                started = True
+            await send({
+                'type': 'http.response.body',
+                'body': format_sse(event['type'], event).encode(),
+                'more_body': True
+            })
+    except Exception as e:
+        logger.error(f"Streaming error: {str(e)}")
+        if not started:
+            await send_json(send, 500, {'error': f'Internal server error: {str(e)}'})
+            return
+        await send({
+            'type': 'http.response.body',
+            'body': format_sse('error', {'type': 'error', 'error': str(e)}).encode(),
+            'more_body': True
+        })
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def create_asgi_app(wsgi_app, gateway=None, cache=None, coalescer=None, sessions=None, scheduler=None, resilience=None,
+                    metrics=None, semantic_cache=None, cancellations=None, budget=None, prefix_cache=None, tracer=None,
+                    profiler=None, encoder=None):
+    return AsyncChatApp(wsgi_app, gateway, cache, coalescer, sessions, scheduler, resilience, metrics, semantic_cache,
+                        cancellations, budget, prefix_cache, tracer, profiler, encoder,
+                        wsgi_threads=int(os.getenv('WSGI_THREADS', 32)))
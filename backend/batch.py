@@ -0,0 +1,164 @@
+"""
+Batch execution of chat requests for offline evaluation runs.
+
+Items run on one bounded thread pool per provider, so a batch can saturate
+each provider's quota without one provider's backlog starving the other.
+Results are yielded in completion order, tagged with the input index, and
+followed by a summary with throughput and latency percentiles.
+
+    BATCH_CONCURRENCY_OPENAI   concurrent OpenAI calls per batch (default 8)
+    BATCH_CONCURRENCY_GOOGLE   concurrent Google AI calls per batch (default 8)
+    BATCH_MAX_CONCURRENCY      upper bound for per-request overrides (default 32)
+    BATCH_MAX_ITEMS            max items accepted per batch (default 10000)
+"""
+import json
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.sessions import estimate_tokens
+from backend.stats import percentile
+
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 32))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 10000))
+
+
+def default_concurrency():
+    return {
+        'openai': int(os.getenv('BATCH_CONCURRENCY_OPENAI', 8)),
+        'google': int(os.getenv('BATCH_CONCURRENCY_GOOGLE', 8)),
+        'local': int(os.getenv('BATCH_CONCURRENCY_LOCAL', 8))
+    }
+
+
+def parse_jsonl(text):
+    """Parse JSONL into a list of (item, error) pairs, one per non-blank line"""
+    items = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError('each line must be a JSON object')
+            items.append((item, None))
+        except ValueError as e:
+            items.append((None, f'Invalid JSON: {e}'))
+    return items
+
+
+def normalize_item(item, providers):
+    """Extract chat parameters from a batch item, raising ValueError when invalid"""
+    provider = item.get('provider', 'openai')
+    if not isinstance(provider, str) or provider not in providers:
+        raise ValueError(f'Unsupported provider: {provider}')
+    message = item.get('message', '')
+    if not message:
+        raise ValueError('Message is required')
+    try:
+        temperature = float(item.get('temperature', 0.7))
+        max_tokens = int(item.get('max_tokens', 1000))
+        top_p = float(item.get('top_p', 1.0))
+    except (TypeError, ValueError) as e:
+        # float(None), int('abc') and the like; one bad item must not abort the batch
+        raise ValueError(f'Invalid sampling parameter: {e}') from e
+    return {
+        'provider': provider,
+        'model': item.get('model', 'gpt-3.5-turbo'),
+        'message': message,
+        'system_prompt': item.get('system_prompt', ''),
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'top_p': top_p,
+        'seed': item.get('seed'),
+        'cache_sampled': item.get('cache') is True
+    }
+
+
+def run_batch(items, complete, concurrency):
+    """Run parsed batch items and yield result dicts in completion order, then a summary.
+
+    complete(params) -> (response, usage, cache_hit, served_by) performs one chat completion;
+    concurrency maps provider -> max concurrent calls.
+    """
+    start = time.perf_counter()
+    results = queue.Queue()
+    pools = {
+        provider: ThreadPoolExecutor(max_workers=max(1, limit), thread_name_prefix=f'batch-{provider}')
+        for provider, limit in concurrency.items()
+    }
+
+    def run_one(index, item_id, params):
+        item_start = time.perf_counter()
+        try:
+            response, usage, cache_hit, served_by = complete(params)
+            completion_tokens = usage.get('completion_tokens')
+            result = {'response': response, 'cached': False, 'error': None, 'prompt_tokens': usage.get('prompt_tokens'),
+                      'completion_tokens': completion_tokens if completion_tokens is not None else estimate_tokens(response)}
+            if cache_hit:
+                result.update(cache_hit)
+            if served_by:
+                result['served_by'] = served_by
+        except Exception as e:
+            result = {'response': None, 'cached': False, 'error': str(e), 'completion_tokens': 0}
+        result.update({
+            'index': index,
+            'id': item_id,
+            'provider': params['provider'],
+            'model': params['model'],
+            'latency_ms': round((time.perf_counter() - item_start) * 1000, 1)
+        })
+        results.put(result)
+
+    pending = 0
+    try:
+        for index, (item, error) in enumerate(items):
+            item_id = item.get('id') if item else None
+            if error is None:
+                try:
+                    params = normalize_item(item, pools)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                yield {'index': index, 'id': item_id, 'response': None, 'error': error, 'latency_ms': 0}
+                continue
+            pools[params['provider']].submit(run_one, index, item_id, params)
+            pending += 1
+
+        latencies = []
+        succeeded = 0
+        tokens = 0
+        while pending:
+            result = results.get()
+            pending -= 1
+            if result['error'] is None:
+                succeeded += 1
+                latencies.append(result['latency_ms'])
+                tokens += result['completion_tokens']
+            yield result
+
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        yield {
+            'summary': {
+                'items': len(items),
+                'succeeded': succeeded,
+                'failed': len(items) - succeeded,
+                'elapsed_s': round(elapsed, 3),
+                'throughput_rps': round(succeeded / elapsed, 2) if elapsed > 0 else None,
+                'completion_tokens_per_s': round(tokens / elapsed, 1) if elapsed > 0 else None,
+                'latency_ms': {
+                    'p50': percentile(latencies, 50),
+                    'p90': percentile(latencies, 90),
+                    'p95': percentile(latencies, 95),
+                    'p99': percentile(latencies, 99),
+                    'max': latencies[-1] if latencies else None
+                },
+                'concurrency': concurrency
+            }
+        }
+    finally:
+        # Drop queued work if the client went away before the batch finished
+        for pool in pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,244 @@
+"""
+Exact-match response cache for chat completions.
+
+Entries are keyed on the normalised request parameters and held in a bounded
+in-memory LRU with a TTL. An optional SQLite tier persists entries across
+restarts and is consulted on memory misses. Several worker processes can
+share one file, so a response cached by one worker is a hit for all of them
+(`start_backend.py --production` sets this up by default).
+
+Only deterministic requests are cached: temperature 0 or an explicit seed.
+Replaying one sample of a sampled request would hide the variation the
+client asked for, so those are neither looked up nor stored unless the client
+opts in with "cache": true. Results that are not real answers are never
+stored: a missing finish reason (the stream broke off), a blocked, filtered or
+cancelled one, or the placeholder text shown instead of a reply.
+
+    RESPONSE_CACHE_ENABLED   set to 'false' to disable caching (default true)
+    RESPONSE_CACHE_SIZE      max entries kept in memory (default 1000)
+    RESPONSE_CACHE_TTL       entry lifetime in seconds (default 3600)
+    RESPONSE_CACHE_DB        path to a SQLite file for the disk tier (default off)
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Finish reasons of completions that were blocked, filtered or cut short
+UNCACHEABLE_FINISH_REASONS = {
+    'SAFETY', 'RECITATION', 'BLOCKLIST', 'PROHIBITED_CONTENT', 'SPII', 'OTHER', 'FINISH_REASON_UNSPECIFIED',
+    'CONTENT_FILTER', 'CANCELLED'
+}
+
+# Texts the provider wrappers return in place of a reply
+PLACEHOLDER_PREFIXES = ("Sorry, I couldn't generate a response", "I'm sorry, but I can't provide a response to that request")
+
+
+def cache_key(provider, model, system_prompt, message, temperature, top_p, max_tokens, seed, history=None):
+    """Build a stable key from the normalised request parameters (and prior turns, if any)"""
+    normalized = [
+        (provider or '').strip().lower(),
+        (model or '').strip(),
+        (system_prompt or '').strip(),
+        (message or '').strip(),
+        round(float(temperature), 4),
+        round(float(top_p), 4),
+        int(max_tokens),
+        int(seed) if seed not in (None, '') else None
+    ]
+    if history:
+        normalized.append([[turn['role'], turn['content']] for turn in history])
+    raw = json.dumps(normalized, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def cacheable_request(temperature, seed, sampled=False):
+    """True for deterministic requests (temperature 0 or an explicit seed), or any request when sampled is set"""
+    return sampled or float(temperature) == 0 or seed not in (None, '')
+
+
+def cacheable_result(value):
+    """True when a {'response', 'finish_reason'} result is a complete answer worth replaying"""
+    finish_reason = value.get('finish_reason')
+    if not finish_reason or str(finish_reason).upper() in UNCACHEABLE_FINISH_REASONS:
+        return False
+    text = (value.get('response') or '').strip()
+    return bool(text) and not text.startswith(PLACEHOLDER_PREFIXES)
+
+
+def cache_opted_in(data):
+    """True when the client asked for sampled (non-deterministic) responses to be cached too"""
+    return data.get('cache') is True
+
+
+def cache_bypassed(data, headers):
+    """True when the client asked to skip cached responses for this request"""
+    if data.get('cache') is False:
+        return True
+    return 'no-cache' in (headers.get('Cache-Control') or '').lower()
+
+
+class ResponseCache:
+    """LRU + TTL memory cache with an optional SQLite disk tier"""
+
+    def __init__(self, max_entries=1000, ttl=3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats_counters = {
+            'hits': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'bypassed': 0,
+            'uncacheable': 0
+        }
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, path):
+        try:
+            # Other worker processes may be writing the same file
+            self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._db.execute('DELETE FROM response_cache WHERE expires_at < ?', (time.time(),))
+            self._db.commit()
+            logger.info(f"Response cache disk tier at {path}")
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache disk tier disabled: {e}")
+            self._db = None
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.stats_counters['hits'] += 1
+                    self.stats_counters['memory_hits'] += 1
+                    return value
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT value, expires_at FROM response_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.stats_counters['hits'] += 1
+                    self.stats_counters['disk_hits'] += 1
+                    return value
+
+            self.stats_counters['misses'] += 1
+            return None
+
+    def set(self, key, value):
+        """Store a JSON-serialisable result under key; incomplete or blocked results are skipped"""
+        if not cacheable_result(value):
+            with self._lock:
+                self.stats_counters['uncacheable'] += 1
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self.stats_counters['stores'] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                        (key, json.dumps(value), expires_at)
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Response cache disk write failed: {e}")
+
+    def _remember(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats_counters['evictions'] += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats_counters['bypassed'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM response_cache')
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.stats_counters['hits'] + self.stats_counters['misses']
+            return dict(
+                self.stats_counters,
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                ttl=self.ttl,
+                disk=self._db is not None,
+                hit_rate=round(self.stats_counters['hits'] / lookups, 4) if lookups else 0.0
+            )
+
+    # Streaming helpers
+
+    def replay_events(self, value):
+        """Replay a cached response as normalised stream events"""
+        yield {'type': 'delta', 'text': value['response']}
+        yield {'type': 'done', 'finish_reason': value.get('finish_reason'), 'usage': value.get('usage', {}), 'cached': True}
+
+    def record_stream(self, key, events):
+        """Pass stream events through, caching the assembled response once it completes.
+
+        Responses served by a fallback model are not cached under the requested model's key.
+        """
+        parts = []
+        for event in events:
+            if event['type'] == 'delta':
+                parts.append(event['text'])
+            elif event['type'] == 'done' and not event.get('served_by'):
+                self.set(key, {'response': ''.join(parts), 'finish_reason': event.get('finish_reason'), 'usage': event.get('usage', {})})
+            yield event
+
+    async def record_async_stream(self, key, events):
+        """Async variant of record_stream for the ASGI gateway"""
+        parts = []
+        async for event in events:
+            if event['type'] == 'delta':
+                parts.append(event['text'])
+            elif event['type'] == 'done' and not event.get('served_by'):
+                self.set(key, {'response': ''.join(parts), 'finish_reason': event.get('finish_reason'), 'usage': event.get('usage', {})})
+            yield event
+
+
+def create_response_cache():
+    """Build the process-wide cache from environment settings, or None if disabled"""
+    if os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'false':
+        return None
+    return ResponseCache(
+        max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 1000)),
+        ttl=float(os.getenv('RESPONSE_CACHE_TTL', 3600)),
+        db_path=os.getenv('RESPONSE_CACHE_DB') or None
+    )
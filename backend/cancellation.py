@@ -0,0 +1,126 @@
+"""
+Cancellation of in-flight chat requests.
+
+Every chat request is registered under its request id (the X-Request-ID
+header, echoed back on the response) while it runs. It is cancelled either
+explicitly, with POST /api/chat/abort {"request_id": ...}, or by the client
+going away: a dropped SSE connection shows up as the response generator being
+closed (Flask) or as an http.disconnect message (ASGI gateway).
+
+Cancelling a stream closes the upstream provider stream, which closes its HTTP
+connection so the provider stops generating. A request waiting on a coalesced
+stream is released at once, and the shared upstream is closed at its next
+chunk once its last subscriber has left; a request reading the provider
+directly stops at the next chunk. A blocking (non-streaming) SDK call cannot be interrupted:
+the request returns immediately, but the call runs to completion in the
+background, so clients that want their tokens back should stream.
+
+Aborts are per process; with several worker processes an abort may reach a
+different worker than the request, and only the disconnect path applies.
+"""
+import logging
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCancelled(Exception):
+    """Raised in a request that was aborted or whose client went away"""
+
+
+class CancelToken:
+    """Cancellation flag for one request; waits can include token.future to wake on cancel"""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id
+        self.future = Future()
+
+    @property
+    def cancelled(self):
+        return self.future.done()
+
+    @property
+    def reason(self):
+        """'abort' or 'disconnect' once cancelled, else None"""
+        return self.future.result() if self.future.done() else None
+
+    def cancel(self, reason='abort'):
+        """Cancel the request; returns False if it was already cancelled"""
+        try:
+            self.future.set_result(reason)
+        except InvalidStateError:
+            return False
+        return True
+
+    def on_cancel(self, callback):
+        """Run callback() when the token is cancelled, at once if it already is"""
+        self.future.add_done_callback(lambda _: callback())
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled(f'Request cancelled ({self.reason})')
+
+
+class CancelRegistry:
+    """Tokens of running requests by request id"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self.stats_counters = {'registered': 0, 'abort': 0, 'disconnect': 0, 'unknown_aborts': 0}
+
+    def register(self, request_id):
+        """Token for a new request; a request id reused while running replaces the older entry"""
+        token = CancelToken(request_id)
+        with self._lock:
+            self.stats_counters['registered'] += 1
+            if request_id:
+                self._tokens[request_id] = token
+        return token
+
+    def unregister(self, token):
+        with self._lock:
+            if token.request_id and self._tokens.get(token.request_id) is token:
+                del self._tokens[token.request_id]
+            if token.cancelled:
+                self.stats_counters[token.reason] += 1
+
+    def cancel(self, request_id, reason='abort'):
+        """Cancel a running request by id; returns False if none is running in this process"""
+        with self._lock:
+            token = self._tokens.get(request_id)
+            if token is None:
+                self.stats_counters['unknown_aborts'] += 1
+                return False
+        token.cancel(reason)
+        return True
+
+    def stream(self, token, events):
+        """Pass stream events through until the token is cancelled or the client disconnects.
+
+        Either way the upstream iterator is closed, which closes the provider
+        stream; an explicit abort ends the stream with a done event whose
+        finish_reason is 'cancelled'. The token is unregistered at the end.
+        """
+        try:
+            try:
+                for event in events:
+                    if token.cancelled:
+                        break
+                    yield event
+            except GeneratorExit:
+                token.cancel('disconnect')
+                raise
+            finally:
+                close = getattr(events, 'close', None)
+                if close is not None:
+                    close()
+            if token.cancelled:
+                yield {'type': 'done', 'finish_reason': 'cancelled', 'usage': {}}
+        finally:
+            self.unregister(token)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counters, running=len(self._tokens))
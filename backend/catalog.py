@@ -0,0 +1,296 @@
+"""
+Model catalog served at /api/models, built from the providers' list-models APIs.
+
+The catalog is cached in memory and in a JSON file, so a fresh process (or
+another worker) starts from the last known list instead of an empty one.
+Requests never wait for a provider: stale entries keep being served while a
+background thread refreshes them (stale-while-revalidate), and a provider
+whose listing fails keeps its previous models, or the built-in defaults.
+
+Every entry carries the model's context window and output limit where known
+(from the API for Gemini and vLLM/llama.cpp servers, from a table otherwise)
+so callers can budget prompts and max_tokens.
+
+    MODEL_CATALOG_FILE        JSON cache file (default <tmp>/llm_model_catalog.json)
+    MODEL_CATALOG_TTL         seconds before a provider's list is refreshed (default 3600)
+    MODEL_CATALOG_LOCAL_TTL   the same for the local server, whose models change more often (default 60)
+    MODEL_CATALOG_RETRY       seconds between attempts after a failed refresh (default 60)
+    MODEL_CATALOG_MAX_AGE     browser cache lifetime (Cache-Control max-age) in seconds (default 300)
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from backend.providers import configured, get_client, list_local_models
+from backend.responses import dumps, etag
+
+logger = logging.getLogger(__name__)
+
+# Listed when a provider is unconfigured or has never been listed successfully
+DEFAULT_MODELS = {
+    'openai': ['gpt-4o', 'gpt-4o-mini', 'gpt-4-turbo', 'gpt-4', 'gpt-3.5-turbo'],
+    'google': ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-flash-latest', 'gemini-pro-latest'],
+    'local': []
+}
+
+DISPLAY_NAMES = {
+    'gpt-4o': 'GPT-4o',
+    'gpt-4o-mini': 'GPT-4o Mini',
+    'gpt-4-turbo': 'GPT-4 Turbo',
+    'gpt-4': 'GPT-4',
+    'gpt-3.5-turbo': 'GPT-3.5 Turbo',
+    'gemini-2.5-flash': 'Gemini 2.5 Flash',
+    'gemini-2.0-flash': 'Gemini 2.0 Flash',
+    'gemini-flash-latest': 'Gemini Flash Latest',
+    'gemini-pro-latest': 'Gemini Pro Latest'
+}
+
+# (context window, max output tokens) by model id prefix; the longest prefix wins
+KNOWN_LIMITS = {
+    'gpt-3.5-turbo': (16385, 4096),
+    'gpt-4': (8192, 8192),
+    'gpt-4-32k': (32768, 8192),
+    'gpt-4-turbo': (128000, 4096),
+    'gpt-4-1106': (128000, 4096),
+    'gpt-4-0125': (128000, 4096),
+    'gpt-4o': (128000, 16384),
+    'gpt-4o-mini': (128000, 16384),
+    'gpt-4.1': (1047576, 32768),
+    'gpt-5': (400000, 128000),
+    'o1': (200000, 100000),
+    'o3': (200000, 100000),
+    'o4-mini': (200000, 100000),
+    'gemini-1.5-flash': (1048576, 8192),
+    'gemini-1.5-pro': (2097152, 8192),
+    'gemini-2.0-flash': (1048576, 8192),
+    'gemini-2.5': (1048576, 65536),
+    'gemini-flash-latest': (1048576, 65536),
+    'gemini-pro-latest': (1048576, 65536)
+}
+
+# OpenAI lists every model of the account; keep the ones that speak chat completions
+_OPENAI_CHAT_PREFIXES = ('gpt-', 'chatgpt-', 'o1', 'o3', 'o4')
+_OPENAI_NON_CHAT = ('instruct', 'audio', 'realtime', 'tts', 'transcribe', 'search', 'image')
+
+
+def known_limits(model):
+    """(context_window, max_output_tokens) from the table, or (None, None)"""
+    best = None
+    for prefix in KNOWN_LIMITS:
+        if model.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return KNOWN_LIMITS[best] if best else (None, None)
+
+
+def model_entry(model, text=None, context_window=None, max_output_tokens=None):
+    """Catalog entry; limits not given are filled in from KNOWN_LIMITS"""
+    known_context, known_output = known_limits(model)
+    return {
+        'value': model,
+        'text': text or DISPLAY_NAMES.get(model, model),
+        'context_window': context_window or known_context,
+        'max_output_tokens': max_output_tokens or known_output
+    }
+
+
+def _preferred_first(entries, provider):
+    """Default models in their usual order, then the rest alphabetically"""
+    order = {model: i for i, model in enumerate(DEFAULT_MODELS[provider])}
+    return sorted(entries, key=lambda e: (order.get(e['value'], len(order)), e['value']))
+
+
+def fetch_openai_models():
+    openai = get_client('openai')
+    models = openai.Model.list()
+    entries = [model_entry(item['id']) for item in models['data']
+               if item['id'].startswith(_OPENAI_CHAT_PREFIXES) and not any(tag in item['id'] for tag in _OPENAI_NON_CHAT)]
+    return _preferred_first(entries, 'openai')
+
+
+def fetch_google_models():
+    genai = get_client('google')
+    entries = []
+    for model in genai.list_models():
+        if 'generateContent' not in (model.supported_generation_methods or []):
+            continue
+        name = model.name.split('/', 1)[-1]
+        entries.append(model_entry(name, model.display_name, model.input_token_limit, model.output_token_limit))
+    return _preferred_first(entries, 'google')
+
+
+def fetch_local_models():
+    entries = []
+    for item in list_local_models():
+        # vLLM reports max_model_len; llama.cpp server reports meta.n_ctx_train
+        context = item.get('max_model_len') or (item.get('meta') or {}).get('n_ctx_train')
+        entries.append(model_entry(item['id'], context_window=context))
+    return sorted(entries, key=lambda e: e['value'])
+
+
+FETCHERS = {
+    'openai': fetch_openai_models,
+    'google': fetch_google_models,
+    'local': fetch_local_models
+}
+
+
+class ModelCatalog:
+    """Per-provider model lists with TTL, disk persistence and background refresh"""
+
+    def __init__(self, path=None, ttls=None, retry=60, max_age=300, fetchers=None):
+        self.path = path
+        self.ttls = ttls or {}
+        self.retry = retry
+        self.max_age = max_age
+        self.fetchers = fetchers or FETCHERS
+        self._lock = threading.Lock()
+        self._providers = {
+            provider: {'models': [model_entry(m) for m in DEFAULT_MODELS.get(provider, [])], 'fetched': 0.0,
+                       'source': 'default'}
+            for provider in self.fetchers
+        }
+        self._refreshing = set()
+        self._attempted = {}
+        self._errors = {}
+        self._body = None
+        self._etag = None
+        self.refreshes = 0
+        self.failures = 0
+        self._load()
+
+    def ttl(self, provider):
+        return self.ttls.get(provider, self.ttls.get('default', 3600))
+
+    # Reading
+
+    def snapshot(self):
+        """Current catalog as (JSON body, ETag); starts refreshes of stale providers, never blocks"""
+        self.refresh_stale()
+        with self._lock:
+            if self._body is None:
+                catalog = {provider: state['models'] for provider, state in self._providers.items()}
+                self._body = dumps(catalog)
+                self._etag = etag(self._body)
+            return self._body, self._etag
+
+    def cache_control(self):
+        return f'public, max-age={int(self.max_age)}, stale-while-revalidate={int(self.ttl("default"))}'
+
+    def lookup(self, provider, model):
+        """Catalog entry for a model, falling back to the known-limits table for unlisted ones"""
+        with self._lock:
+            models = self._providers.get(provider, {}).get('models', [])
+        for entry in models:
+            if entry['value'] == model:
+                return entry
+        return model_entry(model)
+
+    # Refreshing
+
+    def refresh_stale(self):
+        """Start a background refresh for every configured provider whose list is older than its TTL"""
+        now = time.time()
+        with self._lock:
+            stale = [
+                provider for provider, state in self._providers.items()
+                if provider not in self._refreshing
+                and now - state['fetched'] >= self.ttl(provider)
+                and now - self._attempted.get(provider, 0.0) >= self.retry
+                and configured(provider)
+            ]
+            for provider in stale:
+                self._refreshing.add(provider)
+                self._attempted[provider] = now
+        for provider in stale:
+            threading.Thread(target=self.refresh, args=(provider,), daemon=True,
+                             name=f'catalog-refresh-{provider}').start()
+
+    def refresh(self, provider):
+        """List a provider's models now; on failure the previous list stays in place"""
+        try:
+            models = self.fetchers[provider]()
+            if not models and DEFAULT_MODELS.get(provider):
+                raise ValueError('no chat models listed')
+        except Exception as e:
+            logger.warning(f"Could not refresh the {provider} model list: {e}")
+            with self._lock:
+                self.failures += 1
+                self._errors[provider] = str(e)
+            return False
+        finally:
+            with self._lock:
+                self._refreshing.discard(provider)
+
+        with self._lock:
+            self._providers[provider] = {'models': models, 'fetched': time.time(), 'source': 'live'}
+            self._errors.pop(provider, None)
+            self._body = None
+            self.refreshes += 1
+        self._save()
+        return True
+
+    # Persistence
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable model catalog {self.path}: {e}")
+            return
+        for provider, state in (saved.get('providers') or {}).items():
+            if provider in self._providers and isinstance(state.get('models'), list):
+                self._providers[provider] = {'models': state['models'], 'fetched': float(state.get('fetched', 0)),
+                                             'source': 'disk'}
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            saved = {'providers': {provider: {'models': state['models'], 'fetched': state['fetched']}
+                                   for provider, state in self._providers.items() if state['source'] != 'default'}}
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(saved, f)
+            os.replace(tmp_path, self.path)  # Atomic, so concurrent workers never read a partial file
+        except OSError as e:
+            logger.warning(f"Could not write model catalog {self.path}: {e}")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'providers': {
+                    provider: {
+                        'models': len(state['models']),
+                        'source': state['source'],
+                        'age_seconds': round(now - state['fetched'], 1) if state['fetched'] else None,
+                        'refreshing': provider in self._refreshing,
+                        'last_error': self._errors.get(provider)
+                    }
+                    for provider, state in self._providers.items()
+                }
+            }
+
+
+def create_model_catalog():
+    """Build the process-wide model catalog from environment settings"""
+    return ModelCatalog(
+        path=os.getenv('MODEL_CATALOG_FILE', os.path.join(tempfile.gettempdir(), 'llm_model_catalog.json')) or None,
+        ttls={
+            'default': float(os.getenv('MODEL_CATALOG_TTL', 3600)),
+            'local': float(os.getenv('MODEL_CATALOG_LOCAL_TTL', 60))
+        },
+        retry=float(os.getenv('MODEL_CATALOG_RETRY', 60)),
+        max_age=float(os.getenv('MODEL_CATALOG_MAX_AGE', 300))
+    )
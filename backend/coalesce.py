@@ -0,0 +1,302 @@
+"""
+Single-flight coalescing of identical in-flight chat requests.
+
+When several requests with the same key arrive while an upstream call for that
+key is still running, only the first one (the leader) reaches the provider; the
+others wait for and share its result. Streams are fanned out from a shared
+event buffer, so a follower that joins mid-stream first receives every event
+produced so far and then the rest as they arrive.
+
+A shared stream keeps running while anyone is subscribed; when the last
+subscriber leaves (client disconnect or abort) the upstream is closed, so the
+provider stops generating. If a leader's blocking call is cancelled, waiting
+followers run the call again themselves.
+
+Both thread-based (Flask, Vercel) and asyncio (ASGI gateway) callers are
+supported.
+
+    COALESCE_ENABLED   set to 'false' to disable coalescing (default true)
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from backend.cancellation import RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.future = Future()
+
+
+class _StreamCall:
+    def __init__(self, condition):
+        self.events = []
+        self.finished = False
+        self.condition = condition
+        self.subscribers = 0
+        self.abandoned = False
+        self.task = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into one upstream call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self._async_calls = {}
+        self._async_streams = {}
+        self.stats_counters = {
+            'leaders': 0,
+            'coalesced': 0,
+            'stream_leaders': 0,
+            'streams_coalesced': 0,
+            'streams_abandoned': 0
+        }
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self.stats_counters,
+                in_flight=len(self._calls) + len(self._async_calls),
+                streams_in_flight=len(self._streams) + len(self._async_streams)
+            )
+
+    def _count(self, name):
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    def _forget(self, calls, key, call):
+        """Remove a finished call unless a newer one already took its key; caller holds the lock"""
+        if calls.get(key) is call:
+            del calls[key]
+
+    # Blocking calls
+
+    def do(self, key, fn, token=None):
+        """Run fn() once for all concurrent callers with the same key.
+
+        A follower stops waiting when its own cancel token is cancelled.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.stats_counters['leaders'] += 1
+            else:
+                self.stats_counters['coalesced'] += 1
+
+        if not leader:
+            wait([call.future] if token is None else [call.future, token.future], return_when=FIRST_COMPLETED)
+            if not call.future.done():
+                token.check()
+            if isinstance(call.future.exception(), RequestCancelled):
+                # The leader's client gave up, not the provider; run the call for this one
+                return self.do(key, fn, token)
+            return call.future.result()
+
+        try:
+            result = fn()
+        except Exception as e:
+            with self._lock:
+                self._forget(self._calls, key, call)
+            call.future.set_exception(e)
+            raise
+        with self._lock:
+            self._forget(self._calls, key, call)
+        call.future.set_result(result)
+        return result
+
+    # Streams
+
+    def stream(self, key, factory, token=None):
+        """Share one upstream event stream between concurrent callers.
+
+        factory() is called only by the leader and must return an iterator of
+        normalised stream events; it may raise to reject the request up front.
+        A subscriber whose cancel token is cancelled stops receiving at once.
+        """
+        with self._lock:
+            call = self._streams.get(key)
+            leader = call is None
+            if leader:
+                call = _StreamCall(threading.Condition())
+                self._streams[key] = call
+                self.stats_counters['stream_leaders'] += 1
+            else:
+                self.stats_counters['streams_coalesced'] += 1
+            call.subscribers += 1
+
+        if leader:
+            try:
+                upstream = factory()
+            except Exception as e:
+                with self._lock:
+                    self._forget(self._streams, key, call)
+                with call.condition:
+                    # Followers that joined meanwhile get the leader's error, not an empty stream
+                    call.events.append({'type': 'error', 'error': str(e), 'exception': e})
+                    call.finished = True
+                    call.condition.notify_all()
+                raise
+            # Pump upstream in the background so one slow or departed client
+            # cannot stall the others; the leader's context goes along for tracing
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._pump, key, call, upstream), daemon=True).start()
+
+        return self._subscribe(key, call, token)
+
+    def _pump(self, key, call, upstream):
+        try:
+            for event in upstream:
+                with call.condition:
+                    call.events.append(event)
+                    call.condition.notify_all()
+                if call.abandoned:
+                    # Nobody is listening any more; closing the stream stops the provider generating
+                    close = getattr(upstream, 'close', None)
+                    if close is not None:
+                        close()
+                    break
+        except Exception as e:
+            logger.error(f"Coalesced stream error: {str(e)}")
+            with call.condition:
+                call.events.append({'type': 'error', 'error': str(e), 'exception': e})
+        finally:
+            with self._lock:
+                self._forget(self._streams, key, call)
+            with call.condition:
+                call.finished = True
+                call.condition.notify_all()
+
+    def _subscribe(self, key, call, token):
+        if token is not None:
+            token.on_cancel(lambda: _notify(call.condition))
+        index = 0
+        try:
+            while True:
+                with call.condition:
+                    while index >= len(call.events) and not call.finished and not (token and token.cancelled):
+                        call.condition.wait()
+                    if index >= len(call.events):
+                        return
+                    batch = call.events[index:]
+                    index = len(call.events)
+                for event in batch:
+                    if event['type'] == 'error':
+                        raise event['exception']
+                    yield event
+        finally:
+            self._leave(self._streams, key, call)
+
+    def _leave(self, streams, key, call):
+        """Drop a subscriber; the last one out of an unfinished stream abandons it"""
+        with self._lock:
+            call.subscribers -= 1
+            if call.subscribers or call.finished:
+                return
+            call.abandoned = True
+            self._forget(streams, key, call)  # New requests start a fresh upstream
+            self.stats_counters['streams_abandoned'] += 1
+        if call.task is not None:
+            call.task.cancel()
+
+    # Asyncio variants
+
+    async def do_async(self, key, coro_fn):
+        """Async counterpart of do(); coro_fn() returns an awaitable"""
+        future = self._async_calls.get(key)
+        if future is not None:
+            self._count('coalesced')
+            try:
+                return await asyncio.shield(future)
+            except RequestCancelled:
+                # The leader's client went away; run the call for this one
+                return await self.do_async(key, coro_fn)
+
+        future = asyncio.get_running_loop().create_future()
+        self._async_calls[key] = future
+        self._count('leaders')
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        except asyncio.CancelledError:
+            future.set_exception(RequestCancelled('Coalesced request was cancelled'))
+            future.exception()
+            raise
+        finally:
+            self._async_calls.pop(key, None)
+
+    def stream_async(self, key, factory):
+        """Async counterpart of stream(); factory() is a coroutine returning an async iterator"""
+        call = self._async_streams.get(key)
+        if call is None:
+            call = _StreamCall(asyncio.Condition())
+            self._async_streams[key] = call
+            self._count('stream_leaders')
+            call.task = asyncio.get_running_loop().create_task(self._pump_async(key, call, factory))
+        else:
+            self._count('streams_coalesced')
+        call.subscribers += 1
+        return self._subscribe_async(key, call)
+
+    async def _pump_async(self, key, call, factory):
+        try:
+            async for event in await factory():
+                async with call.condition:
+                    call.events.append(event)
+                    call.condition.notify_all()
+        except Exception as e:
+            logger.error(f"Coalesced stream error: {str(e)}")
+            async with call.condition:
+                call.events.append({'type': 'error', 'error': str(e), 'exception': e})
+        finally:
+            self._forget(self._async_streams, key, call)
+            async with call.condition:
+                call.finished = True
+                call.condition.notify_all()
+
+    async def _subscribe_async(self, key, call):
+        # Cancelling the subscribing task (client disconnect or abort) leaves the stream
+        index = 0
+        try:
+            while True:
+                async with call.condition:
+                    while index >= len(call.events) and not call.finished:
+                        await call.condition.wait()
+                    if index >= len(call.events):
+                        return
+                    batch = call.events[index:]
+                    index = len(call.events)
+                for event in batch:
+                    if event['type'] == 'error':
+                        raise event['exception']
+                    yield event
+        finally:
+            self._leave(self._async_streams, key, call)
+
+
+def _notify(condition):
+    with condition:
+        condition.notify_all()
+
+
+def create_coalescer():
+    """Build the process-wide coalescer, or None if disabled"""
+    if os.getenv('COALESCE_ENABLED', 'true').lower() == 'false':
+        return None
+    return SingleFlight()
@@ -0,0 +1,109 @@
+"""
+Concurrent fan-out of one prompt to several models.
+
+Each target runs on its own worker thread so the total wait is the slowest
+model rather than the sum of all of them. Results are yielded as normalised
+events in completion order:
+
+    {'type': 'delta', 'index': i, 'text': '...'}     # token mode only
+    {'type': 'result', 'index': i, 'provider': ..., 'model': ..., 'response': ...,
+     'latency_ms': ..., 'ttft_ms': ..., 'completion_tokens': ..., 'served_by': ..., 'error': ...}
+    {'type': 'done', 'total_ms': ..., 'sum_latency_ms': ..., 'targets': n}
+"""
+import queue
+import threading
+import time
+
+from backend.sessions import estimate_tokens
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def _result(index, target, response=None, latency_ms=None, ttft_ms=None, usage=None, cached=False, served_by=None, error=None):
+    usage = usage or {}
+    completion_tokens = usage.get('completion_tokens')
+    return {
+        'type': 'result',
+        'index': index,
+        'provider': target['provider'],
+        'model': target['model'],
+        'response': response,
+        'latency_ms': latency_ms,
+        'ttft_ms': ttft_ms,
+        'completion_tokens': completion_tokens if completion_tokens is not None else estimate_tokens(response),
+        'prompt_tokens': usage.get('prompt_tokens'),
+        'cached': cached,
+        'served_by': served_by,
+        'error': error
+    }
+
+
+def _run_targets(targets, worker):
+    """Start one thread per target and yield queued events until every target reported a result"""
+    events = queue.Queue()
+    start = time.perf_counter()
+    for index, target in enumerate(targets):
+        threading.Thread(target=worker, args=(index, target, events), daemon=True).start()
+
+    latencies = []
+    remaining = len(targets)
+    while remaining:
+        event = events.get()
+        if event['type'] == 'result':
+            remaining -= 1
+            latencies.append(event['latency_ms'] or 0)
+        yield event
+
+    yield {
+        'type': 'done',
+        'targets': len(targets),
+        'total_ms': _elapsed_ms(start),
+        'sum_latency_ms': round(sum(latencies), 1)
+    }
+
+
+def compare_results(targets, complete):
+    """Fan out complete(target) -> (response, usage, cache_hit, served_by) and yield each result as it finishes"""
+    def worker(index, target, events):
+        start = time.perf_counter()
+        try:
+            response, usage, cache_hit, served_by = complete(target)
+            result = _result(index, target, response, _elapsed_ms(start), usage=usage, served_by=served_by)
+            if cache_hit:
+                result.update(cache_hit)
+            events.put(result)
+        except Exception as e:
+            events.put(_result(index, target, latency_ms=_elapsed_ms(start), error=str(e)))
+
+    return _run_targets(targets, worker)
+
+
+def compare_streams(targets, open_stream):
+    """Fan out open_stream(target) -> stream events, forwarding tokens tagged with the target index"""
+    def worker(index, target, events):
+        start = time.perf_counter()
+        ttft_ms = None
+        parts = []
+        usage = {}
+        cache_hit = {}
+        served_by = None
+        try:
+            for event in open_stream(target):
+                if event['type'] == 'delta':
+                    if ttft_ms is None:
+                        ttft_ms = _elapsed_ms(start)
+                    parts.append(event['text'])
+                    events.put({'type': 'delta', 'index': index, 'text': event['text']})
+                elif event['type'] == 'done':
+                    usage = event.get('usage') or {}
+                    cache_hit = {field: event[field] for field in ('cached', 'similarity') if field in event}
+                    served_by = event.get('served_by')
+            result = _result(index, target, ''.join(parts), _elapsed_ms(start), ttft_ms, usage, served_by=served_by)
+            result.update(cache_hit)
+            events.put(result)
+        except Exception as e:
+            events.put(_result(index, target, ''.join(parts) or None, _elapsed_ms(start), ttft_ms, error=str(e)))
+
+    return _run_targets(targets, worker)
@@ -0,0 +1,324 @@
+"""
+Async provider gateway with one pooled keep-alive HTTP client per provider.
+
+The synchronous SDK calls in app.py hold a worker thread for the whole
+round-trip. This gateway talks to the providers' REST APIs directly through
+httpx.AsyncClient so a single event loop can keep hundreds of completions in
+flight, reusing TCP/TLS connections from a bounded pool.
+
+Pool limits and timeouts are configured through environment variables:
+
+    GATEWAY_MAX_CONNECTIONS     total connections per provider (default 200)
+    GATEWAY_MAX_KEEPALIVE       idle keep-alive connections kept (default 50)
+    GATEWAY_KEEPALIVE_EXPIRY    seconds an idle connection is kept (default 30)
+    GATEWAY_CONNECT_TIMEOUT     connect timeout in seconds (default 5)
+    GATEWAY_READ_TIMEOUT        read timeout in seconds (default 120)
+    GOOGLE_BASE_URL             Gemini REST base URL (default: GOOGLE_API_ENDPOINT's, or Google's)
+"""
+import json
+import logging
+import os
+
+import httpx
+
+from backend.providers import PROVIDER_NAMES, PROVIDERS, api_key, configured, google_api_base
+from backend.providers import build_messages  # noqa: F401 (re-exported)
+
+logger = logging.getLogger(__name__)
+
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+GOOGLE_BASE_URL = os.getenv('GOOGLE_BASE_URL') or google_api_base()
+LOCAL_BASE_URL = os.getenv('LOCAL_BASE_URL')
+
+# Statuses Gemini answers a reference to a cached content that no longer exists with
+CACHE_MISSING = (403, 404)
+
+
+class ProviderError(Exception):
+    """Error returned by a provider, keeping the HTTP status for callers"""
+
+    def __init__(self, provider, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def gateway_config():
+    """Read pool limits and timeouts from the environment"""
+    return {
+        'max_connections': int(os.getenv('GATEWAY_MAX_CONNECTIONS', 200)),
+        'max_keepalive': int(os.getenv('GATEWAY_MAX_KEEPALIVE', 50)),
+        'keepalive_expiry': float(os.getenv('GATEWAY_KEEPALIVE_EXPIRY', 30)),
+        'connect_timeout': float(os.getenv('GATEWAY_CONNECT_TIMEOUT', 5)),
+        'read_timeout': float(os.getenv('GATEWAY_READ_TIMEOUT', 120))
+    }
+
+
+class ProviderGateway:
+    """Async chat completions for OpenAI, Google AI and local servers over pooled HTTP clients"""
+
+    def __init__(self, config=None):
+        self.config = config or gateway_config()
+        self.api_keys = {provider: api_key(provider) for provider in PROVIDERS}
+        self.configured = {provider: configured(provider) for provider in PROVIDERS}
+        self.base_urls = {
+            'openai': OPENAI_BASE_URL,
+            'google': GOOGLE_BASE_URL,
+            'local': LOCAL_BASE_URL
+        }
+        self._clients = {}
+
+    def available_providers(self):
+        return [name for name, ok in self.configured.items() if ok]
+
+    def client(self, provider):
+        """Return the pooled client for a provider, creating it on first use"""
+        if provider not in self._clients:
+            limits = httpx.Limits(
+                max_connections=self.config['max_connections'],
+                max_keepalive_connections=self.config['max_keepalive'],
+                keepalive_expiry=self.config['keepalive_expiry']
+            )
+            timeout = httpx.Timeout(
+                self.config['read_timeout'],
+                connect=self.config['connect_timeout']
+            )
+            self._clients[provider] = httpx.AsyncClient(
+                base_url=self.base_urls[provider],
+                limits=limits,
+                timeout=timeout,
+                headers=self._auth_headers(provider)
+            )
+        return self._clients[provider]
+
+    async def aclose(self):
+        """Close all pooled connections"""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients = {}
+
+    def _auth_headers(self, provider):
+        if provider == 'google':
+            return {'x-goog-api-key': self.api_keys['google'] or ''}
+        key = self.api_keys[provider]
+        return {'Authorization': f"Bearer {key}"} if key else {}
+
+    def _require(self, provider):
+        if provider not in self.configured:
+            raise ValueError(f"Unsupported provider: {provider}")
+        if not self.configured[provider]:
+            if provider == 'local':
+                raise ProviderError(provider, "Local model client not initialized. Please set LOCAL_BASE_URL.")
+            raise ProviderError(provider, f"{PROVIDER_NAMES[provider]} client not initialized. Please check your API key.")
+
+    # Request builders
+
+    def _openai_body(self, model, messages, temperature, max_tokens, top_p, seed, stream=False, prefix=None):
+        body = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p
+        }
+        if seed:
+            body["seed"] = int(seed)
+        if prefix is not None:
+            body["prompt_cache_key"] = prefix.key
+        if stream:
+            body["stream"] = True
+            body["stream_options"] = {"include_usage": True}
+        return body
+
+    async def _raise_for_status(self, provider, response):
+        if response.status_code < 400:
+            return
+        await response.aread()
+        try:
+            detail = response.json().get('error', {}).get('message') or response.text
+        except ValueError:
+            detail = response.text
+        raise ProviderError(
+            provider,
+            f"{PROVIDER_NAMES[provider]} API error: {detail}",
+            status_code=response.status_code,
+            retry_after=response.headers.get('Retry-After')
+        )
+
+    # Completions
+
+    async def chat(self, provider, model, messages, temperature, max_tokens, top_p, seed, prefix=None):
+        """Run a completion and return {'text', 'finish_reason', 'usage'}.
+
+        prefix is the system prompt's entry in backend.prefix_cache, if any: OpenAI
+        requests carry its key, Gemini requests reference its cached content.
+        """
+        self._require(provider)
+        client = self.client(provider)
+
+        if provider != 'google':  # OpenAI and OpenAI-compatible local servers
+            body = self._openai_body(model, messages, temperature, max_tokens, top_p, seed, prefix=prefix)
+            response = await client.post('/chat/completions', json=body)
+            await self._raise_for_status(provider, response)
+            data = response.json()
+            choice = data['choices'][0]
+            result = {
+                'text': choice['message']['content'],
+                'finish_reason': choice.get('finish_reason'),
+                'usage': _openai_usage(data.get('usage'))
+            }
+        else:
+            cached_content = prefix.name if prefix is not None else None
+            url = f'/models/{model}:generateContent'
+            response = await client.post(url, json=google_body(messages, temperature, max_tokens, top_p, seed, cached_content))
+            if cached_content and response.status_code in CACHE_MISSING:
+                # Expired or deleted on Google's side: send the system prompt itself
+                prefix.invalidate()
+                response = await client.post(url, json=google_body(messages, temperature, max_tokens, top_p, seed))
+            await self._raise_for_status(provider, response)
+            data = response.json()
+            text, finish_reason = google_candidate(data)
+            result = {
+                'text': text,
+                'finish_reason': finish_reason,
+                'usage': google_usage(data.get('usageMetadata'))
+            }
+        if prefix is not None:
+            prefix.record(result['usage'])
+        return result
+
+    async def stream(self, provider, model, messages, temperature, max_tokens, top_p, seed, prefix=None):
+        """Stream a completion as normalised delta/done events (see backend.streaming)"""
+        self._require(provider)
+        client = self.client(provider)
+
+        cached_content = None
+        if provider != 'google':
+            body = self._openai_body(model, messages, temperature, max_tokens, top_p, seed, stream=True, prefix=prefix)
+            url = '/chat/completions'
+            params = None
+        else:
+            cached_content = prefix.name if prefix is not None else None
+            body = google_body(messages, temperature, max_tokens, top_p, seed, cached_content)
+            url = f'/models/{model}:streamGenerateContent'
+            params = {'alt': 'sse'}
+
+        finish_reason = None
+        usage = None
+        response = await client.send(client.build_request('POST', url, json=body, params=params), stream=True)
+        try:
+            if cached_content and response.status_code in CACHE_MISSING:
+                await response.aclose()
+                prefix.invalidate()
+                body = google_body(messages, temperature, max_tokens, top_p, seed)
+                response = await client.send(client.build_request('POST', url, json=body, params=params), stream=True)
+            await self._raise_for_status(provider, response)
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    break
+                chunk = json.loads(payload)
+
+                if provider != 'google':
+                    if chunk.get('usage'):
+                        usage = _openai_usage(chunk['usage'])
+                    if not chunk.get('choices'):
+                        continue
+                    choice = chunk['choices'][0]
+                    text = (choice.get('delta') or {}).get('content')
+                    finish_reason = choice.get('finish_reason') or finish_reason
+                else:
+                    if chunk.get('usageMetadata'):
+                        usage = google_usage(chunk['usageMetadata'])
+                    text, reason = google_candidate(chunk, fallback=None)
+                    finish_reason = reason or finish_reason
+
+                if text:
+                    yield {'type': 'delta', 'text': text}
+        finally:
+            await response.aclose()
+
+        if prefix is not None:
+            prefix.record(usage)
+        yield {
+            'type': 'done',
+            'finish_reason': finish_reason,
+            'usage': dict(usage or {}, temperature=temperature, max_tokens=max_tokens, top_p=top_p)
+        }
+
+
+def google_body(messages, temperature, max_tokens, top_p, seed, cached_content=None):
+    """Gemini REST request body; with cached_content the system prompt comes from the cache instead"""
+    contents = []
+    system_parts = []
+    for msg in messages:
+        if msg['role'] == 'system':
+            system_parts.append({'text': msg['content']})
+        else:
+            role = 'model' if msg['role'] == 'assistant' else 'user'
+            contents.append({'role': role, 'parts': [{'text': msg['content']}]})
+
+    generation_config = {
+        'temperature': temperature,
+        'maxOutputTokens': max_tokens,
+        'topP': top_p
+    }
+    if seed:
+        generation_config['seed'] = int(seed)
+
+    body = {'contents': contents, 'generationConfig': generation_config}
+    if cached_content:
+        body['cachedContent'] = cached_content
+    elif system_parts:
+        body['systemInstruction'] = {'parts': system_parts}
+    return body
+
+
+def _openai_usage(usage):
+    if not usage:
+        return {}
+    result = {
+        'prompt_tokens': usage.get('prompt_tokens'),
+        'completion_tokens': usage.get('completion_tokens'),
+        'total_tokens': usage.get('total_tokens')
+    }
+    cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+    if cached is not None:
+        result['cached_tokens'] = cached
+    return result
+
+
+def google_usage(usage):
+    if not usage:
+        return {}
+    result = {
+        'prompt_tokens': usage.get('promptTokenCount'),
+        'completion_tokens': usage.get('candidatesTokenCount'),
+        'total_tokens': usage.get('totalTokenCount')
+    }
+    if usage.get('cachedContentTokenCount') is not None:
+        result['cached_tokens'] = usage['cachedContentTokenCount']
+    return result
+
+
+def google_candidate(data, fallback="Sorry, I couldn't generate a response. Please try again."):
+    """Extract (text, finish_reason) from a Gemini REST response"""
+    candidates = data.get('candidates') or []
+    if not candidates:
+        return fallback, None
+
+    candidate = candidates[0]
+    finish_reason = candidate.get('finishReason')
+    parts = (candidate.get('content') or {}).get('parts') or []
+    text = ''.join(part.get('text', '') for part in parts)
+    if text:
+        return text, finish_reason
+
+    if finish_reason == 'SAFETY':
+        return "I'm sorry, but I can't provide a response to that request due to safety guidelines.", finish_reason
+    if finish_reason == 'RECITATION':
+        return "I'm sorry, but I can't provide a response to that request due to content policy restrictions.", finish_reason
+    return fallback, finish_reason
@@ -0,0 +1,334 @@
+"""
+Server-side chat history: SQLite storage with an FTS5 full-text index.
+
+Messages are append-only. Request handlers only put them on a queue; one
+writer thread drains it and commits everything queued so far in a single
+transaction, so bursts of saves cost one fsync instead of one each and never
+hold a request on disk I/O. Conversation listing is keyset-paginated on
+(updated_at, id), so every page costs the same however many conversations are
+stored, and search is an FTS5 match ranked by bm25 (a LIKE scan when the
+SQLite build lacks FTS5).
+
+Every conversation belongs to the client that created it: the frontend keeps a
+random client id in localStorage and sends it as X-Client-ID, and all reads
+and writes are scoped to it, so one browser never lists, searches, appends to
+or deletes another's chats. The id is a bearer token, not an account; anyone
+holding it sees that client's history. Conversations stored before scoping
+have no owner and are no longer listed.
+
+    HISTORY_ENABLED      set to 'false' to disable the history endpoints (default true)
+    HISTORY_DB           SQLite file (default <tmp>/llm_history.db)
+    HISTORY_BATCH_SIZE   max queued writes committed per transaction (default 500)
+    HISTORY_QUEUE_SIZE   max writes waiting for the writer; further saves are rejected (default 10000)
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('user', 'assistant', 'system')
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS conversations ('
+    ' id TEXT PRIMARY KEY, title TEXT, provider TEXT, model TEXT, params TEXT,'
+    ' created_at REAL NOT NULL, updated_at REAL NOT NULL, message_count INTEGER NOT NULL DEFAULT 0, owner TEXT)',
+    'CREATE TABLE IF NOT EXISTS messages ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL,'
+    ' role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, id)'
+)
+
+# Applied after the owner column exists, which databases from before scoping lack
+_OWNER_SCHEMA = (
+    'DROP INDEX IF EXISTS conversations_updated',
+    'CREATE INDEX IF NOT EXISTS conversations_owner_updated ON conversations (owner, updated_at, id)'
+)
+
+# External-content FTS table over messages.content, kept in sync by triggers
+_FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    " content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    'CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN'
+    ' INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END',
+    'CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN'
+    " INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END"
+)
+
+
+def fts_query(text):
+    """Quote each term so user input never reaches FTS5 as query syntax; the last term matches as a prefix"""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if not terms:
+        return None
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def encode_cursor(updated_at, conversation_id):
+    return f'{updated_at!r}:{conversation_id}'
+
+
+def decode_cursor(cursor):
+    """(updated_at, id) from a listing cursor; raises ValueError for malformed ones"""
+    updated_at, separator, conversation_id = cursor.partition(':')
+    if not separator:
+        raise ValueError('Invalid cursor')
+    return float(updated_at), conversation_id
+
+
+class HistoryStore:
+    """Conversation history in SQLite with batched background writes"""
+
+    def __init__(self, path, batch_size=500, queue_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer = None
+        self.stats_counters = {'queued': 0, 'written': 0, 'batches': 0, 'dropped': 0, 'rejected': 0, 'write_errors': 0}
+
+        self._db = self._connect()
+        self.fts = self._create_schema()
+        atexit.register(self.flush, timeout=5)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')  # Readers never wait for the writer
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def _create_schema(self):
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(conversations)')]
+        if 'owner' not in columns:
+            self._db.execute('ALTER TABLE conversations ADD COLUMN owner TEXT')
+        for statement in _OWNER_SCHEMA:
+            self._db.execute(statement)
+        try:
+            for statement in _FTS_SCHEMA:
+                self._db.execute(statement)
+            fts = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite FTS5 unavailable, history search falls back to LIKE: {e}")
+            fts = False
+        self._db.commit()
+        return fts
+
+    # Writing
+
+    def append(self, owner, conversation_id, messages, title=None, provider=None, model=None, params=None):
+        """Queue messages for one of owner's conversations; returns False if the write queue is full.
+
+        Messages for a conversation id that another owner already uses are
+        discarded by the writer (counted as rejected).
+        """
+        return self._enqueue(('append', owner, conversation_id, messages, title, provider, model, params, time.time()))
+
+    def delete(self, owner, conversation_id):
+        """Queue removal of one of owner's conversations and its messages"""
+        return self._enqueue(('delete', owner, conversation_id))
+
+    def _enqueue(self, op):
+        self._start_writer()
+        try:
+            self._queue.put_nowait(op)
+        except queue.Full:
+            with self._lock:
+                self.stats_counters['dropped'] += 1
+                dropped = self.stats_counters['dropped']
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning(f"History write queue full, {dropped} writes dropped so far")
+            return False
+        with self._lock:
+            self.stats_counters['queued'] += 1
+        return True
+
+    def _start_writer(self):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run, daemon=True, name='history-writer')
+                    self._writer.start()
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            # Group commit: take whatever has queued up behind the first write
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with db:
+                    rejected = sum(1 for op in batch if not self._apply(db, op))
+                with self._lock:
+                    self.stats_counters['written'] += len(batch) - rejected
+                    self.stats_counters['rejected'] += rejected
+                    self.stats_counters['batches'] += 1
+            except sqlite3.Error as e:
+                logger.error(f"History write of {len(batch)} operations failed: {e}")
+                with self._lock:
+                    self.stats_counters['write_errors'] += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _apply(self, db, op):
+        """Apply one queued write; False when the conversation belongs to another owner"""
+        if op[0] == 'delete':
+            _, owner, conversation_id = op
+            if db.execute('DELETE FROM conversations WHERE id = ? AND owner = ?', (conversation_id, owner)).rowcount:
+                db.execute('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
+            return True
+
+        _, owner, conversation_id, messages, title, provider, model, params, now = op
+        upserted = db.execute(
+            'INSERT INTO conversations (id, title, provider, model, params, created_at, updated_at, message_count, owner)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+            ' ON CONFLICT (id) DO UPDATE SET'
+            ' title = COALESCE(conversations.title, excluded.title),'
+            ' provider = COALESCE(excluded.provider, conversations.provider),'
+            ' model = COALESCE(excluded.model, conversations.model),'
+            ' params = COALESCE(excluded.params, conversations.params),'
+            ' updated_at = excluded.updated_at,'
+            ' message_count = conversations.message_count + excluded.message_count'
+            ' WHERE conversations.owner = excluded.owner',
+            (conversation_id, title, provider, model, json.dumps(params) if params is not None else None,
+             now, now, len(messages), owner)
+        ).rowcount
+        if not upserted:
+            return False
+        db.executemany(
+            'INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)',
+            [(conversation_id, message['role'], message['content'], now) for message in messages]
+        )
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until queued writes are committed (or the timeout passes)"""
+        if self._writer is None:
+            return
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(0.01)
+
+    # Reading
+
+    def list_conversations(self, owner, limit=50, cursor=None):
+        """owner's newest conversations first as (conversations, next_cursor)"""
+        sql = 'SELECT id, title, provider, model, created_at, updated_at, message_count FROM conversations WHERE owner = ?'
+        args = [owner]
+        if cursor:
+            updated_at, conversation_id = decode_cursor(cursor)
+            sql += ' AND (updated_at, id) < (?, ?)'
+            args += [updated_at, conversation_id]
+        sql += ' ORDER BY updated_at DESC, id DESC LIMIT ?'
+        args.append(limit + 1)
+        with self._read_lock:
+            rows = self._db.execute(sql, args).fetchall()
+
+        conversations = [_conversation(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = conversations[-1]
+            next_cursor = encode_cursor(last['updated_at'], last['id'])
+        return conversations, next_cursor
+
+    def get_conversation(self, owner, conversation_id, limit=200, before=None):
+        """(conversation, messages oldest first, next_before) for the newest messages, or None"""
+        with self._read_lock:
+            row = self._db.execute(
+                'SELECT id, title, provider, model, created_at, updated_at, message_count, params'
+                ' FROM conversations WHERE id = ? AND owner = ?', (conversation_id, owner)
+            ).fetchone()
+            if row is None:
+                return None
+            sql = 'SELECT id, role, content, created_at FROM messages WHERE conversation_id = ?'
+            args = [conversation_id]
+            if before is not None:
+                sql += ' AND id < ?'
+                args.append(before)
+            sql += ' ORDER BY id DESC LIMIT ?'
+            args.append(limit + 1)
+            rows = self._db.execute(sql, args).fetchall()
+
+        conversation = _conversation(row)
+        conversation['params'] = json.loads(row[7]) if row[7] else None
+        messages = [{'id': r[0], 'role': r[1], 'content': r[2], 'created_at': r[3]} for r in rows[:limit]]
+        next_before = messages[-1]['id'] if len(rows) > limit else None
+        return conversation, messages[::-1], next_before
+
+    def search(self, owner, text, limit=20, offset=0):
+        """Best-matching messages in owner's conversations as (results, next_offset)"""
+        if self.fts:
+            match = fts_query(text)
+            if match is None:
+                return [], None
+            sql = ("SELECT m.conversation_id, c.title, m.id, m.role, c.updated_at,"
+                   " snippet(messages_fts, 0, '<mark>', '</mark>', '…', 16)"
+                   " FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+                   " JOIN conversations c ON c.id = m.conversation_id"
+                   " WHERE messages_fts MATCH ? AND c.owner = ? ORDER BY rank LIMIT ? OFFSET ?")
+            args = (match, owner, limit + 1, offset)
+        else:
+            text = text.strip()
+            if not text:
+                return [], None
+            pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            sql = ("SELECT m.conversation_id, c.title, m.id, m.role, c.updated_at, substr(m.content, 1, 200)"
+                   " FROM messages m JOIN conversations c ON c.id = m.conversation_id"
+                   " WHERE m.content LIKE ? ESCAPE '\\' AND c.owner = ? ORDER BY m.id DESC LIMIT ? OFFSET ?")
+            args = (pattern, owner, limit + 1, offset)
+
+        with self._read_lock:
+            rows = self._db.execute(sql, args).fetchall()
+        results = [
+            {'conversation_id': r[0], 'title': r[1], 'message_id': r[2], 'role': r[3], 'updated_at': r[4], 'snippet': r[5]}
+            for r in rows[:limit]
+        ]
+        return results, offset + limit if len(rows) > limit else None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counters, pending=self._queue.qsize(), fts=self.fts)
+
+
+def _conversation(row):
+    return {
+        'id': row[0],
+        'title': row[1],
+        'provider': row[2],
+        'model': row[3],
+        'created_at': row[4],
+        'updated_at': row[5],
+        'message_count': row[6]
+    }
+
+
+def create_history_store():
+    """Build the process-wide history store from environment settings, or None if disabled"""
+    if os.getenv('HISTORY_ENABLED', 'true').lower() == 'false':
+        return None
+    path = os.getenv('HISTORY_DB') or os.path.join(tempfile.gettempdir(), 'llm_history.db')
+    try:
+        return HistoryStore(
+            path,
+            batch_size=int(os.getenv('HISTORY_BATCH_SIZE', 500)),
+            queue_size=int(os.getenv('HISTORY_QUEUE_SIZE', 10000))
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"Chat history disabled, cannot open {path}: {e}")
+        return None
@@ -0,0 +1,265 @@
+"""
+Asynchronous chat jobs for generations that outlive a request.
+
+POST /api/jobs returns a job id at once; the completion runs on a bounded
+worker pool and its state (queued, running, succeeded, failed, cancelled), the
+partial text generated so far and the final result are kept in SQLite. Any worker
+process sharing the file can answer polls, and results stay readable for
+JOBS_TTL seconds after a job finishes. Progress is written at most every
+JOBS_PROGRESS_INTERVAL seconds per job, and the text is only joined for those
+writes, so a fast stream turns into neither a write nor a copy per token.
+DELETE /api/jobs/<id> cancels a queued or running job in the process that runs
+it, closing its provider stream; other processes answer JobNotRunningHere.
+
+    JOBS_ENABLED             set to 'false' to disable the job endpoints (default true)
+    JOBS_DB                  SQLite file for job state (default <tmp>/llm_jobs.db)
+    JOBS_WORKERS             concurrent jobs per process (default 8)
+    JOBS_MAX_PENDING         queued + running jobs per process before submissions get 503 (default 1000)
+    JOBS_TTL                 seconds a finished job is kept (default 3600)
+    JOBS_PROGRESS_INTERVAL   seconds between progress writes of a running job (default 0.5)
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.cancellation import CancelRegistry, RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS jobs ('
+    ' id TEXT PRIMARY KEY, state TEXT NOT NULL, params TEXT NOT NULL, text TEXT NOT NULL DEFAULT \'\','
+    ' result TEXT, error TEXT, created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL,'
+    ' finished_at REAL, expires_at REAL)',
+    'CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires_at)'
+)
+
+
+class JobsBusy(Exception):
+    """Raised when a process already has JOBS_MAX_PENDING jobs queued or running"""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobNotRunningHere(Exception):
+    """Raised when cancelling a job that is queued or running in another worker process"""
+
+
+class JobManager:
+    """Runs jobs on a thread pool and keeps their state in SQLite"""
+
+    def __init__(self, path, run, workers=8, max_pending=1000, ttl=3600, progress_interval=0.5, cancellations=None):
+        self.path = path
+        # run(params, progress, token) -> result dict; progress(parts) reports the text pieces generated so far
+        # (a list the caller keeps appending to), token is the job's CancelToken and run raises RequestCancelled
+        # once it is cancelled
+        self.run = run
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.progress_interval = progress_interval
+        self.cancellations = cancellations or CancelRegistry()  # Jobs are registered under their job id
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = 0
+        self._next_cleanup = 0.0
+        self.stats_counters = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'cancelled': 0, 'rejected': 0,
+                               'expired': 0}
+
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def _write(self, sql, args):
+        with self._lock:
+            self._db.execute(sql, args)
+            self._db.commit()
+            self._changed.notify_all()
+
+    # Submitting and running
+
+    def submit(self, params):
+        """Queue a job and return its id; raises JobsBusy when the pool is saturated"""
+        now = time.time()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats_counters['rejected'] += 1
+                raise JobsBusy(f'Too many pending jobs ({self._pending}), try again later')
+            self._pending += 1
+            self.stats_counters['submitted'] += 1
+
+        job_id = uuid.uuid4().hex
+        self._write('INSERT INTO jobs (id, state, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                    (job_id, 'queued', json.dumps(params), now, now))
+        token = self.cancellations.register(job_id)
+        self._executor.submit(self._execute, job_id, params, token)
+        self._cleanup(now)
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job of this process; raises JobNotRunningHere if another process runs it"""
+        if not self.cancellations.cancel(job_id):
+            raise JobNotRunningHere(f'Job {job_id} is not running on this worker process (pid {os.getpid()}); '
+                                    'only the worker running it can cancel it')
+
+    def _execute(self, job_id, params, token):
+        last_write = 0.0
+
+        def progress(parts):
+            nonlocal last_write
+            now = time.monotonic()
+            if now - last_write >= self.progress_interval:
+                last_write = now
+                self._write('UPDATE jobs SET text = ?, updated_at = ? WHERE id = ?', (''.join(parts), time.time(), job_id))
+
+        text, error = None, None  # On failure the last progress text is kept
+        try:
+            token.check()  # Cancelled while still queued
+            started = time.time()
+            self._write("UPDATE jobs SET state = 'running', started_at = ?, updated_at = ? WHERE id = ?",
+                        (started, started, job_id))
+            result = self.run(params, progress, token)
+            state, text = 'succeeded', result.get('response') or ''
+        except RequestCancelled as e:
+            state, result, error = 'cancelled', None, str(e)
+        except Exception as e:
+            logger.warning(f"Job {job_id} failed: {e}")
+            state, result, error = 'failed', None, str(e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self.cancellations.unregister(token)
+
+        finished = time.time()
+        self._write(
+            'UPDATE jobs SET state = ?, text = COALESCE(?, text), result = ?, error = ?, updated_at = ?,'
+            ' finished_at = ?, expires_at = ? WHERE id = ?',
+            (state, text, json.dumps(result) if result is not None else None, error, finished, finished,
+             finished + self.ttl, job_id)
+        )
+        with self._lock:
+            self.stats_counters[state] += 1
+
+    def _cleanup(self, now):
+        """Delete expired jobs, and unfinished ones silent for a whole TTL (their process died), at most once a minute"""
+        with self._lock:
+            if now < self._next_cleanup:
+                return
+            self._next_cleanup = now + 60
+            deleted = self._db.execute(
+                'DELETE FROM jobs WHERE expires_at < ? OR (finished_at IS NULL AND updated_at < ?)', (now, now - self.ttl)
+            ).rowcount
+            self._db.commit()
+            self.stats_counters['expired'] += deleted
+
+    # Reading
+
+    def get(self, job_id):
+        """Job state as a dict, or None if unknown or expired"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id, state, params, text, result, error, created_at, started_at, updated_at, finished_at,'
+                ' expires_at FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None or (row[10] is not None and row[10] < time.time()):
+            return None
+
+        params = json.loads(row[2])
+        job = {
+            'id': row[0],
+            'state': row[1],
+            'provider': params['provider'],
+            'model': params['model'],
+            'text': row[3],
+            'created_at': row[6],
+            'started_at': row[7],
+            'updated_at': row[8],
+            'finished_at': row[9],
+            'expires_at': row[10]
+        }
+        if row[4] is not None:
+            job['result'] = json.loads(row[4])
+        if row[5] is not None:
+            job['error'] = row[5]
+        return job
+
+    def wait(self, job_id, since, timeout):
+        """Block until the job changed after `since`, finished or the timeout passed; returns the job.
+
+        Updates from this process wake the waiter at once; jobs run by another
+        process are picked up by re-reading at least once a second.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['state'] in FINISHED or job['updated_at'] > since:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._lock:
+                self._changed.wait(min(remaining, 1.0))
+
+    def events(self, job_id):
+        """Yield state/delta events while a job runs, then done (or error) like a chat stream"""
+        sent = 0
+        since = 0.0
+        state = None
+        while True:
+            job = self.wait(job_id, since, 15)
+            if job is None:
+                yield {'type': 'error', 'error': 'Job not found or expired'}
+                return
+            since = job['updated_at']
+            if len(job['text']) > sent:
+                yield {'type': 'delta', 'text': job['text'][sent:]}
+                sent = len(job['text'])
+            if job['state'] != state:
+                state = job['state']
+                yield {'type': 'state', 'state': state, 'job_id': job_id}
+            if job['state'] == 'succeeded':
+                result = job['result']
+                yield dict({key: value for key, value in result.items() if key != 'response'}, type='done', job_id=job_id)
+                return
+            if job['state'] in ('failed', 'cancelled'):
+                yield {'type': 'error', 'error': job['error'], 'job_id': job_id}
+                return
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counters, pending=self._pending, workers=self.workers, max_pending=self.max_pending,
+                        ttl=self.ttl)
+
+
+def create_job_manager(run, cancellations=None):
+    """Build the process-wide job manager from environment settings, or None if disabled"""
+    if os.getenv('JOBS_ENABLED', 'true').lower() == 'false':
+        return None
+    path = os.getenv('JOBS_DB') or os.path.join(tempfile.gettempdir(), 'llm_jobs.db')
+    try:
+        return JobManager(
+            path,
+            run,
+            workers=int(os.getenv('JOBS_WORKERS', 8)),
+            max_pending=int(os.getenv('JOBS_MAX_PENDING', 1000)),
+            ttl=float(os.getenv('JOBS_TTL', 3600)),
+            progress_interval=float(os.getenv('JOBS_PROGRESS_INTERVAL', 0.5)),
+            cancellations=cancellations
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"Job mode disabled, cannot open {path}: {e}")
+        return None
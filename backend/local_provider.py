@@ -0,0 +1,179 @@
+"""
+OpenAI-compatible provider for self-hosted inference servers (llama.cpp server,
+vLLM, Ollama and similar), addressed by base URL.
+
+Requests go through a dedicated keep-alive connection pool, separate from the
+hosted providers' SDK sessions, so on-prem traffic never queues behind hosted
+calls for a connection. Models are discovered from GET <base>/models.
+
+    LOCAL_BASE_URL          base URL including /v1, e.g. http://gpu-1:8000/v1 (enables the provider)
+    LOCAL_API_KEY           bearer token, for servers started with an API key
+    LOCAL_POOL_SIZE         keep-alive connections kept to the server (default 64)
+    LOCAL_CONNECT_TIMEOUT   connect timeout in seconds (default 2)
+    LOCAL_READ_TIMEOUT      read timeout in seconds (default 120)
+"""
+import json
+import logging
+import os
+import threading
+
+from backend.scheduler import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class LocalProviderError(Exception):
+    """An error response from the local server, keeping its HTTP status"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LocalProvider:
+    """Chat completions against one OpenAI-compatible server over a pooled session"""
+
+    def __init__(self, base_url, api_key=None, pool_size=64, connect_timeout=2, read_timeout=120):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        """Return the pooled requests session, creating it on first use"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    session.trust_env = False  # On-prem servers are reached directly, never through a proxy
+                    if self.api_key:
+                        session.headers['Authorization'] = f'Bearer {self.api_key}'
+                    self._session = session
+        return self._session
+
+    def _timeout(self, timeout=None):
+        return (self.connect_timeout, timeout or self.read_timeout)
+
+    def _body(self, model, messages, temperature, max_tokens, top_p, seed, stream=False):
+        body = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p
+        }
+        if seed:
+            body["seed"] = int(seed)
+        if stream:
+            body["stream"] = True
+            body["stream_options"] = {"include_usage": True}
+        return body
+
+    def _raise_for_status(self, response):
+        if response.status_code < 400:
+            return
+        try:
+            detail = (response.json().get('error') or {}).get('message') or response.text
+        except (ValueError, AttributeError):
+            detail = response.text
+        if response.status_code == 429:
+            raise RateLimitExceeded(f"Local model API error: {detail}", float(response.headers.get('Retry-After') or 1))
+        raise LocalProviderError(f"Local model API error: {detail} (status {response.status_code})", response.status_code)
+
+    def chat(self, model, messages, temperature, max_tokens, top_p, seed, timeout=None):
+        """Run a completion and return {'text', 'finish_reason', 'usage'}"""
+        import requests
+
+        try:
+            response = self.session().post(f'{self.base_url}/chat/completions',
+                                           json=self._body(model, messages, temperature, max_tokens, top_p, seed),
+                                           timeout=self._timeout(timeout))
+        except requests.RequestException as e:
+            raise Exception(f"Local model API error: {e}")
+        self._raise_for_status(response)
+        data = response.json()
+        usage = data.get('usage') or {}
+        return {
+            'text': data['choices'][0]['message']['content'],
+            'finish_reason': data['choices'][0].get('finish_reason'),
+            'usage': {
+                'prompt_tokens': usage.get('prompt_tokens'),
+                'completion_tokens': usage.get('completion_tokens'),
+                'total_tokens': usage.get('total_tokens')
+            }
+        }
+
+    def stream(self, model, messages, temperature, max_tokens, top_p, seed):
+        """Stream a completion as normalised delta/done events (see backend.streaming)"""
+        import requests
+
+        try:
+            response = self.session().post(f'{self.base_url}/chat/completions',
+                                           json=self._body(model, messages, temperature, max_tokens, top_p, seed, stream=True),
+                                           timeout=self._timeout(), stream=True)
+        except requests.RequestException as e:
+            raise Exception(f"Local model API error: {e}")
+
+        finish_reason = None
+        usage = None
+        chunks = 0
+        with response:
+            self._raise_for_status(response)
+            for line in response.iter_lines():
+                if not line.startswith(b'data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == b'[DONE]':
+                    break
+                chunk = json.loads(payload)
+                if chunk.get('usage'):
+                    usage = chunk['usage']
+                if not chunk.get('choices'):
+                    continue
+                choice = chunk['choices'][0]
+                text = (choice.get('delta') or {}).get('content')
+                if text:
+                    chunks += 1
+                    yield {'type': 'delta', 'text': text}
+                finish_reason = choice.get('finish_reason') or finish_reason
+
+        result_usage = {
+            'completion_chunks': chunks,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'top_p': top_p
+        }
+        if usage:
+            result_usage['prompt_tokens'] = usage.get('prompt_tokens')
+            result_usage['completion_tokens'] = usage.get('completion_tokens')
+            result_usage['total_tokens'] = usage.get('total_tokens')
+        yield {'type': 'done', 'finish_reason': finish_reason, 'usage': result_usage}
+
+    def list_models(self):
+        """Raw model objects from GET <base>/models (cached by backend.catalog)"""
+        response = self.session().get(f'{self.base_url}/models', timeout=(self.connect_timeout, 10))
+        self._raise_for_status(response)
+        return [item for item in response.json().get('data', []) if item.get('id')]
+
+
+def create_local_provider():
+    """Build the local provider from environment settings, or None when LOCAL_BASE_URL is unset"""
+    base_url = os.getenv('LOCAL_BASE_URL')
+    if not base_url:
+        return None
+    return LocalProvider(
+        base_url,
+        api_key=os.getenv('LOCAL_API_KEY') or None,
+        pool_size=int(os.getenv('LOCAL_POOL_SIZE', 64)),
+        connect_timeout=float(os.getenv('LOCAL_CONNECT_TIMEOUT', 2)),
+        read_timeout=float(os.getenv('LOCAL_READ_TIMEOUT', 120))
+    )
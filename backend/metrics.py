@@ -0,0 +1,350 @@
+"""
+In-process metrics exposed in the Prometheus text format at /api/metrics.
+
+Recording is lock-free on the hot path: every thread writes to its own shard
+(plain dicts reached through a thread-local), and shards are only summed when
+the endpoint is scraped. Shards of finished threads are folded into a shared
+base shard so short-lived request threads do not accumulate.
+
+Stats that other components already keep (cache, coalescing, scheduler,
+resilience) are exported at scrape time through registered stats callbacks.
+With a usage ledger attached, every recorded provider call is also appended
+to it (see backend.usage).
+"""
+import asyncio
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+from backend.sessions import estimate_tokens
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TTFT_BUCKETS = (0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 35, 50, 75, 100, 150, 250, 500)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'llm_requests_total': ('counter', 'Chat API requests by endpoint, provider, model and status', None),
+    'llm_request_duration_seconds': ('histogram', 'End-to-end request latency, including streaming', LATENCY_BUCKETS),
+    'llm_in_flight_requests': ('gauge', 'Requests currently being served', None),
+    'llm_provider_requests_total': ('counter', 'Upstream provider calls by outcome (ok, error, cancelled)', None),
+    'llm_provider_latency_seconds': ('histogram', 'Upstream provider call latency (full stream for streams)', LATENCY_BUCKETS),
+    'llm_provider_in_flight': ('gauge', 'Upstream provider calls currently open', None),
+    'llm_time_to_first_token_seconds': ('histogram', 'Time from opening a provider stream to its first token', TTFT_BUCKETS),
+    'llm_completion_tokens_total': ('counter', 'Completion tokens received from providers (estimated when not reported)', None),
+    'llm_completion_tokens_per_second': ('histogram', 'Completion tokens per second per provider call', TOKENS_PER_SECOND_BUCKETS),
+    'llm_cancelled_tokens_saved_total': ('counter', 'Completion tokens not generated because a provider call was cancelled (max_tokens minus tokens received)', None)
+}
+
+FOLD_EVERY = 256  # Fold dead threads' shards after this many new shards
+MAX_MODEL_LABELS = 200  # Models are client-supplied; cap label cardinality
+
+
+class _Shard:
+    __slots__ = ('thread', 'values', 'histograms')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.values = defaultdict(float)
+        self.histograms = {}
+
+
+class Metrics:
+    """Per-thread sharded counters, gauges and histograms"""
+
+    def __init__(self, ledger=None):
+        self.ledger = ledger
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._base = _Shard(None)
+        self._new_shards = 0
+        self._stats = []
+        self._models = set()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = _Shard(threading.current_thread())
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append(shard)
+                self._new_shards += 1
+                if self._new_shards >= FOLD_EVERY:
+                    self._fold()
+        return shard
+
+    def _fold(self):
+        """Merge shards of finished threads into the base shard; caller holds the lock"""
+        live = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                live.append(shard)
+            else:
+                _merge(self._base, shard)
+        self._shards = live
+        self._new_shards = 0
+
+    def _model_label(self, model):
+        model = model or ''
+        if model in self._models:
+            return model
+        with self._lock:
+            if len(self._models) < MAX_MODEL_LABELS:
+                self._models.add(model)
+                return model
+        return 'other'
+
+    # Recording
+
+    def inc(self, name, labels=(), value=1):
+        self._shard().values[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            # Bucket counts (last one is +Inf), then sum
+            histogram = histograms[key] = [0] * (len(METRICS[name][2]) + 1) + [0.0]
+        histogram[bisect.bisect_left(METRICS[name][2], value)] += 1
+        histogram[-1] += value
+
+    def start_request(self, endpoint):
+        self.inc('llm_in_flight_requests', (('endpoint', endpoint),))
+        return time.perf_counter()
+
+    def finish_request(self, endpoint, provider, model, status, start):
+        self.inc('llm_in_flight_requests', (('endpoint', endpoint),), -1)
+        labels = (('endpoint', endpoint), ('provider', provider or ''), ('model', self._model_label(model)))
+        self.inc('llm_requests_total', labels + (('status', str(status)),))
+        self.observe('llm_request_duration_seconds', labels, time.perf_counter() - start)
+
+    def observe_provider(self, provider, model, seconds, completion_tokens=None, error=False, prompt_tokens=None,
+                         estimated=False):
+        """Record one finished provider call; estimated marks completion_tokens counted from the text"""
+        outcome = 'error' if error else 'ok'
+        if self.ledger is not None:
+            self.ledger.record(provider, model, outcome, seconds, prompt_tokens, completion_tokens, estimated)
+        labels = (('provider', provider), ('model', self._model_label(model)))
+        self.inc('llm_provider_requests_total', labels + (('outcome', outcome),))
+        self.observe('llm_provider_latency_seconds', labels, seconds)
+        if completion_tokens:
+            self.inc('llm_completion_tokens_total', labels, completion_tokens)
+            if seconds > 0:
+                self.observe('llm_completion_tokens_per_second', labels, completion_tokens / seconds)
+
+    def observe_cancelled(self, provider, model, completion_tokens, max_tokens=None, seconds=0.0):
+        """Record a provider call closed before it finished, and the tokens that were never generated"""
+        if self.ledger is not None:
+            self.ledger.record(provider, model, 'cancelled', seconds, None, completion_tokens, True)
+        labels = (('provider', provider), ('model', self._model_label(model)))
+        self.inc('llm_provider_requests_total', labels + (('outcome', 'cancelled'),))
+        if completion_tokens:
+            self.inc('llm_completion_tokens_total', labels, completion_tokens)
+        if max_tokens:
+            self.inc('llm_cancelled_tokens_saved_total', labels, max(0, max_tokens - completion_tokens))
+
+    def call_provider(self, provider, model, fn):
+        """Run fn() -> {'text', 'finish_reason', 'usage'} as a provider call and record it"""
+        labels = (('provider', provider),)
+        self.inc('llm_provider_in_flight', labels)
+        start = time.perf_counter()
+        try:
+            response = fn()
+        except Exception:
+            self.observe_provider(provider, model, time.perf_counter() - start, error=True)
+            raise
+        finally:
+            self.inc('llm_provider_in_flight', labels, -1)
+        usage = response.get('usage') or {}
+        completion_tokens = usage.get('completion_tokens')
+        self.observe_provider(provider, model, time.perf_counter() - start,
+                              completion_tokens if completion_tokens is not None else estimate_tokens(response['text']),
+                              prompt_tokens=usage.get('prompt_tokens'), estimated=completion_tokens is None)
+        return response
+
+    def record_stream(self, provider, model, events, max_tokens=None):
+        """Pass provider stream events through, recording TTFT, latency and tokens.
+
+        A stream closed before its done event (client disconnect or abort)
+        counts as cancelled, crediting max_tokens minus the tokens received as saved.
+        """
+        labels = (('provider', provider),)
+        self.inc('llm_provider_in_flight', labels)
+        start = time.perf_counter()
+        tracker = _StreamTracker(self, provider, model, start)
+        try:
+            for event in events:
+                tracker.see(event)
+                yield event
+        except Exception:
+            tracker.finish(error=True)
+            raise
+        except GeneratorExit:
+            tracker.cancel(max_tokens)
+            raise
+        else:
+            tracker.finish()
+        finally:
+            self.inc('llm_provider_in_flight', labels, -1)
+
+    async def record_async_stream(self, provider, model, events, max_tokens=None):
+        """Async variant of record_stream for the ASGI gateway"""
+        labels = (('provider', provider),)
+        self.inc('llm_provider_in_flight', labels)
+        start = time.perf_counter()
+        tracker = _StreamTracker(self, provider, model, start)
+        try:
+            async for event in events:
+                tracker.see(event)
+                yield event
+        except Exception:
+            tracker.finish(error=True)
+            raise
+        except (GeneratorExit, asyncio.CancelledError):
+            tracker.cancel(max_tokens)
+            raise
+        else:
+            tracker.finish()
+        finally:
+            self.inc('llm_provider_in_flight', labels, -1)
+
+    # Exposition
+
+    def register_stats(self, subsystem, stats_fn):
+        """Export the numeric fields of stats_fn() as llm_<subsystem>_<field> at scrape time"""
+        self._stats.append((subsystem, stats_fn))
+
+    def collect(self):
+        """Sum every shard into (values, histograms)"""
+        total = _Shard(None)
+        with self._lock:
+            self._fold()
+            shards = [self._base] + self._shards
+        for shard in shards:
+            _merge(total, shard)
+        return total.values, total.histograms
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        values, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'histogram':
+                for (metric, labels), histogram in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram[:-1]):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(labels)} {_number(histogram[-1])}')
+                    lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+            else:
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_labels(labels)} {_number(value)}')
+
+        for subsystem, stats_fn in self._stats:
+            try:
+                stats = stats_fn()
+            except Exception:
+                continue
+            if stats:
+                lines.extend(_stats_lines(f'llm_{subsystem}', stats))
+        return '\n'.join(lines) + '\n'
+
+
+class _StreamTracker:
+    def __init__(self, metrics, provider, model, start):
+        self.metrics = metrics
+        self.provider = provider
+        self.model = model
+        self.start = start
+        self.first_token = None
+        self.parts = []
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.done = False
+
+    def see(self, event):
+        if event['type'] == 'delta':
+            if self.first_token is None:
+                self.first_token = time.perf_counter()
+                self.metrics.observe('llm_time_to_first_token_seconds',
+                                     (('provider', self.provider), ('model', self.metrics._model_label(self.model))),
+                                     self.first_token - self.start)
+            self.parts.append(event['text'])
+        elif event['type'] == 'done':
+            self.done = True
+            usage = event.get('usage') or {}
+            self.prompt_tokens = usage.get('prompt_tokens')
+            self.completion_tokens = usage.get('completion_tokens')
+
+    def finish(self, error=False):
+        tokens = self.completion_tokens
+        if tokens is None:
+            tokens = estimate_tokens(''.join(self.parts))
+        self.metrics.observe_provider(self.provider, self.model, time.perf_counter() - self.start, tokens, error,
+                                      self.prompt_tokens, self.completion_tokens is None)
+
+    def cancel(self, max_tokens=None):
+        if self.done:
+            # Closed right after the last event; the call completed
+            self.finish()
+            return
+        self.metrics.observe_cancelled(self.provider, self.model, estimate_tokens(''.join(self.parts)), max_tokens,
+                                       time.perf_counter() - self.start)
+
+
+def _merge(target, shard):
+    for key, value in list(shard.values.items()):
+        target.values[key] += value
+    for key, histogram in list(shard.histograms.items()):
+        existing = target.histograms.get(key)
+        if existing is None:
+            target.histograms[key] = list(histogram)
+        else:
+            for i, value in enumerate(histogram):
+                existing[i] += value
+
+
+def _stats_lines(prefix, stats, labels=()):
+    lines = []
+    for key, value in sorted(stats.items()):
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            lines.append(f'{prefix}_{key}{_labels(labels)} {_number(value)}')
+        elif isinstance(value, dict):
+            # Nested maps such as queue_depth {provider: n} or breakers {provider: {...}}
+            if all(isinstance(v, dict) for v in value.values()):
+                for name, nested in sorted(value.items()):
+                    lines.extend(_stats_lines(f'{prefix}_{key}', nested, labels + (('key', name),)))
+            else:
+                for name, nested in sorted(value.items()):
+                    if isinstance(nested, (int, float)) and not isinstance(nested, bool):
+                        lines.append(f'{prefix}_{key}{_labels(labels + (("key", name),))} {_number(nested)}')
+    return lines
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
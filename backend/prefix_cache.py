@@ -0,0 +1,462 @@
+"""
+Reusable prompt prefixes: long system prompts are sent to the provider once
+and referenced on later calls, so their prefill is not paid again.
+
+System prompts are fingerprinted per provider and model (SHA-256 of the
+text). One at least PREFIX_CACHE_MIN_TOKENS long is handled per provider:
+
+* OpenAI caches prompt prefixes of 1024 tokens and more by itself. Messages
+  are always built system prompt first, then earlier turns, then the new
+  message, so the shared part forms a stable prefix; requests also carry the
+  fingerprint as prompt_cache_key, which routes requests with the same prefix
+  to the same cache. Nothing is registered.
+* Gemini caches only what it is given explicitly, and refuses content below
+  a per-model minimum far above OpenAI's, so only system prompts of at least
+  PREFIX_CACHE_GEMINI_MIN_TOKENS qualify. Once one has been seen
+  PREFIX_CACHE_MIN_USES times it is registered as a cachedContents resource
+  in the background; calls after that reference it by name instead of
+  sending the prompt. A prompt Gemini refuses (400, e.g. still too small for
+  the model) is not offered again; other failures are retried after
+  RETRY_AFTER seconds. A registered prompt's TTL is extended when less than
+  half remains, and a reference Gemini no longer knows (expired or deleted)
+  is dropped and the call is repeated with the prompt itself. Registered
+  caches are deleted when evicted and at exit. Gemini is reached at GOOGLE_API_ENDPOINT, like the SDK.
+* Local servers are left alone.
+
+A serverless function is frozen once it has answered, so background threads
+and exit hooks cannot be relied on there. With serverless=True the
+registration, extension and deletion calls run inline in the request that
+triggers them, nothing is deleted at exit, and the TTL defaults to
+SERVERLESS_TTL so caches left behind by a recycled instance expire soon.
+
+Providers report the cached part of the prompt (OpenAI cached_tokens, Gemini
+cachedContentTokenCount); the totals are in the stats next to the prompt
+tokens of the same calls. Each worker process registers its own caches.
+
+    PREFIX_CACHE_ENABLED            set to 'false' to send every system prompt in full (default true)
+    PREFIX_CACHE_MIN_TOKENS         shortest system prompt worth caching, in tokens (default 1024)
+    PREFIX_CACHE_GEMINI_MIN_TOKENS  shortest system prompt registered with Gemini, in tokens (default 4096)
+    PREFIX_CACHE_MIN_USES           uses of a system prompt before it is registered with Gemini (default 2)
+    PREFIX_CACHE_TTL                seconds a Gemini cache lives without use (default 3600, 300 serverless)
+    PREFIX_CACHE_MAX_ENTRIES        system prompts tracked; the least recently used is evicted (default 64)
+"""
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.providers import api_key, configured, google_api_base
+from backend.responses import loads
+from backend.scheduler import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+CACHEABLE = ('openai', 'google')
+
+# Seconds before a Gemini registration that failed is tried again
+RETRY_AFTER = 300
+
+# Default Gemini cache TTL in seconds for serverless functions
+SERVERLESS_TTL = 300
+
+
+class CachedContentMissing(LookupError):
+    """Raised when Gemini no longer knows a cached content (it expired or was deleted)"""
+
+
+class CachedContentRejected(ValueError):
+    """Raised when Gemini refuses to cache a system prompt, e.g. because it is below the model's minimum size"""
+
+
+class Prefix:
+    """A system prompt tracked by the cache; passed to provider calls as their handle on it"""
+
+    def __init__(self, cache, provider, model, fingerprint, tokens):
+        self.cache = cache
+        self.provider = provider
+        self.model = model
+        self.fingerprint = fingerprint
+        self.key = fingerprint[:32]
+        self.tokens = tokens
+        self.uses = 0
+        self.name = None  # Gemini cachedContents/... once registered
+        self.expires_at = 0.0
+        self.retry_at = 0.0
+
+    def record(self, usage):
+        """Count the prompt and cached tokens a provider reported for a call made with this prefix"""
+        self.cache.record(usage)
+
+    def record_stream(self, events):
+        """Pass stream events through, recording the usage on the final one"""
+        try:
+            for event in events:
+                if event['type'] == 'done':
+                    self.record(event.get('usage'))
+                yield event
+        finally:
+            close = getattr(events, 'close', None)
+            if close is not None:
+                close()
+
+    def invalidate(self):
+        """Forget the Gemini cache after it turned out to be gone"""
+        self.cache.invalidate(self)
+
+    # Calls through the Gemini cache for the synchronous provider path. They go over REST rather than the
+    # SDK's from_cached_content(), which costs a cachedContents.get round trip per model it builds
+
+    def generate(self, model, messages, temperature, max_tokens, top_p, seed, timeout=None):
+        return self._gemini_call(self.cache.gemini.generate, model, messages, temperature, max_tokens, top_p, seed, timeout)
+
+    def stream(self, model, messages, temperature, max_tokens, top_p, seed):
+        return self._gemini_call(self.cache.gemini.stream, model, messages, temperature, max_tokens, top_p, seed)
+
+    def _gemini_call(self, call, *args):
+        name = self.name
+        if not name:
+            raise CachedContentMissing(self.key)
+        try:
+            return call(name, *args)
+        except CachedContentMissing:
+            self.invalidate()
+            raise
+
+
+class PrefixCache:
+    """Fingerprints system prompts and keeps their provider-side caches"""
+
+    def __init__(self, gemini=None, count_tokens=None, min_tokens=1024, min_uses=2, ttl=3600, max_entries=64,
+                 serverless=False, gemini_min_tokens=4096):
+        # count_tokens(model, text) -> tokens; about four bytes per token without one
+        self.gemini = gemini
+        self.serverless = serverless
+        self.count_tokens = count_tokens or (lambda model, text: len(text.encode('utf-8')) // 4)
+        self.min_tokens = min_tokens
+        self.gemini_min_tokens = max(min_tokens, gemini_min_tokens)
+        self.min_uses = min_uses
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # fingerprint -> Prefix, least recently used first
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None if serverless else ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefix-cache')
+        self.stats_counters = {'lookups': 0, 'hits': 0, 'misses': 0, 'short': 0, 'keyed': 0, 'registered': 0,
+                               'registration_errors': 0, 'registration_rejected': 0, 'extended': 0, 'expired': 0,
+                               'evicted': 0, 'invalidated': 0, 'calls': 0, 'cached_calls': 0, 'prompt_tokens': 0,
+                               'cached_tokens': 0}
+        if not serverless:
+            atexit.register(self.close)
+
+    def lookup(self, provider, model, system_prompt):
+        """The Prefix to pass to a provider call for this system prompt, or None to send it as usual"""
+        if not system_prompt or provider not in CACHEABLE or (provider == 'google' and self.gemini is None):
+            return None
+        if len(system_prompt) < self.min_tokens:
+            # A text has fewer tokens than characters, so this one cannot reach min_tokens
+            self._count('short')
+            return None
+
+        fingerprint = hashlib.sha256(f'{provider}\0{model}\0{system_prompt}'.encode()).hexdigest()
+        with self._lock:
+            prefix = self._entries.get(fingerprint)
+            if prefix is not None:
+                self._entries.move_to_end(fingerprint)
+        if prefix is None:
+            prefix = self._add(Prefix(self, provider, model, fingerprint, self.count_tokens(model, system_prompt)))
+
+        now = time.time()
+        work = None
+        with self._lock:
+            self.stats_counters['lookups'] += 1
+            if prefix.tokens < (self.gemini_min_tokens if provider == 'google' else self.min_tokens):
+                self.stats_counters['short'] += 1
+                return None
+            prefix.uses += 1
+            if provider == 'openai':
+                self.stats_counters['keyed'] += 1
+                return prefix
+
+            if prefix.name and prefix.expires_at <= now:
+                prefix.name = None
+                self.stats_counters['expired'] += 1
+            if prefix.name:
+                self.stats_counters['hits'] += 1
+                if prefix.expires_at - now < self.ttl / 2:
+                    work = (self._extend, prefix)
+            else:
+                self.stats_counters['misses'] += 1
+                if prefix.uses >= self.min_uses and now >= prefix.retry_at:
+                    work = (self._register, prefix, system_prompt)
+        if work is not None:
+            self._submit(prefix, *work)
+        # Serverless registration has just run inline, so this call can use it already
+        return prefix if prefix.name else None
+
+    def _add(self, prefix):
+        with self._lock:
+            prefix = self._entries.setdefault(prefix.fingerprint, prefix)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                _, oldest = self._entries.popitem(last=False)
+                self.stats_counters['evicted'] += 1
+                if oldest.name:
+                    evicted.append(oldest.name)
+                    oldest.name = None
+        for name in evicted:
+            if self._executor is None:
+                self._delete(name)
+            else:
+                self._executor.submit(self._delete, name)
+        return prefix
+
+    def _submit(self, prefix, fn, *args):
+        """Run fn(*args) in the background (inline when serverless) unless work for this prefix is already under way"""
+        with self._lock:
+            if prefix in self._pending:
+                return
+            self._pending.add(prefix)
+        if self._executor is None:
+            self._run(prefix, fn, *args)
+        else:
+            self._executor.submit(self._run, prefix, fn, *args)
+
+    def _run(self, prefix, fn, *args):
+        try:
+            fn(*args)
+        finally:
+            with self._lock:
+                self._pending.discard(prefix)
+
+    def _register(self, prefix, system_prompt):
+        try:
+            name = self.gemini.create(prefix.model, system_prompt, self.ttl)
+        except CachedContentRejected as e:
+            # Asking again would only be refused again; the prompt is sent in full from now on
+            logger.info(f"Gemini will not cache a {prefix.tokens}-token system prompt for {prefix.model}: {e}")
+            with self._lock:
+                prefix.retry_at = float('inf')
+                self.stats_counters['registration_rejected'] += 1
+            return
+        except Exception as e:
+            logger.warning(f"Could not cache a {prefix.tokens}-token system prompt for {prefix.model}: {e}")
+            with self._lock:
+                prefix.retry_at = time.time() + RETRY_AFTER
+                self.stats_counters['registration_errors'] += 1
+            return
+        with self._lock:
+            current = self._entries.get(prefix.fingerprint) is prefix
+            if current:
+                prefix.name = name
+                prefix.expires_at = time.time() + self.ttl
+                self.stats_counters['registered'] += 1
+        if current:
+            logger.info(f"Cached a {prefix.tokens}-token system prompt for {prefix.model} as {name}")
+        else:
+            # Evicted while it was being registered
+            self._delete(name)
+
+    def _extend(self, prefix):
+        name = prefix.name
+        if not name:
+            return
+        try:
+            self.gemini.extend(name, self.ttl)
+        except CachedContentMissing:
+            self.invalidate(prefix)
+            return
+        except Exception as e:
+            logger.warning(f"Could not extend {name}: {e}")
+            return
+        with self._lock:
+            if prefix.name == name:
+                prefix.expires_at = time.time() + self.ttl
+            self.stats_counters['extended'] += 1
+
+    def _delete(self, name):
+        try:
+            self.gemini.delete(name)
+        except Exception as e:
+            logger.info(f"Could not delete {name}, it will expire on its own: {e}")
+
+    def invalidate(self, prefix):
+        with self._lock:
+            if prefix.name:
+                prefix.name = None
+                self.stats_counters['invalidated'] += 1
+
+    def record(self, usage):
+        usage = usage or {}
+        cached = usage.get('cached_tokens') or 0
+        with self._lock:
+            self.stats_counters['calls'] += 1
+            self.stats_counters['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            self.stats_counters['cached_tokens'] += cached
+            if cached:
+                self.stats_counters['cached_calls'] += 1
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats_counters['lookups'] += 1
+            self.stats_counters[counter] += 1
+
+    def close(self):
+        """Delete the Gemini caches this process registered; they would otherwise be billed until they expire"""
+        with self._lock:
+            names = [prefix.name for prefix in self._entries.values() if prefix.name]
+            for prefix in self._entries.values():
+                prefix.name = None
+        for name in names:
+            self._delete(name)
+
+    def stats(self):
+        with self._lock:
+            registered = sum(1 for prefix in self._entries.values() if prefix.name)
+            return dict(self.stats_counters, entries=len(self._entries), active=registered,
+                        min_tokens=self.min_tokens, gemini_min_tokens=self.gemini_min_tokens, ttl=self.ttl,
+                        serverless=self.serverless)
+
+
+class GeminiCachedContents:
+    """Gemini's cachedContents REST API, and generateContent calls that reference a cached content.
+
+    httpx is imported and the client opened on the first call, so building
+    the prefix cache costs a cold start nothing.
+    """
+
+    def __init__(self, key, base_url=None, timeout=None):
+        self.key = key
+        self.base_url = base_url or google_api_base()
+        self.timeout = timeout
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    self._client = httpx.Client(base_url=self.base_url, headers={'x-goog-api-key': self.key},
+                                                timeout=self.timeout or httpx.Timeout(120, connect=5))
+        return self._client
+
+    def create(self, model, system_prompt, ttl):
+        """Register a system prompt for a model; returns the cached content's name"""
+        response = self.client.post('/cachedContents', json={
+            'model': f'models/{model}',
+            'systemInstruction': {'parts': [{'text': system_prompt}]},
+            'ttl': f'{int(ttl)}s'
+        })
+        if response.status_code == 400:
+            raise CachedContentRejected(self._detail(response))
+        self._raise_for_status(response)
+        return response.json()['name']
+
+    def extend(self, name, ttl):
+        response = self.client.patch(f'/{name}', params={'updateMask': 'ttl'}, json={'ttl': f'{int(ttl)}s'})
+        self._raise_for_status(response)
+
+    def delete(self, name):
+        from backend.gateway import CACHE_MISSING
+        response = self.client.delete(f'/{name}')
+        if response.status_code not in CACHE_MISSING:
+            self._raise_for_status(response)
+
+    def generate(self, name, model, messages, temperature, max_tokens, top_p, seed, timeout=None):
+        """Blocking completion with the system prompt taken from a cached content"""
+        from backend.gateway import google_body, google_candidate, google_usage
+        body = google_body(messages, temperature, max_tokens, top_p, seed, cached_content=name)
+        response = self.client.post(f'/models/{model}:generateContent', json=body,
+                                    timeout=timeout or self.client.timeout)
+        self._raise_for_status(response)
+        data = response.json()
+        text, finish_reason = google_candidate(data)
+        return {'text': text, 'finish_reason': finish_reason, 'usage': google_usage(data.get('usageMetadata'))}
+
+    def stream(self, name, model, messages, temperature, max_tokens, top_p, seed):
+        """Start a streamed completion with the system prompt taken from a cached content.
+
+        The request is sent before this returns, so a missing cache is reported
+        here rather than on the first event.
+        """
+        from backend.gateway import google_body
+        body = google_body(messages, temperature, max_tokens, top_p, seed, cached_content=name)
+        request = self.client.build_request('POST', f'/models/{model}:streamGenerateContent', json=body,
+                                            params={'alt': 'sse'})
+        response = self.client.send(request, stream=True)
+        try:
+            self._raise_for_status(response)
+        except Exception:
+            response.close()
+            raise
+        return self._events(response, temperature, max_tokens, top_p)
+
+    @staticmethod
+    def _events(response, temperature, max_tokens, top_p):
+        """Normalised delta/done events from a Gemini SSE response (see backend.streaming)"""
+        from backend.gateway import google_candidate, google_usage
+        finish_reason = None
+        reported = None
+        chunks = 0
+        try:
+            for line in response.iter_lines():
+                if not line.startswith('data:'):
+                    continue
+                chunk = loads(line[5:].strip())
+                if chunk.get('usageMetadata'):
+                    reported = google_usage(chunk['usageMetadata'])
+                text, reason = google_candidate(chunk, fallback=None)
+                finish_reason = reason or finish_reason
+                if text:
+                    chunks += 1
+                    yield {'type': 'delta', 'text': text}
+        finally:
+            response.close()
+        if not chunks:
+            yield {'type': 'delta', 'text': "Sorry, I couldn't generate a response. Please try again."}
+        usage = {'completion_chunks': chunks, 'temperature': temperature, 'max_tokens': max_tokens, 'top_p': top_p}
+        usage.update(reported or {})
+        yield {'type': 'done', 'finish_reason': finish_reason, 'usage': usage}
+
+    @staticmethod
+    def _raise_for_status(response):
+        from backend.gateway import CACHE_MISSING
+        if response.status_code < 400:
+            return
+        detail = GeminiCachedContents._detail(response)
+        if response.status_code in CACHE_MISSING:
+            raise CachedContentMissing(detail)
+        if response.status_code == 429:
+            raise RateLimitExceeded(f"Google AI API error: {detail}", float(response.headers.get('Retry-After') or 1))
+        raise Exception(f"Google AI API error: {detail}")
+
+    @staticmethod
+    def _detail(response):
+        """The error message of a failed response"""
+        response.read()
+        try:
+            return response.json().get('error', {}).get('message') or response.text
+        except ValueError:
+            return response.text
+
+
+def create_prefix_cache(count_tokens=None, serverless=False):
+    """Build the process-wide prefix cache from environment settings, or None if disabled"""
+    if os.getenv('PREFIX_CACHE_ENABLED', 'true').lower() == 'false':
+        return None
+    gemini = GeminiCachedContents(api_key('google')) if configured('google') else None
+    return PrefixCache(
+        gemini,
+        count_tokens,
+        min_tokens=int(os.getenv('PREFIX_CACHE_MIN_TOKENS', 1024)),
+        gemini_min_tokens=int(os.getenv('PREFIX_CACHE_GEMINI_MIN_TOKENS', 4096)),
+        min_uses=int(os.getenv('PREFIX_CACHE_MIN_USES', 2)),
+        ttl=int(os.getenv('PREFIX_CACHE_TTL', SERVERLESS_TTL if serverless else 3600)),
+        max_entries=int(os.getenv('PREFIX_CACHE_MAX_ENTRIES', 64)),
+        serverless=serverless
+    )
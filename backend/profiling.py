@@ -0,0 +1,285 @@
+"""
+On-demand profiling of single requests.
+
+Off unless PROFILE_ENABLED is set: no hooks are installed and requests run
+exactly as before. When enabled, a request is profiled if it carries
+`X-Profile: <PROFILE_TOKEN>` or is picked by PROFILE_SAMPLE_RATE. The profile
+rides on the request's trace (backend.tracing): it covers the request thread
+from the start of the request until its response is closed, plus every
+thread doing work for it inside a span (queueing, client_init, the provider
+SDK call, response unpacking) or reading its provider stream.
+
+Two modes, chosen by PROFILE_MODE or per request with `X-Profile-Mode`:
+
+* cprofile: deterministic cProfile of each participating thread, merged and
+  written as <id>.pstats (python -m pstats, snakeviz)
+* sample: a sampler thread records the participating threads' stacks every
+  PROFILE_INTERVAL ms and writes them as <id>.collapsed, one
+  "frame;frame;frame count" line per stack, ready for flamegraph.pl or speedscope
+
+Each profile gets a <id>.json summary next to it; GET /api/profiles lists
+them, newest first, and GET /api/profiles/<id> downloads one. Both need the
+token, and the response of a profiled request names its profile in X-Profile-ID.
+
+    PROFILE_ENABLED       set to 'true' to install the hook (default false)
+    PROFILE_TOKEN         secret for the X-Profile header and the profile endpoints (default none)
+    PROFILE_SAMPLE_RATE   fraction of requests profiled without the header (default 0)
+    PROFILE_MODE          cprofile or sample (default cprofile)
+    PROFILE_INTERVAL      sampling interval in milliseconds (default 5)
+    PROFILE_DIR           where profiles are written (default <tmp>/llm_profiles)
+    PROFILE_KEEP          profiles kept, oldest deleted first (default 200)
+    PROFILE_MAX_ACTIVE    requests profiled at once; further ones are not profiled (default 4)
+"""
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sample')
+EXTENSIONS = {'cprofile': 'pstats', 'sample': 'collapsed'}
+
+
+class Profile:
+    """Profiler state for one request, entered and left by each thread that works on it"""
+
+    def __init__(self, profiler, profile_id, trace, mode):
+        self.profiler = profiler
+        self.id = profile_id
+        self.trace = trace
+        self.mode = mode
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._depth = {}  # thread id -> nesting depth of enter()
+        self._profiles = {}  # thread id -> cProfile.Profile (cprofile mode)
+        self._finished = []
+        self._samples = Counter()
+        self._stopped = threading.Event()
+        self._sampler = None
+        if mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample, daemon=True, name=f'profile-{profile_id}')
+            self._sampler.start()
+
+    def enter(self):
+        """Start profiling the calling thread for this request (nested calls are counted)"""
+        thread_id = threading.get_ident()
+        with self._lock:
+            depth = self._depth.get(thread_id, 0)
+            self._depth[thread_id] = depth + 1
+            if depth or self.mode != 'cprofile' or self._stopped.is_set():
+                return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return
+        with self._lock:
+            self._profiles[thread_id] = profile
+
+    def exit(self):
+        """Stop profiling the calling thread once its outermost enter() is left"""
+        thread_id = threading.get_ident()
+        with self._lock:
+            depth = self._depth.get(thread_id)
+            if depth is None:
+                return
+            if depth > 1:
+                self._depth[thread_id] = depth - 1
+                return
+            del self._depth[thread_id]
+            profile = self._profiles.pop(thread_id, None)
+        if profile is not None:
+            profile.disable()
+            with self._lock:
+                self._finished.append(profile)
+
+    def _sample(self):
+        interval = self.profiler.interval
+        own = threading.get_ident()
+        while not self._stopped.wait(interval):
+            with self._lock:
+                threads = set(self._depth)
+            if not threads:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in threads and thread_id != own:
+                    self._samples[_collapse(frame)] += 1
+
+    def finish(self, status=None):
+        """Stop profiling and write the profile; called when the request's trace finishes"""
+        self.exit()
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        with self._lock:
+            # Threads still inside the request (e.g. a stream closed from elsewhere) stop contributing here
+            profiles = self._finished + list(self._profiles.values())
+            self._profiles.clear()
+            self._depth.clear()
+        self.profiler.write(self, profiles, status)
+
+
+class Profiler:
+    """Decides which requests to profile and stores their profiles"""
+
+    def __init__(self, directory, token=None, sample_rate=0.0, mode='cprofile', interval=0.005, keep=200, max_active=4):
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.interval = interval
+        self.keep = keep
+        self.max_active = max_active
+        self._lock = threading.Lock()
+        self._active = 0
+        self.stats_counters = {'profiled': 0, 'requested': 0, 'sampled': 0, 'skipped_busy': 0, 'write_errors': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def authorized(self, value):
+        """Whether a header value matches the profile token"""
+        return bool(self.token and value and hmac.compare_digest(value, self.token))
+
+    def start(self, trace, header=None, mode=None):
+        """Attach a profile to a trace if the request asked for one or was sampled; returns it or None"""
+        requested = self.authorized(header)
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            return None
+        with self._lock:
+            if self._active >= self.max_active:
+                self.stats_counters['skipped_busy'] += 1
+                return None
+            self._active += 1
+            self.stats_counters['requested' if requested else 'sampled'] += 1
+
+        profile_id = f"{int(time.time() * 1000)}-{re.sub(r'[^A-Za-z0-9_-]', '', trace.request_id)[:64]}"
+        profile = Profile(self, profile_id, trace, mode if mode in MODES else self.mode)
+        trace.profile = profile
+        profile.enter()
+        return profile
+
+    def write(self, profile, profiles, status):
+        try:
+            path = os.path.join(self.directory, f'{profile.id}.{EXTENSIONS[profile.mode]}')
+            if profile.mode == 'cprofile':
+                if profiles:
+                    stats = pstats.Stats(profiles[0])
+                    for other in profiles[1:]:
+                        stats.add(other)
+                    stats.dump_stats(path)
+                threads = len(profiles)
+            else:
+                with open(path, 'w') as f:
+                    for stack, count in profile._samples.most_common():
+                        f.write(f'{stack} {count}\n')
+                threads = None
+            summary = {
+                'id': profile.id,
+                'file': os.path.basename(path),
+                'mode': profile.mode,
+                'request_id': profile.trace.request_id,
+                'name': profile.trace.root.name,
+                'status': status,
+                'created_at': profile.started_at,
+                'duration_ms': round(profile.trace.root.duration_ms, 2),
+                'spans': profile.trace.totals(),
+                'threads': threads,
+                'samples': sum(profile._samples.values()) if profile.mode == 'sample' else None
+            }
+            summary.update(profile.trace.attributes)
+            with open(os.path.join(self.directory, f'{profile.id}.json'), 'w') as f:
+                json.dump(summary, f)
+            with self._lock:
+                self.stats_counters['profiled'] += 1
+            self._prune()
+        except Exception as e:
+            logger.warning(f"Could not write profile {profile.id}: {e}")
+            with self._lock:
+                self.stats_counters['write_errors'] += 1
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _prune(self):
+        summaries = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in summaries[:max(0, len(summaries) - self.keep)]:
+            profile_id = name[:-len('.json')]
+            for extension in ('json',) + tuple(EXTENSIONS.values()):
+                try:
+                    os.remove(os.path.join(self.directory, f'{profile_id}.{extension}'))
+                except FileNotFoundError:
+                    pass
+
+    # Reading
+
+    def list(self, limit=50):
+        """Summaries of the newest profiles first"""
+        names = sorted((name for name in os.listdir(self.directory) if name.endswith('.json')), reverse=True)
+        profiles = []
+        for name in names[:limit]:
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def path(self, profile_id):
+        """File of a profile, or None if there is none (ids never contain path separators)"""
+        if not re.fullmatch(r'[0-9]+-[A-Za-z0-9_-]*', profile_id or ''):
+            return None
+        for extension in EXTENSIONS.values():
+            path = os.path.join(self.directory, f'{profile_id}.{extension}')
+            if os.path.exists(path):
+                return path
+        return None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counters, active=self._active, sample_rate=self.sample_rate)
+
+
+def _collapse(frame):
+    """Root-first 'function (file:line);...' stack of a frame"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+def create_profiler():
+    """Build the process-wide profiler from environment settings, or None when profiling is off"""
+    if os.getenv('PROFILE_ENABLED', 'false').lower() != 'true':
+        return None
+    mode = os.getenv('PROFILE_MODE', 'cprofile')
+    if mode not in MODES:
+        logger.warning(f"Unknown PROFILE_MODE {mode!r}, using cprofile")
+        mode = 'cprofile'
+    directory = os.getenv('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'llm_profiles')
+    try:
+        profiler = Profiler(
+            directory,
+            token=os.getenv('PROFILE_TOKEN') or None,
+            sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+            mode=mode,
+            interval=float(os.getenv('PROFILE_INTERVAL', 5)) / 1000,
+            keep=int(os.getenv('PROFILE_KEEP', 200)),
+            max_active=int(os.getenv('PROFILE_MAX_ACTIVE', 4))
+        )
+    except OSError as e:
+        logger.warning(f"Profiling disabled, cannot create {directory}: {e}")
+        return None
+    logger.info(f"Request profiling enabled ({mode}), profiles in {directory}")
+    return profiler
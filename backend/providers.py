@@ -0,0 +1,376 @@
+"""
+Provider calls shared by the Flask app and the Vercel functions.
+
+The OpenAI and Google AI SDKs are imported lazily, the first time a provider
+is used, so entry points that never talk to a provider (or only to one of
+them) do not pay for both imports on a cold start. Gemini model handles are
+cached per model and generation config instead of being rebuilt per request.
+The 'local' provider talks to a self-hosted OpenAI-compatible server (see
+backend.local_provider) and is enabled by LOCAL_BASE_URL.
+
+    GOOGLE_MODEL_CACHE_SIZE   Gemini model handles kept (default 64)
+    GOOGLE_API_ENDPOINT       alternative Gemini endpoint, spoken over REST (e.g. the benchmark mock)
+"""
+import functools
+import logging
+import os
+import threading
+import time
+
+from backend.local_provider import create_local_provider
+from backend.scheduler import RateLimitExceeded
+from backend.streaming import stream_google, stream_openai
+from backend.tracing import span, trace_stream
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ('openai', 'google', 'local')
+
+_API_KEYS = {
+    'openai': ('OPENAI_API_KEY', 'your_openai_api_key_here'),
+    'google': ('GOOGLE_API_KEY', 'your_google_api_key_here'),
+    'local': ('LOCAL_API_KEY', None)
+}
+
+PROVIDER_NAMES = {'openai': 'OpenAI', 'google': 'Google AI', 'local': 'Local model'}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Milliseconds spent importing and configuring each SDK, for cold-start benchmarks
+load_times = {}
+
+
+def api_key(provider):
+    """Return the configured API key for a provider, or None when missing or still the placeholder"""
+    name, placeholder = _API_KEYS[provider]
+    key = os.getenv(name)
+    if key and key != placeholder:
+        return key
+    return None
+
+
+def configured(provider):
+    """Whether a provider can be used: an API key for hosted providers, a base URL for 'local'"""
+    if provider == 'local':
+        return bool(os.getenv('LOCAL_BASE_URL'))
+    return api_key(provider) is not None
+
+
+def initialize_clients():
+    """Check which providers are configured without importing their SDKs"""
+    # Clear proxy environment variables that might interfere
+    proxy_vars = ['HTTP_PROXY', 'HTTPS_PROXY', 'http_proxy', 'https_proxy', 'NO_PROXY', 'no_proxy']
+    for var in proxy_vars:
+        if var in os.environ:
+            del os.environ[var]
+
+    available = set()
+    for provider in PROVIDERS:
+        if configured(provider):
+            available.add(provider)
+        elif provider != 'local':  # Optional; only used when LOCAL_BASE_URL is set
+            logger.warning(f"{PROVIDER_NAMES[provider]} API key not found or not configured")
+    return available
+
+
+def get_client(provider):
+    """Return the SDK module for a provider, importing and configuring it on first use"""
+    client = _clients.get(provider)
+    if client is not None:
+        return client
+
+    if not configured(provider):
+        if provider == 'local':
+            raise Exception("Local model client not initialized. Please set LOCAL_BASE_URL.")
+        raise Exception(f"{PROVIDER_NAMES[provider]} client not initialized. Please check your API key.")
+    key = api_key(provider)
+
+    with _clients_lock, span('client_init'):
+        if provider not in _clients:
+            start = time.perf_counter()
+            if provider == 'openai':
+                import openai
+                openai.api_key = key
+                _clients[provider] = openai
+            elif provider == 'local':
+                _clients[provider] = create_local_provider()
+            else:
+                import google.generativeai as genai
+                endpoint = os.getenv('GOOGLE_API_ENDPOINT')
+                if endpoint:
+                    genai.configure(api_key=key, transport='rest', client_options={'api_endpoint': endpoint})
+                else:
+                    genai.configure(api_key=key)
+                _clients[provider] = genai
+            load_times[provider] = round((time.perf_counter() - start) * 1000, 1)
+            logger.info(f"{PROVIDER_NAMES[provider]} client initialized in {load_times[provider]}ms")
+        return _clients[provider]
+
+
+def google_api_base():
+    """Gemini REST base URL, at GOOGLE_API_ENDPOINT when it is set (a host or URL, as the SDK takes it)"""
+    endpoint = os.getenv('GOOGLE_API_ENDPOINT')
+    if not endpoint:
+        return 'https://generativelanguage.googleapis.com/v1beta'
+    if '://' not in endpoint:
+        endpoint = f'https://{endpoint}'
+    return f"{endpoint.rstrip('/')}/v1beta"
+
+
+def preload(providers=None):
+    """Import the SDKs of all configured providers ahead of the first request"""
+    for provider in providers or PROVIDERS:
+        if configured(provider):
+            try:
+                get_client(provider)
+            except Exception as e:
+                logger.warning(f"Could not preload {provider} client: {e}")
+
+
+@functools.lru_cache(maxsize=int(os.getenv('GOOGLE_MODEL_CACHE_SIZE', 64)))
+def google_model(model, temperature, max_tokens, top_p):
+    """Return a cached GenerativeModel for a model and generation config"""
+    genai = get_client('google')
+    return genai.GenerativeModel(model, generation_config={
+        'temperature': temperature,
+        'max_output_tokens': max_tokens,
+        'top_p': top_p
+    })
+
+
+def build_messages(message, system_prompt, history=None):
+    """Build an OpenAI-style message list from prior turns and the new message"""
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.extend(history or [])
+    messages.append({"role": "user", "content": message})
+    return messages
+
+
+def build_google_prompt(message, system_prompt, history=None):
+    """Build Gemini input: a single prompt string, or multi-turn contents when there is history"""
+    if not history:
+        if system_prompt:
+            return f"System: {system_prompt}\n\nUser: {message}"
+        return message
+
+    contents = []
+    for turn in history + [{'role': 'user', 'content': message}]:
+        role = 'model' if turn['role'] == 'assistant' else 'user'
+        contents.append({'role': role, 'parts': [turn['content']]})
+
+    # Gemini has no system role here; prefix it to the first user turn
+    if system_prompt:
+        contents[0]['parts'] = [f"System: {system_prompt}\n\nUser: {contents[0]['parts'][0]}"]
+    return contents
+
+
+def completion(text, finish_reason=None, prompt_tokens=None, completion_tokens=None, total_tokens=None,
+               cached_tokens=None):
+    """Result of a blocking provider call: the reply text, why it ended and the token usage the provider reported"""
+    usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': total_tokens}
+    if cached_tokens is not None:
+        usage['cached_tokens'] = cached_tokens
+    return {'text': text, 'finish_reason': finish_reason, 'usage': usage}
+
+
+def call_openai(model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None, timeout=None,
+                prefix=None):
+    """Call OpenAI API"""
+    openai = get_client('openai')
+
+    try:
+        # System prompt, prior conversation turns, then the new user message
+        messages = build_messages(message, system_prompt, history)
+
+        # Prepare parameters
+        params = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p
+        }
+        if timeout:
+            params["request_timeout"] = timeout
+
+        # Add seed if provided
+        if seed:
+            params["seed"] = int(seed)
+
+        # Requests sharing a long system prompt are routed to the same prompt cache
+        if prefix is not None:
+            params["prompt_cache_key"] = prefix.key
+
+        # Make API call using legacy format
+        with span('provider'):
+            response = openai.ChatCompletion.create(**params)
+        usage = response.get('usage') or {}
+        return completion(response.choices[0].message.content, response.choices[0].get('finish_reason'),
+                          usage.get('prompt_tokens'), usage.get('completion_tokens'), usage.get('total_tokens'),
+                          (usage.get('prompt_tokens_details') or {}).get('cached_tokens'))
+
+    except openai.error.RateLimitError as e:
+        logger.warning(f"OpenAI rate limit: {str(e)}")
+        retry_after = (getattr(e, 'headers', None) or {}).get('retry-after')
+        raise RateLimitExceeded(f"OpenAI API error: {str(e)}", float(retry_after or 1))
+    except Exception as e:
+        logger.error(f"OpenAI API error: {str(e)}")
+        raise Exception(f"OpenAI API error: {str(e)}")
+
+
+def call_google(model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None, timeout=None,
+                prefix=None):
+    """Call Google AI API"""
+    if prefix is not None and prefix.name:
+        # Over REST, like the async gateway: the SDK's from_cached_content() fetches the cache on every
+        # model it builds, and a cache that has expired is told apart by its HTTP status
+        from backend.prefix_cache import CachedContentMissing
+        messages = build_messages(message, system_prompt, history)
+        try:
+            with span('provider'):
+                return prefix.generate(model, messages, temperature, max_tokens, top_p, seed, timeout)
+        except CachedContentMissing:
+            logger.info(f"Cached system prompt for {model} is gone, sending it in full")
+
+    get_client('google')
+    from google.api_core import exceptions as google_exceptions
+
+    try:
+        genai_model = google_model(model, temperature, max_tokens, top_p)
+
+        # Prepare the prompt
+        full_prompt = build_google_prompt(message, system_prompt, history)
+
+        # Make API call - use the same simple approach that worked in debug
+        with span('provider'):
+            response = genai_model.generate_content(full_prompt, request_options={'timeout': timeout} if timeout else None)
+        with span('unpack'):
+            text = google_text(response)
+        usage = getattr(response, 'usage_metadata', None)
+        candidates = getattr(response, 'candidates', None)
+        finish_reason = getattr(candidates[0], 'finish_reason', None) if candidates else None
+        return completion(text, getattr(finish_reason, 'name', finish_reason),
+                          getattr(usage, 'prompt_token_count', None), getattr(usage, 'candidates_token_count', None),
+                          getattr(usage, 'total_token_count', None), getattr(usage, 'cached_content_token_count', None))
+
+    except google_exceptions.ResourceExhausted as e:
+        logger.warning(f"Google AI rate limit: {str(e)}")
+        raise RateLimitExceeded(f"Google AI API error: {str(e)}")
+    except Exception as e:
+        logger.error(f"Google AI API error: {str(e)}")
+        raise Exception(f"Google AI API error: {str(e)}")
+
+
+def call_local(model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None, timeout=None):
+    """Call a self-hosted OpenAI-compatible server"""
+    local = get_client('local')
+    messages = build_messages(message, system_prompt, history)
+    try:
+        with span('provider'):
+            return local.chat(model, messages, temperature, max_tokens, top_p, seed, timeout)
+    except RateLimitExceeded:
+        logger.warning(f"Local model rate limit for {model}")
+        raise
+    except Exception as e:
+        logger.error(f"Local model API error: {str(e)}")
+        raise
+
+
+def list_local_models():
+    """Models served by the local server, or [] when it is not configured"""
+    if not configured('local'):
+        return []
+    return get_client('local').list_models()
+
+
+def google_text(response):
+    """Extract the reply text from a Gemini response, with friendly messages for blocked output"""
+    # Handle response safely - the Google AI API response.text works perfectly
+    try:
+        # Check if response was blocked by safety filters
+        if hasattr(response, 'candidates') and response.candidates and len(response.candidates) > 0:
+            candidate = response.candidates[0]
+            if hasattr(candidate, 'finish_reason'):
+                if candidate.finish_reason == 'SAFETY':
+                    return "I'm sorry, but I can't provide a response to that request due to safety guidelines."
+                elif candidate.finish_reason == 'RECITATION':
+                    return "I'm sorry, but I can't provide a response to that request due to content policy restrictions."
+
+        # Use the direct text property - this works perfectly
+        if response and hasattr(response, 'text') and response.text:
+            return response.text
+
+        # Fallback to candidates if text is not available
+        if hasattr(response, 'candidates') and response.candidates and len(response.candidates) > 0:
+            candidate = response.candidates[0]
+            if hasattr(candidate, 'content') and candidate.content:
+                if hasattr(candidate.content, 'parts') and candidate.content.parts and len(candidate.content.parts) > 0:
+                    part = candidate.content.parts[0]
+                    if hasattr(part, 'text') and part.text:
+                        return part.text
+
+        return "Sorry, I couldn't generate a response. Please try again."
+
+    except Exception as e:
+        logger.error(f"Error accessing response content: {e}")
+        return "Sorry, I encountered an error processing the response. Please try again."
+
+
+def open_openai_stream(model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None, prefix=None):
+    """Start a streaming OpenAI completion"""
+    messages = build_messages(message, system_prompt, history)
+    cache_key = prefix.key if prefix is not None else None
+    return trace_stream(stream_openai(get_client('openai'), model, messages, temperature, max_tokens, top_p, seed,
+                                      cache_key))
+
+
+def open_google_stream(model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None, prefix=None):
+    """Start a streaming Google AI completion"""
+    if prefix is not None and prefix.name:
+        from backend.prefix_cache import CachedContentMissing
+        messages = build_messages(message, system_prompt, history)
+        try:
+            return trace_stream(prefix.stream(model, messages, temperature, max_tokens, top_p, seed))
+        except CachedContentMissing:
+            logger.info(f"Cached system prompt for {model} is gone, sending it in full")
+    genai_model = google_model(model, temperature, max_tokens, top_p)
+    full_prompt = build_google_prompt(message, system_prompt, history)
+    return trace_stream(stream_google(genai_model, full_prompt, temperature, max_tokens, top_p))
+
+
+def open_local_stream(model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None):
+    """Start a streaming completion on the local server"""
+    messages = build_messages(message, system_prompt, history)
+    return trace_stream(get_client('local').stream(model, messages, temperature, max_tokens, top_p, seed))
+
+
+def call_provider(provider, model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None, timeout=None,
+                  prefix=None):
+    """Route a blocking completion to the provider's call function; returns {'text', 'finish_reason', 'usage'}.
+
+    prefix is the system prompt's entry in backend.prefix_cache, if any.
+    """
+    if provider == 'openai':
+        result = call_openai(model, message, system_prompt, temperature, max_tokens, top_p, seed, history, timeout, prefix)
+    elif provider == 'local':
+        return call_local(model, message, system_prompt, temperature, max_tokens, top_p, seed, history, timeout)
+    else:
+        result = call_google(model, message, system_prompt, temperature, max_tokens, top_p, seed, history, timeout, prefix)
+    if prefix is not None:
+        prefix.record(result['usage'])
+    return result
+
+
+def open_provider_stream(provider, model, message, system_prompt, temperature, max_tokens, top_p, seed, history=None,
+                         prefix=None):
+    """Route a streaming completion to the provider's stream function"""
+    if provider == 'openai':
+        events = open_openai_stream(model, message, system_prompt, temperature, max_tokens, top_p, seed, history, prefix)
+    elif provider == 'local':
+        return open_local_stream(model, message, system_prompt, temperature, max_tokens, top_p, seed, history)
+    else:
+        events = open_google_stream(model, message, system_prompt, temperature, max_tokens, top_p, seed, history, prefix)
+    return prefix.record_stream(events) if prefix is not None else events
@@ -0,0 +1,592 @@
+"""
+Resilience layer for provider calls: timeouts, circuit breakers, hedged
+requests and cross-provider fallback.
+
+* Every call runs with a per-provider timeout, since the SDKs have none. The
+  clock starts once the rate limiter has admitted the call (callers pass the
+  admission step as admit), so time spent queueing for quota is never
+  mistaken for a slow provider. Streams must send their first event within
+  the timeout and then never go quiet for longer than the idle timeout.
+* A circuit breaker per provider tracks a rolling window of outcomes and opens
+  when the error rate or the share of slow calls crosses a threshold. Only
+  errors that say the provider is unhealthy count: timeouts, connection
+  failures, 429 and 5xx. A 400, 401 or 404, or a prompt that is too long, is
+  the request's fault and leaves the breaker alone. While open, calls fail
+  fast (or are rerouted); after a cooldown one probe call is let through
+  (half-open) to decide whether to close again.
+* Optional hedging sends a second attempt when the first has not answered
+  within a latency percentile of recent calls and takes whichever finishes
+  first. This trades extra provider spend for lower tail latency.
+* A fallback map reroutes calls for a provider whose circuit is open, e.g.
+  {"google:gemini-2.5-flash": "openai:gpt-4o-mini", "google": "openai:gpt-4o-mini"}.
+
+    PROVIDER_TIMEOUT        seconds before a provider call (or a stream's first event) is abandoned, 0 for no limit (default 60)
+    STREAM_IDLE_TIMEOUT     seconds a stream may go without an event once started, 0 for no limit (default 30)
+    CIRCUIT_WINDOW          rolling window in seconds (default 60)
+    CIRCUIT_MIN_CALLS       calls in the window before the breaker may open (default 10)
+    CIRCUIT_ERROR_RATE      error rate that opens the breaker (default 0.5)
+    CIRCUIT_SLOW_CALL_MS    latency counted as a slow call (default 30000)
+    CIRCUIT_SLOW_RATE       slow-call rate that opens the breaker (default 0.5)
+    CIRCUIT_COOLDOWN        seconds the breaker stays open before probing (default 30)
+    HEDGE_ENABLED           send hedged requests (default false)
+    HEDGE_PERCENTILE        latency percentile that triggers the hedge (default 95)
+    HEDGE_MIN_SAMPLES       latency samples needed before hedging (default 20)
+    FALLBACK_MODELS         JSON fallback map (default {})
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from backend.cancellation import RequestCancelled
+from backend.scheduler import RateLimitExceeded
+from backend.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ProviderUnavailable(Exception):
+    """Raised when a provider's circuit is open and no fallback is configured"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after))
+
+
+class ProviderTimeout(Exception):
+    """Raised when a provider call exceeds its timeout"""
+
+
+class _NotAdmitted(Exception):
+    """A hedged attempt found no rate-limit capacity and was skipped"""
+
+
+# Exception classes (matched by name along the MRO, so the optional SDKs need
+# not be imported) for network failures and provider-side errors
+TRANSIENT_ERRORS = {
+    'TimeoutException', 'TransportError',                                       # httpx
+    'Timeout', 'ConnectionError', 'ChunkedEncodingError',                       # requests
+    'APIConnectionError', 'ServiceUnavailableError', 'TryAgain',               # openai
+    'DeadlineExceeded', 'ServiceUnavailable', 'ServerError', 'TooManyRequests'  # google.api_core
+}
+
+
+def _status(error):
+    """HTTP status carried by a provider or HTTP library exception, if any"""
+    for attribute in ('status_code', 'http_status'):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    code = getattr(error, 'code', None)  # google.api_core errors carry the HTTP status as code
+    if isinstance(code, int) and 100 <= code < 600:
+        return code
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def is_provider_failure(error):
+    """True for errors that count against a provider's circuit: timeouts, connection failures, 429 and 5xx.
+
+    Wrapped errors are followed through __cause__ / __context__, since the
+    provider functions re-raise SDK errors with a friendlier message.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (ProviderTimeout, TimeoutError, ConnectionError, RateLimitExceeded)):
+            return True
+        status = _status(error)
+        if status is not None:
+            return status == 429 or status >= 500
+        if any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class CircuitBreaker:
+    """Rolling-window circuit breaker driven by error rate and slow-call rate"""
+
+    def __init__(self, name, window=60, min_calls=10, error_rate=0.5, slow_call_ms=30000, slow_rate=0.5, cooldown=30):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_ms = slow_call_ms
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._outcomes = deque()
+        self._lock = threading.Lock()
+        self.stats_counters = {'opened': 0, 'rejected': 0}
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def allow(self):
+        """True if a call may go to the provider now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.stats_counters['rejected'] += 1
+            return False
+
+    def retry_after(self):
+        with self._lock:
+            return max(1, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def release(self):
+        """Give back a half-open probe slot without recording an outcome"""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def record(self, ok, latency_ms):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+                if ok and latency_ms < self.slow_call_ms:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._outcomes.append((now, ok, latency_ms >= self.slow_call_ms))
+            self._trim(now)
+            calls = len(self._outcomes)
+            if self.state != CLOSED or calls < self.min_calls:
+                return
+            errors = sum(1 for _, success, _ in self._outcomes if not success)
+            slow = sum(1 for _, _, is_slow in self._outcomes if is_slow)
+            if errors / calls >= self.error_rate or slow / calls >= self.slow_rate:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.stats_counters['opened'] += 1
+        logger.warning(f"{self.name} circuit opened after {len(self._outcomes)} calls in window")
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._outcomes)
+            errors = sum(1 for _, success, _ in self._outcomes if not success)
+            return dict(self.stats_counters, state=self.state, window_calls=calls,
+                        error_rate=round(errors / calls, 4) if calls else 0.0)
+
+
+class Resilience:
+    """Timeouts, circuit breakers, hedging and fallback around provider calls"""
+
+    def __init__(self, timeout=60, breaker_settings=None, hedge_enabled=False, hedge_percentile=95,
+                 hedge_min_samples=20, fallbacks=None, max_workers=256, stream_idle_timeout=30):
+        self.timeout = timeout
+        self.stream_idle_timeout = stream_idle_timeout
+        self.breaker_settings = breaker_settings or {}
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.fallbacks = fallbacks or {}
+        self._breakers = {}
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provider')
+        self.stats_counters = {'timeouts': 0, 'stream_timeouts': 0, 'hedged': 0, 'hedge_wins': 0, 'fallbacks': 0,
+                               'client_errors': 0}
+
+    def breaker(self, provider):
+        with self._lock:
+            if provider not in self._breakers:
+                self._breakers[provider] = CircuitBreaker(provider, **self.breaker_settings)
+            return self._breakers[provider]
+
+    def _count(self, name):
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    # Routing
+
+    def route(self, provider, model):
+        """Return the (provider, model) to call, rerouting around an open circuit"""
+        breaker = self.breaker(provider)
+        if breaker.allow():
+            return provider, model
+
+        fallback = self.fallbacks.get(f'{provider}:{model}') or self.fallbacks.get(provider)
+        if fallback:
+            fallback_provider, _, fallback_model = fallback.partition(':')
+            if fallback_provider != provider and self.breaker(fallback_provider).allow():
+                self._count('fallbacks')
+                logger.warning(f"{provider} circuit open, falling back to {fallback}")
+                return fallback_provider, fallback_model or model
+
+        raise ProviderUnavailable(f'{provider} is temporarily unavailable (circuit open)', breaker.retry_after())
+
+    def record(self, provider, model, ok, latency_ms):
+        self.breaker(provider).record(ok, latency_ms)
+        if ok:
+            with self._lock:
+                self._latencies.setdefault((provider, model), deque(maxlen=500)).append(latency_ms)
+
+    def record_error(self, provider, model, error, latency_ms):
+        """Record a failed call against the breaker, unless the error was the request's fault"""
+        if is_provider_failure(error):
+            self.record(provider, model, False, latency_ms)
+        else:
+            self._count('client_errors')
+            self.breaker(provider).release()
+
+    def _admit(self, provider, admit, target):
+        """Run the admission step for a routed call before its clock starts"""
+        if admit is None:
+            return
+        try:
+            admit(*target)
+        except BaseException:
+            self.breaker(provider).release()
+            raise
+
+    def hedge_delay(self, provider, model):
+        """Seconds to wait before hedging, or None when hedging is off or there is too little data"""
+        if not self.hedge_enabled:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies.get((provider, model), ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return percentile(samples, self.hedge_percentile) / 1000.0
+
+    # Blocking calls
+
+    def call(self, provider, model, attempt, token=None, admit=None):
+        """Run attempt(provider, model) with timeout, hedging and fallback.
+
+        admit(provider, model), when given, waits for rate-limit capacity for
+        the routed target before the timeout starts (and again for a hedge).
+        Returns (result, provider, model) where provider/model are the ones
+        that actually served the request. Cancelling the token stops the wait
+        with RequestCancelled; the attempt itself cannot be interrupted.
+        """
+        provider, model = self.route(provider, model)
+        self._admit(provider, admit, (provider, model))
+        start = time.perf_counter()
+        try:
+            result = self._run(provider, model, attempt, token, admit)
+        except RequestCancelled:
+            # A departed client says nothing about provider health
+            self.breaker(provider).release()
+            raise
+        except Exception as e:
+            self.record_error(provider, model, e, (time.perf_counter() - start) * 1000)
+            raise
+        self.record(provider, model, True, (time.perf_counter() - start) * 1000)
+        return result, provider, model
+
+    @staticmethod
+    def _hedge(attempt, admit):
+        """The hedged attempt, admitted like the first one; skipped when there is no capacity for it"""
+        if admit is None:
+            return attempt
+
+        def hedged(provider, model):
+            try:
+                admit(provider, model)
+            except RateLimitExceeded:
+                raise _NotAdmitted()
+            return attempt(provider, model)
+        return hedged
+
+    def _run(self, provider, model, attempt, token=None, admit=None):
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        cancel = [token.future] if token is not None else []
+        # Run attempts in a copy of the caller's context so request traces follow them
+        first = self._pool.submit(contextvars.copy_context().run, attempt, provider, model)
+        futures = [first]
+        delay = self.hedge_delay(provider, model)
+        if delay is not None:
+            done, _ = wait(futures + cancel, timeout=min(delay, self.timeout or delay), return_when=FIRST_COMPLETED)
+            if token is not None:
+                token.check()
+            if not done:
+                self._count('hedged')
+                futures.append(self._pool.submit(contextvars.copy_context().run, self._hedge(attempt, admit), provider, model))
+
+        error = None
+        while futures:
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                break
+            done, _ = wait(futures + cancel, timeout=remaining, return_when=FIRST_COMPLETED)
+            if token is not None:
+                token.check()
+            if not done:
+                break
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None:
+                    if future is not first:
+                        self._count('hedge_wins')
+                    return future.result()
+                if not isinstance(future.exception(), _NotAdmitted):
+                    error = future.exception()
+        if error is not None and not futures:
+            raise error
+        self._count('timeouts')
+        raise ProviderTimeout(f'{provider} did not respond within {self.timeout:g}s')
+
+    def open_stream(self, provider, model, opener, admit=None):
+        """Open opener(provider, model) -> stream events behind the breaker and fallback map.
+
+        admit(provider, model) runs first, as for call(). Streams are not
+        hedged; the outcome is recorded when the stream ends, and the done
+        event carries served_by when the request was rerouted.
+        """
+        target = self.route(provider, model)
+        self._admit(target[0], admit, target)
+        start = time.perf_counter()
+        try:
+            events = opener(*target)
+        except Exception as e:
+            self.record_error(*target, e, (time.perf_counter() - start) * 1000)
+            raise
+        return self._recorded(self._paced(events, target[0]), target, (provider, model), start)
+
+    def _paced(self, events, provider):
+        """Read events on a helper thread, raising ProviderTimeout when the first event takes longer than the
+        provider timeout or a later one longer than the idle timeout.
+
+        A blocking SDK iterator cannot be interrupted, so an abandoned reader
+        closes the upstream stream at its next event.
+        """
+        if not self.timeout and not self.stream_idle_timeout:
+            yield from events
+            return
+        buffer = queue.Queue()
+        stopped = threading.Event()
+
+        def read():
+            try:
+                for event in events:
+                    buffer.put((event, None))
+                    if stopped.is_set():
+                        break
+                buffer.put((None, None))
+            except BaseException as e:
+                buffer.put((None, e))
+            finally:
+                close = getattr(events, 'close', None)
+                if close is not None:
+                    close()
+
+        # Run in a copy of the caller's context so request traces follow the reads
+        threading.Thread(target=contextvars.copy_context().run, args=(read,), daemon=True,
+                         name='stream-reader').start()
+        timeout = self.timeout
+        try:
+            while True:
+                try:
+                    event, error = buffer.get(timeout=timeout or None)
+                except queue.Empty:
+                    self._count('stream_timeouts')
+                    raise ProviderTimeout(f'{provider} stream sent nothing for {timeout:g}s')
+                if error is not None:
+                    raise error
+                if event is None:
+                    return
+                yield event
+                timeout = self.stream_idle_timeout
+        finally:
+            stopped.set()
+
+    def _recorded(self, events, target, requested, start):
+        try:
+            for event in events:
+                if event['type'] == 'done' and target != requested:
+                    event = dict(event, served_by={'provider': target[0], 'model': target[1]})
+                yield event
+        except Exception as e:
+            self.record_error(*target, e, (time.perf_counter() - start) * 1000)
+            raise
+        except GeneratorExit:
+            self.breaker(target[0]).release()  # Client went away; no verdict on the provider
+            raise
+        self.record(*target, True, (time.perf_counter() - start) * 1000)
+
+    # Asyncio variants
+
+    async def _admit_async(self, provider, admit, target):
+        if admit is None:
+            return
+        try:
+            await admit(*target)
+        except BaseException:
+            self.breaker(provider).release()
+            raise
+
+    async def call_async(self, provider, model, attempt, admit=None):
+        """Async counterpart of call(); attempt(provider, model) and admit(provider, model) return awaitables"""
+        provider, model = self.route(provider, model)
+        await self._admit_async(provider, admit, (provider, model))
+        start = time.perf_counter()
+        try:
+            result = await self._run_async(provider, model, attempt, admit)
+        except asyncio.CancelledError:
+            self.breaker(provider).release()
+            raise
+        except Exception as e:
+            self.record_error(provider, model, e, (time.perf_counter() - start) * 1000)
+            raise
+        self.record(provider, model, True, (time.perf_counter() - start) * 1000)
+        return result, provider, model
+
+    @staticmethod
+    def _hedge_async(attempt, admit):
+        if admit is None:
+            return attempt
+
+        async def hedged(provider, model):
+            try:
+                await admit(provider, model)
+            except RateLimitExceeded:
+                raise _NotAdmitted()
+            return await attempt(provider, model)
+        return hedged
+
+    async def _run_async(self, provider, model, attempt, admit=None):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout if self.timeout else None
+        first = asyncio.ensure_future(attempt(provider, model))
+        tasks = [first]
+        try:
+            delay = self.hedge_delay(provider, model)
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=min(delay, self.timeout or delay))
+                if not done:
+                    self._count('hedged')
+                    tasks.append(asyncio.ensure_future(self._hedge_async(attempt, admit)(provider, model)))
+
+            error = None
+            while tasks:
+                remaining = deadline - loop.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                done, _ = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        if task is not first:
+                            self._count('hedge_wins')
+                        return task.result()
+                    if not isinstance(task.exception(), _NotAdmitted):
+                        error = task.exception()
+            if error is not None and not tasks:
+                raise error
+            self._count('timeouts')
+            raise ProviderTimeout(f'{provider} did not respond within {self.timeout:g}s')
+        finally:
+            # Cancelling the losing attempt closes its upstream connection
+            for task in tasks:
+                task.cancel()
+
+    async def open_stream_async(self, provider, model, opener, admit=None):
+        """Async counterpart of open_stream(); opener(provider, model) is a coroutine returning an async iterator"""
+        target = self.route(provider, model)
+        await self._admit_async(target[0], admit, target)
+        start = time.perf_counter()
+        try:
+            events = await opener(*target)
+        except Exception as e:
+            self.record_error(*target, e, (time.perf_counter() - start) * 1000)
+            raise
+        return self._recorded_async(self._paced_async(events, target[0]), target, (provider, model), start)
+
+    async def _paced_async(self, events, provider):
+        """Async counterpart of _paced(); a timed-out read is cancelled and the upstream closed"""
+        iterator = events.__aiter__()
+        timeout = self.timeout
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(iterator.__anext__(), timeout or None)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self._count('stream_timeouts')
+                    raise ProviderTimeout(f'{provider} stream sent nothing for {timeout:g}s')
+                yield event
+                timeout = self.stream_idle_timeout
+        finally:
+            aclose = getattr(iterator, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    async def _recorded_async(self, events, target, requested, start):
+        try:
+            async for event in events:
+                if event['type'] == 'done' and target != requested:
+                    event = dict(event, served_by={'provider': target[0], 'model': target[1]})
+                yield event
+        except Exception as e:
+            self.record_error(*target, e, (time.perf_counter() - start) * 1000)
+            raise
+        except GeneratorExit:
+            self.breaker(target[0]).release()
+            raise
+        self.record(*target, True, (time.perf_counter() - start) * 1000)
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            counters = dict(self.stats_counters)
+        counters['breakers'] = {provider: breaker.stats() for provider, breaker in breakers.items()}
+        counters['hedge_enabled'] = self.hedge_enabled
+        return counters
+
+
+def create_resilience():
+    """Build the process-wide resilience layer from environment settings"""
+    try:
+        fallbacks = json.loads(os.getenv('FALLBACK_MODELS', '{}'))
+    except ValueError as e:
+        logger.warning(f"Ignoring invalid FALLBACK_MODELS: {e}")
+        fallbacks = {}
+    return Resilience(
+        timeout=float(os.getenv('PROVIDER_TIMEOUT', 60)),
+        breaker_settings={
+            'window': float(os.getenv('CIRCUIT_WINDOW', 60)),
+            'min_calls': int(os.getenv('CIRCUIT_MIN_CALLS', 10)),
+            'error_rate': float(os.getenv('CIRCUIT_ERROR_RATE', 0.5)),
+            'slow_call_ms': float(os.getenv('CIRCUIT_SLOW_CALL_MS', 30000)),
+            'slow_rate': float(os.getenv('CIRCUIT_SLOW_RATE', 0.5)),
+            'cooldown': float(os.getenv('CIRCUIT_COOLDOWN', 30))
+        },
+        hedge_enabled=os.getenv('HEDGE_ENABLED', 'false').lower() == 'true',
+        hedge_percentile=float(os.getenv('HEDGE_PERCENTILE', 95)),
+        hedge_min_samples=int(os.getenv('HEDGE_MIN_SAMPLES', 20)),
+        fallbacks=fallbacks,
+        stream_idle_timeout=float(os.getenv('STREAM_IDLE_TIMEOUT', 30))
+    )
@@ -0,0 +1,227 @@
+"""
+Response encoding shared by the Flask app, the ASGI app and the Vercel functions.
+
+JSON is serialized with orjson when it is installed (several times faster
+than the standard library, and it produces bytes directly), otherwise with
+the standard library in compact form. Bodies of COMPRESS_MIN_SIZE bytes or
+more are compressed with brotli (when installed) or gzip if the client
+accepts it. Streamed JSON lines (batch results) are compressed chunk by
+chunk with a flush after each one, so results still arrive as they finish.
+Server-Sent Events are never compressed: their small events would only be
+delayed. GET responses carry an ETag, so a client revalidating an unchanged
+resource gets an empty 304.
+
+    JSON_BACKEND         orjson or json (default orjson when installed)
+    COMPRESS_ENABLED     set to 'false' to send every response uncompressed (default true)
+    COMPRESS_MIN_SIZE    smallest body in bytes worth compressing (default 1024)
+    COMPRESS_LEVEL       gzip level, 1-9 (default 6)
+    BROTLI_QUALITY       brotli quality, 0-11 (default 4)
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Content types worth compressing; text/event-stream is left out on purpose
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/css',
+                'application/javascript', 'text/javascript')
+
+# Of those, the ones compressed when streamed
+STREAMED = ('application/x-ndjson',)
+
+
+def _json_dumps(obj):
+    """Serialize an object to compact JSON bytes"""
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def _orjson_dumps(obj):
+    """Serialize an object to compact JSON bytes with orjson"""
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # Objects orjson cannot serialize (e.g. integers above 64 bits) go the slow way
+        return _json_dumps(obj)
+
+
+if os.getenv('JSON_BACKEND', 'orjson') == 'orjson' and orjson is not None:
+    JSON_BACKEND = 'orjson'
+    dumps = _orjson_dumps
+    loads = orjson.loads
+else:
+    JSON_BACKEND = 'json'
+    dumps = _json_dumps
+    loads = json.loads
+
+
+def etag(body):
+    """Strong ETag for a response body"""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def not_modified(if_none_match, etag):
+    """Whether an If-None-Match header value matches the current ETag (weak comparison)"""
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or opaque in candidates or f'W/{opaque}' in candidates
+
+
+def weak(etag):
+    """The weak form of an ETag, for a body that was re-encoded (compressed) after it was computed"""
+    return etag if etag.startswith('W/') else f'W/{etag}'
+
+
+def accepted_encodings(accept_encoding):
+    """Content codings with their q-values from an Accept-Encoding header"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+class ResponseEncoder:
+    """Compresses response bodies for clients that accept it and counts what it saved"""
+
+    def __init__(self, enabled=True, min_size=1024, gzip_level=6, brotli_quality=4):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+        self.stats_counters = {'compressed': 0, 'streams': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_ms': 0.0,
+                               'skipped_small': 0}
+
+    def negotiate(self, accept_encoding):
+        """'br', 'gzip' or None for an Accept-Encoding header"""
+        if not self.enabled or not accept_encoding:
+            return None
+        accepted = accepted_encodings(accept_encoding)
+        wildcard = accepted.get('*', 0)
+        if brotli is not None and accepted.get('br', wildcard) > 0:
+            return 'br'
+        if accepted.get('gzip', wildcard) > 0:
+            return 'gzip'
+        return None
+
+    @staticmethod
+    def compressible(content_type, streamed=False):
+        mimetype = (content_type or '').split(';')[0].strip().lower()
+        return mimetype in (STREAMED if streamed else COMPRESSIBLE)
+
+    def compress(self, body, encoding):
+        """Compressed body, or None when it is too small or would not shrink"""
+        if len(body) < self.min_size:
+            with self._lock:
+                self.stats_counters['skipped_small'] += 1
+            return None
+        start = time.thread_time()
+        if encoding == 'br':
+            compressed = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        self._record('compressed', len(body), len(compressed), time.thread_time() - start)
+        return compressed if len(compressed) < len(body) else None
+
+    def compress_stream(self, chunks, encoding):
+        """Compress a streamed body, flushing after every chunk so each one reaches the client at once"""
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            process, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)  # 31: gzip container
+            process, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+        size_in = size_out = 0
+        cpu = 0.0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                start = time.thread_time()
+                data = process(chunk) + flush()
+                cpu += time.thread_time() - start
+                size_in += len(chunk)
+                size_out += len(data)
+                yield data
+            data = finish()
+            size_out += len(data)
+            yield data
+        finally:
+            # Closing the compressed stream closes the one it wraps
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+            self._record('streams', size_in, size_out, cpu)
+
+    def _record(self, counter, size_in, size_out, cpu):
+        with self._lock:
+            self.stats_counters[counter] += 1
+            self.stats_counters['bytes_in'] += size_in
+            self.stats_counters['bytes_out'] += size_out
+            self.stats_counters['cpu_ms'] += cpu * 1000
+
+    def respond(self, status, body, content_type, request_headers, etag_value=None, conditional=False):
+        """(status, headers, body) for a complete response from a plain HTTP handler.
+
+        With conditional=True a 200 carries an ETag (etag_value, or one computed from
+        the body) and becomes an empty 304 when the client's If-None-Match matches.
+        """
+        headers = {}
+        if conditional and status == 200:
+            etag_value = etag_value or etag(body)
+            headers['ETag'] = etag_value
+            if not_modified(request_headers.get('If-None-Match'), etag_value):
+                return 304, headers, b''
+        headers['Content-Type'] = content_type
+        if self.compressible(content_type):
+            headers['Vary'] = 'Accept-Encoding'
+            encoding = self.negotiate(request_headers.get('Accept-Encoding'))
+            compressed = self.compress(body, encoding) if encoding else None
+            if compressed is not None:
+                body = compressed
+                headers['Content-Encoding'] = encoding
+                if 'ETag' in headers:
+                    headers['ETag'] = weak(headers['ETag'])
+        headers['Content-Length'] = str(len(body))
+        return status, headers, body
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.stats_counters, cpu_ms=round(self.stats_counters['cpu_ms'], 1))
+        stats.update(json_backend=JSON_BACKEND, brotli=brotli is not None, enabled=self.enabled)
+        return stats
+
+
+def create_response_encoder():
+    """Build the process-wide response encoder from environment settings"""
+    return ResponseEncoder(
+        enabled=os.getenv('COMPRESS_ENABLED', 'true').lower() != 'false',
+        min_size=int(os.getenv('COMPRESS_MIN_SIZE', 1024)),
+        gzip_level=int(os.getenv('COMPRESS_LEVEL', 6)),
+        brotli_quality=int(os.getenv('BROTLI_QUALITY', 4))
+    )
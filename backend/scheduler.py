@@ -0,0 +1,250 @@
+"""
+Per-provider rate limiting and priority scheduling in front of provider calls.
+
+Every upstream call first acquires capacity from token buckets for requests
+per minute (RPM) and tokens per minute (TPM), at provider level and optionally
+per model. Callers that cannot be admitted immediately wait in a bounded
+per-provider queue ordered by priority (interactive before batch) and arrival.
+When the queue is full, or a caller would wait too long, RateLimitExceeded is
+raised straight away so the endpoint can answer 429 with Retry-After.
+
+The buckets live in process memory. When several worker processes serve the
+same account (`start_backend.py --production` sets RATE_LIMIT_WORKERS to the
+worker count) every limit is divided between them, so together they stay
+within the configured RPM/TPM instead of multiplying it.
+
+    RATE_LIMIT_OPENAI_RPM / RATE_LIMIT_OPENAI_TPM   provider limits (default unlimited)
+    RATE_LIMIT_GOOGLE_RPM / RATE_LIMIT_GOOGLE_TPM
+    RATE_LIMIT_LOCAL_RPM / RATE_LIMIT_LOCAL_TPM
+    RATE_LIMIT_MODELS         JSON per-model limits, e.g. {"openai:gpt-4o": {"rpm": 500, "tpm": 30000}}
+    RATE_LIMIT_WORKERS        processes sharing the limits; each enforces its share (default 1)
+    SCHEDULER_MAX_QUEUE       waiting requests allowed per provider (default 100)
+    SCHEDULER_MAX_WAIT        seconds an interactive request may wait (default 30)
+    SCHEDULER_MAX_WAIT_BATCH  seconds a batch request may wait (default 300)
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from backend.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {'interactive': 0, 'batch': 1}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint in seconds"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after or 1)))
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at capacity per minute"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available (0 when it is available now)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # Oversized requests wait for a full bucket
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Ticket:
+    __slots__ = ('provider', 'model', 'tokens', 'priority', 'enqueued')
+
+    def __init__(self, provider, model, tokens, priority):
+        self.provider = provider
+        self.model = model
+        self.tokens = tokens
+        self.priority = priority
+        self.enqueued = time.monotonic()
+
+
+class ProviderScheduler:
+    """Token-bucket admission control with a bounded priority queue per provider"""
+
+    def __init__(self, provider_limits=None, model_limits=None, max_queue=100, max_wait=30, max_wait_batch=300):
+        self.max_queue = max_queue
+        self.max_wait = {'interactive': max_wait, 'batch': max_wait_batch}
+        self._buckets = {}
+        for scope, limits in list((provider_limits or {}).items()) + list((model_limits or {}).items()):
+            if limits.get('rpm'):
+                self._buckets[(scope, 'rpm')] = TokenBucket(limits['rpm'])
+            if limits.get('tpm'):
+                self._buckets[(scope, 'tpm')] = TokenBucket(limits['tpm'])
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._queues = {}
+        self._sequence = itertools.count()
+        self._queue_times = deque(maxlen=1000)
+        self.stats_counters = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0}
+
+    def _buckets_for(self, ticket):
+        for scope in (ticket.provider, f'{ticket.provider}:{ticket.model}'):
+            for kind, amount in (('rpm', 1), ('tpm', ticket.tokens)):
+                bucket = self._buckets.get((scope, kind))
+                if bucket is not None:
+                    yield bucket, amount
+
+    def _try_admit(self, entry):
+        """Admit the ticket if it heads its queue and the buckets allow; return seconds to wait otherwise"""
+        ticket = entry[2]
+        queue = self._queues[ticket.provider]
+        if queue[0] is not entry:
+            return None  # Someone with higher priority (or earlier arrival) goes first
+
+        now = time.monotonic()
+        wait = 0.0
+        buckets = list(self._buckets_for(ticket))
+        for bucket, amount in buckets:
+            wait = max(wait, bucket.wait_time(amount, now))
+        if wait > 0:
+            return wait
+
+        for bucket, amount in buckets:
+            bucket.consume(amount)
+        heapq.heappop(queue)
+        queued_for = now - ticket.enqueued
+        self._queue_times.append(queued_for)
+        self.stats_counters['admitted'] += 1
+        self._condition.notify_all()
+        return 0.0
+
+    def _enqueue(self, provider, model, tokens, priority):
+        queue = self._queues.setdefault(provider, [])
+        if len(queue) >= self.max_queue:
+            self.stats_counters['rejected'] += 1
+            raise RateLimitExceeded(f'{provider} request queue is full', self._retry_hint(provider, len(queue)))
+        ticket = _Ticket(provider, model, tokens, priority)
+        entry = (PRIORITIES.get(priority, 0), next(self._sequence), ticket)
+        heapq.heappush(queue, entry)
+        return entry
+
+    def _abandon(self, entry):
+        queue = self._queues[entry[2].provider]
+        queue.remove(entry)
+        heapq.heapify(queue)
+        self.stats_counters['timed_out'] += 1
+        self._condition.notify_all()
+        return RateLimitExceeded(
+            f'{entry[2].provider} rate limit: request waited too long in queue',
+            self._retry_hint(entry[2].provider, len(queue))
+        )
+
+    def _retry_hint(self, provider, depth):
+        bucket = self._buckets.get((provider, 'rpm'))
+        if bucket is None:
+            return 1
+        return (depth + 1) / bucket.rate
+
+    def acquire(self, provider, model, tokens, priority='interactive'):
+        """Block until the call may proceed; return the time spent queued in seconds"""
+        if not self._buckets:
+            return 0.0
+        deadline = time.monotonic() + self.max_wait.get(priority, self.max_wait['interactive'])
+        with self._condition:
+            entry = self._enqueue(provider, model, tokens, priority)
+            first = True
+            while True:
+                wait = self._try_admit(entry)
+                if wait == 0.0:
+                    return time.monotonic() - entry[2].enqueued
+                if first:
+                    self.stats_counters['queued'] += 1
+                    first = False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (wait is not None and wait > remaining):
+                    raise self._abandon(entry)
+                self._condition.wait(min(wait if wait is not None else remaining, remaining))
+
+    async def acquire_async(self, provider, model, tokens, priority='interactive'):
+        """Async counterpart of acquire() that sleeps on the event loop instead of blocking"""
+        if not self._buckets:
+            return 0.0
+        deadline = time.monotonic() + self.max_wait.get(priority, self.max_wait['interactive'])
+        with self._lock:
+            entry = self._enqueue(provider, model, tokens, priority)
+        first = True
+        while True:
+            with self._lock:
+                wait = self._try_admit(entry)
+                if wait == 0.0:
+                    return time.monotonic() - entry[2].enqueued
+                if first:
+                    self.stats_counters['queued'] += 1
+                    first = False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (wait is not None and wait > remaining):
+                    raise self._abandon(entry)
+            # Poll: async waiters are not woken by the condition
+            await asyncio.sleep(min(wait if wait is not None else 0.05, remaining, 0.25))
+
+    def stats(self):
+        with self._lock:
+            queue_times = sorted(self._queue_times)
+            return dict(
+                self.stats_counters,
+                queue_depth={provider: len(queue) for provider, queue in self._queues.items()},
+                max_queue=self.max_queue,
+                queue_time_ms={
+                    'p50': round(percentile(queue_times, 50) * 1000, 1) if queue_times else None,
+                    'p95': round(percentile(queue_times, 95) * 1000, 1) if queue_times else None,
+                    'max': round(queue_times[-1] * 1000, 1) if queue_times else None
+                }
+            )
+
+
+def worker_share(limits, workers):
+    """Divide rpm/tpm limits between worker processes that each hold their own buckets"""
+    if workers <= 1:
+        return limits
+    return {kind: float(value) / workers if value else value for kind, value in limits.items()}
+
+
+def create_scheduler():
+    """Build the process-wide scheduler from environment settings"""
+    workers = max(1, int(os.getenv('RATE_LIMIT_WORKERS', 1)))
+    provider_limits = {}
+    for provider in ('openai', 'google', 'local'):
+        prefix = f'RATE_LIMIT_{provider.upper()}'
+        provider_limits[provider] = worker_share({
+            'rpm': float(os.getenv(f'{prefix}_RPM', 0)),
+            'tpm': float(os.getenv(f'{prefix}_TPM', 0))
+        }, workers)
+    try:
+        model_limits = json.loads(os.getenv('RATE_LIMIT_MODELS', '{}'))
+    except ValueError as e:
+        logger.warning(f"Ignoring invalid RATE_LIMIT_MODELS: {e}")
+        model_limits = {}
+    model_limits = {scope: worker_share(limits, workers) for scope, limits in model_limits.items()}
+    return ProviderScheduler(
+        provider_limits,
+        model_limits,
+        max_queue=int(os.getenv('SCHEDULER_MAX_QUEUE', 100)),
+        max_wait=float(os.getenv('SCHEDULER_MAX_WAIT', 30)),
+        max_wait_batch=float(os.getenv('SCHEDULER_MAX_WAIT_BATCH', 300))
+    )
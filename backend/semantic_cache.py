@@ -0,0 +1,371 @@
+"""
+Semantic cache: serves a stored completion for a paraphrase of an earlier prompt.
+
+Sits behind the exact-match response cache. Prompts are embedded locally
+(signed feature hashing of words, word pairs and character n-grams; no model
+download) and kept as rows of a NumPy matrix per scope, so a lookup is one
+matrix-vector product over the scope's entries. A hit needs cosine similarity
+at or above the threshold within the same scope: provider, model, system
+prompt and sampling parameters all have to match exactly, only the user
+message may differ. Requests with conversation history are never served from
+it. The same rules as for the exact-match cache decide what is looked up and
+stored (deterministic requests, complete answers; see backend/cache.py). Full
+entries are evicted least recently used.
+
+The hashed embedding measures shared wording, not meaning: "largest" and
+"smallest", or "to French" and "to Spanish", differ by a single word. So a
+hit also needs the prompts' exact terms to match, in order: numbers,
+negations, quoted text, natural and programming language names, and
+contrast words such as largest/smallest or increase/decrease. The default
+threshold is the lowest that serves none of the near-miss pairs in
+benchmarks/semantic_calibration.py, plus a margin; run it to recalibrate
+after changing the embedder.
+
+Off by default; it needs NumPy. A different embedder can be plugged in as a
+'module:factory' path whose factory returns an object with
+embed(texts) -> float32 array of L2-normalised rows.
+
+    SEMANTIC_CACHE_ENABLED     set to 'true' to enable (default false)
+    SEMANTIC_CACHE_THRESHOLD   minimum cosine similarity for a hit (default 0.94)
+    SEMANTIC_CACHE_SIZE        max entries (default 10000)
+    SEMANTIC_CACHE_TTL         entry lifetime in seconds (default 3600)
+    SEMANTIC_CACHE_DIM         hashed embedding dimensions (default 512)
+    SEMANTIC_CACHE_EMBEDDER    'hashed' or 'module:factory' (default hashed)
+"""
+import hashlib
+import importlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+from backend.cache import cacheable_result
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'[^\W_]+')
+
+# Quoted text, numbers and words (with contractions), in order
+_TERM = re.compile(r'"[^"]*"|\u201c[^\u201d]*\u201d|`[^`]*`|\d+(?:[.,]\d+)*|[^\W_]+(?:[+#]+|[\'\u2019][^\W_]+)?')
+
+INITIAL_CAPACITY = 256
+DUPLICATE_SIMILARITY = 0.995  # A store this close to an existing entry replaces it
+
+# Lowest threshold without a near-miss hit in benchmarks/semantic_calibration.py, plus a margin
+DEFAULT_THRESHOLD = 0.94
+
+# Words that carry no meaning for matching ("how do I" / "how can I")
+STOP_WORDS = frozenset(
+    'a an the do does did can could would will shall please you your my me i to of for about is are was were be '
+    'on in into with some any it this that there'.split()
+)
+
+NEGATIONS = frozenset('not no never none nothing nobody neither nor without cannot'.split())
+
+# Words whose opposite is otherwise a near-identical prompt
+CONTRASTS = frozenset(
+    'largest smallest biggest least most maximum minimum max min fastest slowest faster slower best worst better '
+    'worse pros cons increase decrease more less higher lower highest lowest first second third last before after '
+    'above below short long shortest longest true false ascending descending add remove enable disable '
+    'encrypt decrypt encode decode'.split()
+)
+
+# Target languages: translating to one or writing code in one
+LANGUAGES = frozenset(
+    'english french spanish german italian portuguese dutch russian chinese mandarin cantonese japanese korean '
+    'arabic hindi bengali turkish polish swedish norwegian danish finnish greek hebrew latin ukrainian vietnamese '
+    'thai indonesian python javascript typescript java rust go golang ruby php kotlin swift scala c c++ c# csharp '
+    'sql bash powershell haskell perl lua r matlab'.split()
+)
+
+
+def exact_terms(text):
+    """The terms two prompts must share, in order, to be served each other's answer"""
+    terms = []
+    for term in _TERM.findall(text.lower()):
+        if (term[0] in '"`\u201c' or term[0].isdigit() or term in NEGATIONS or term.endswith(("n't", "n\u2019t"))
+                or term in CONTRASTS or term in LANGUAGES):
+            terms.append(term)
+    return tuple(terms)
+
+
+def _terms_key(text):
+    digest = hashlib.blake2b('\0'.join(exact_terms(text)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def semantic_scope(provider, model, system_prompt, temperature, top_p, max_tokens, seed):
+    """Hash of everything except the user message; only prompts in the same scope can match"""
+    normalized = [
+        (provider or '').strip().lower(),
+        (model or '').strip(),
+        (system_prompt or '').strip(),
+        round(float(temperature), 4),
+        round(float(top_p), 4),
+        int(max_tokens),
+        int(seed) if seed not in (None, '') else None
+    ]
+    digest = hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little', signed=True)
+
+
+class HashedNgramEmbedder:
+    """Signed feature hashing of word unigrams, word bigrams and character n-grams, stop words left out.
+
+    Bigrams weigh double so that swapped words ("100 Fahrenheit to Celsius" and
+    "100 Celsius to Fahrenheit") do not look alike.
+    """
+
+    def __init__(self, dim=512, char_ngrams=(3, 4), bigram_weight=2.0):
+        import numpy
+        self.np = numpy
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+        self.bigram_weight = bigram_weight
+
+    def features(self, text):
+        """(features, weights)"""
+        words = [word for word in _WORD.findall(text.lower()) if word not in STOP_WORDS]
+        bigrams = [f'{a} {b}' for a, b in zip(words, words[1:])]
+        features = words + bigrams
+        for word in words:
+            padded = f'<{word}>'
+            for n in self.char_ngrams:
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        weights = [1.0] * len(features)
+        weights[len(words):len(words) + len(bigrams)] = [self.bigram_weight] * len(bigrams)
+        return features, weights
+
+    def embed(self, texts):
+        np = self.np
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features, weights = self.features(text)
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(f.encode('utf-8')) for f in features), dtype=np.uint32, count=len(features))
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0) * np.asarray(weights)
+            vectors[row] = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class _Scope:
+    """Rows of one scope: embeddings matrix plus per-row exact terms, expiry, recency and value"""
+
+    def __init__(self, np, dim):
+        self.vectors = np.zeros((INITIAL_CAPACITY, dim), dtype=np.float32)
+        self.terms = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.expires = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        self.last_used = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.values = []
+        self.size = 0
+
+    def grow(self, np):
+        capacity = self.vectors.shape[0] * 2
+        for name in ('vectors', 'terms', 'expires', 'last_used'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def remove(self, row):
+        """Drop a row by moving the last row into its place"""
+        last = self.size - 1
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.terms[row] = self.terms[last]
+            self.expires[row] = self.expires[last]
+            self.last_used[row] = self.last_used[last]
+            self.values[row] = self.values[last]
+        self.values.pop()
+        self.size = last
+
+
+class SemanticCache:
+    """Cosine-similarity lookup over per-scope NumPy matrices of prompt embeddings, LRU + TTL"""
+
+    def __init__(self, embedder, threshold=DEFAULT_THRESHOLD, max_entries=10000, ttl=3600):
+        import numpy
+        self.np = numpy
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._scopes = {}
+        self._size = 0
+        self._clock = 0
+        self.stats_counters = {'hits': 0, 'misses': 0, 'stores': 0, 'replaced': 0, 'evictions': 0, 'terms_mismatch': 0,
+                               'uncacheable': 0}
+        self._similarity_total = 0.0
+
+    def _embed(self, text):
+        return self.embedder.embed([text])[0]
+
+    def _search(self, entries, vector, terms, now):
+        """(row, similarity, terms match) of the closest live row, or (None, -1, False); caller holds the lock.
+
+        Rows whose exact terms match win over closer rows whose terms do not.
+        """
+        if entries is None or entries.size == 0:
+            return None, -1.0, False
+        n = entries.size
+        similarities = entries.vectors[:n] @ vector
+        similarities = self.np.where(entries.expires[:n] > now, similarities, -1.0)
+        matching = self.np.where(entries.terms[:n] == terms, similarities, -1.0)
+        row = int(matching.argmax())
+        if matching[row] > -1.0:
+            return row, float(matching[row]), True
+        row = int(similarities.argmax())
+        return row, float(similarities[row]), False
+
+    def _evict(self, now):
+        """Remove the least recently used row across all scopes, expired rows first; caller holds the lock"""
+        victim, victim_row, victim_rank = None, None, None
+        for scope, entries in self._scopes.items():
+            n = entries.size
+            if not n:
+                continue
+            ranks = self.np.where(entries.expires[:n] > now, entries.last_used[:n], -1)
+            row = int(ranks.argmin())
+            if victim_rank is None or ranks[row] < victim_rank:
+                victim, victim_row, victim_rank = scope, row, ranks[row]
+        entries = self._scopes[victim]
+        entries.remove(victim_row)
+        if entries.size == 0:
+            del self._scopes[victim]
+        self._size -= 1
+        self.stats_counters['evictions'] += 1
+
+    def get(self, scope, text):
+        """Return (value, similarity) for the closest cached prompt in scope, or None below the threshold"""
+        vector = self._embed(text)
+        terms = _terms_key(text)
+        now = time.time()
+        with self._lock:
+            entries = self._scopes.get(scope)
+            row, similarity, terms_match = self._search(entries, vector, terms, now)
+            if row is None or similarity < self.threshold or not terms_match:
+                self.stats_counters['misses'] += 1
+                if row is not None and similarity >= self.threshold:
+                    self.stats_counters['terms_mismatch'] += 1
+                return None
+            self._clock += 1
+            entries.last_used[row] = self._clock
+            self.stats_counters['hits'] += 1
+            self._similarity_total += similarity
+            return entries.values[row], round(similarity, 4)
+
+    def set(self, scope, text, value):
+        """Store a JSON-serialisable result for a prompt in scope; incomplete or blocked results are skipped"""
+        if not cacheable_result(value):
+            with self._lock:
+                self.stats_counters['uncacheable'] += 1
+            return
+        vector = self._embed(text)
+        terms = _terms_key(text)
+        now = time.time()
+        with self._lock:
+            entries = self._scopes.get(scope)
+            row, similarity, terms_match = self._search(entries, vector, terms, now)
+            if row is not None and terms_match and similarity >= DUPLICATE_SIMILARITY:
+                self.stats_counters['replaced'] += 1
+            else:
+                if self._size >= self.max_entries:
+                    self._evict(now)
+                    entries = self._scopes.get(scope)
+                if entries is None:
+                    entries = self._scopes[scope] = _Scope(self.np, vector.shape[0])
+                if entries.size == entries.vectors.shape[0]:
+                    entries.grow(self.np)
+                row = entries.size
+                entries.size += 1
+                entries.values.append(None)
+                self._size += 1
+
+            self._clock += 1
+            entries.vectors[row] = vector
+            entries.terms[row] = terms
+            entries.expires[row] = now + self.ttl
+            entries.last_used[row] = self._clock
+            entries.values[row] = value
+            self.stats_counters['stores'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._scopes = {}
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.stats_counters['hits'] + self.stats_counters['misses']
+            return dict(
+                self.stats_counters,
+                entries=self._size,
+                scopes=len(self._scopes),
+                max_entries=self.max_entries,
+                threshold=self.threshold,
+                ttl=self.ttl,
+                hit_rate=round(self.stats_counters['hits'] / lookups, 4) if lookups else 0.0,
+                mean_hit_similarity=(round(self._similarity_total / self.stats_counters['hits'], 4)
+                                     if self.stats_counters['hits'] else None)
+            )
+
+    # Streaming helpers
+
+    def replay_events(self, value, similarity):
+        """Replay a cached response as normalised stream events"""
+        yield {'type': 'delta', 'text': value['response']}
+        yield {'type': 'done', 'finish_reason': value.get('finish_reason'), 'usage': value.get('usage', {}),
+               'cached': True, 'similarity': similarity}
+
+    def record_stream(self, scope, text, events):
+        """Pass stream events through, storing the assembled response once it completes"""
+        parts = []
+        for event in events:
+            if event['type'] == 'delta':
+                parts.append(event['text'])
+            elif event['type'] == 'done' and not event.get('served_by'):
+                self.set(scope, text, {'response': ''.join(parts), 'finish_reason': event.get('finish_reason'),
+                                       'usage': event.get('usage', {})})
+            yield event
+
+    async def record_async_stream(self, scope, text, events):
+        """Async variant of record_stream for the ASGI gateway"""
+        parts = []
+        async for event in events:
+            if event['type'] == 'delta':
+                parts.append(event['text'])
+            elif event['type'] == 'done' and not event.get('served_by'):
+                self.set(scope, text, {'response': ''.join(parts), 'finish_reason': event.get('finish_reason'),
+                                       'usage': event.get('usage', {})})
+            yield event
+
+
+def load_embedder(spec, dim):
+    """'hashed' for the built-in embedder, or 'module:factory' for a custom one"""
+    if spec in (None, '', 'hashed'):
+        return HashedNgramEmbedder(dim)
+    module_name, _, factory = spec.partition(':')
+    return getattr(importlib.import_module(module_name), factory or 'create_embedder')()
+
+
+def create_semantic_cache():
+    """Build the process-wide semantic cache from environment settings, or None if disabled"""
+    if os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() != 'true':
+        return None
+    try:
+        embedder = load_embedder(os.getenv('SEMANTIC_CACHE_EMBEDDER'), int(os.getenv('SEMANTIC_CACHE_DIM', 512)))
+        return SemanticCache(
+            embedder,
+            threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', DEFAULT_THRESHOLD)),
+            max_entries=int(os.getenv('SEMANTIC_CACHE_SIZE', 10000)),
+            ttl=float(os.getenv('SEMANTIC_CACHE_TTL', 3600))
+        )
+    except (ImportError, AttributeError) as e:
+        logger.warning(f"Semantic cache disabled: {e}")
+        return None
@@ -0,0 +1,244 @@
+"""
+Server-side conversation sessions.
+
+Clients send a `conversation_id` with each new turn instead of resending the
+whole transcript. The server keeps the turns, with a token estimate cached per
+turn, and assembles the context for the next call from the newest turns that
+fit the configured token budget. Older turns are dropped from the context (but
+kept in the stored history) once the budget is exceeded.
+
+Conversations are kept in process memory unless SESSION_DB names a SQLite
+file, which then holds them instead so that several worker processes see the
+same conversations (`start_backend.py --production` sets this up whenever it
+runs more than one worker); the next turn may land on any worker.
+
+    SESSION_TOKEN_BUDGET   tokens available for system prompt + history + new message (default 3000)
+    SESSION_MAX_TURNS      turns stored per conversation (default 200)
+    SESSION_MAX_COUNT      conversations kept, least recently used evicted (default 10000)
+    SESSION_TTL            seconds an idle conversation is kept (default 86400)
+    SESSION_DB             path to a SQLite file shared by worker processes (default off, in memory)
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Appends between sweeps of expired and surplus conversations in the shared file
+SWEEP_INTERVAL = 100
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token)"""
+    if not text:
+        return 0
+    return max(1, (len(text) + 3) // 4)
+
+
+class Conversation:
+    def __init__(self):
+        self.turns = []
+        self.updated_at = time.time()
+
+
+class SessionStore:
+    """Conversation history with token-budgeted context assembly, in memory or in a shared SQLite file"""
+
+    def __init__(self, token_budget=3000, max_turns=200, max_sessions=10000, ttl=86400, db_path=None):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.db_path = db_path
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._appends = 0
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, path):
+        try:
+            # Autocommit, so appends can take the write lock with BEGIN IMMEDIATE
+            self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS sessions '
+                '(conversation_id TEXT PRIMARY KEY, turns TEXT NOT NULL, updated_at REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)')
+            self._sweep()
+            logger.info(f"Shared session store at {path}")
+        except sqlite3.Error as e:
+            logger.warning(f"Shared session store disabled, keeping sessions per process: {e}")
+            self._db = None
+
+    def _sweep(self):
+        """Drop expired conversations and the least recently used beyond max_sessions from the file"""
+        self._db.execute('DELETE FROM sessions WHERE updated_at < ?', (time.time() - self.ttl,))
+        self._db.execute(
+            'DELETE FROM sessions WHERE conversation_id IN '
+            '(SELECT conversation_id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_sessions,)
+        )
+
+    def _turns(self, conversation_id):
+        """Stored turns of a live conversation, or None; called with the lock held"""
+        if self._db is None:
+            conversation = self._get(conversation_id)
+            return conversation.turns if conversation else None
+        row = self._db.execute(
+            'SELECT turns, updated_at FROM sessions WHERE conversation_id = ?', (conversation_id,)
+        ).fetchone()
+        if row is None or row[1] + self.ttl < time.time():
+            return None
+        return json.loads(row[0])
+
+    def _get(self, conversation_id):
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            return None
+        if conversation.updated_at + self.ttl < time.time():
+            del self._conversations[conversation_id]
+            return None
+        self._conversations.move_to_end(conversation_id)
+        return conversation
+
+    def context(self, conversation_id, system_prompt='', message=''):
+        """Return (history, info) for the next turn within the token budget.
+
+        history is a list of {'role', 'content'} dicts, oldest first; info
+        reports how many turns were included and dropped.
+        """
+        available = self.token_budget - estimate_tokens(system_prompt) - estimate_tokens(message)
+        with self._lock:
+            turns = list(self._turns(conversation_id) or [])
+
+        # Walk back from the newest exchange using the cached per-turn counts,
+        # keeping user/assistant pairs together
+        used = 0
+        start = len(turns)
+        while start >= 2:
+            pair_tokens = turns[start - 2]['tokens'] + turns[start - 1]['tokens']
+            if used + pair_tokens > available:
+                break
+            used += pair_tokens
+            start -= 2
+
+        history = [{'role': turn['role'], 'content': turn['content']} for turn in turns[start:]]
+        info = {
+            'conversation_id': conversation_id,
+            'history_turns': len(history),
+            'dropped_turns': start,
+            'history_tokens': used
+        }
+        return history, info
+
+    def append(self, conversation_id, user_message, assistant_message):
+        """Record a completed exchange"""
+        exchange = [
+            {'role': 'user', 'content': user_message, 'tokens': estimate_tokens(user_message)},
+            {'role': 'assistant', 'content': assistant_message, 'tokens': estimate_tokens(assistant_message)}
+        ]
+        with self._lock:
+            if self._db is not None:
+                self._append_db(conversation_id, exchange)
+                return
+
+            conversation = self._get(conversation_id)
+            if conversation is None:
+                conversation = Conversation()
+                self._conversations[conversation_id] = conversation
+                while len(self._conversations) > self.max_sessions:
+                    self._conversations.popitem(last=False)
+
+            conversation.turns.extend(exchange)
+            if len(conversation.turns) > self.max_turns:
+                del conversation.turns[:len(conversation.turns) - self.max_turns]
+            conversation.updated_at = time.time()
+
+    def _append_db(self, conversation_id, exchange):
+        try:
+            # Read-modify-write under the database write lock, so concurrent
+            # turns from other workers are not lost
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                turns = (self._turns(conversation_id) or []) + exchange
+                self._db.execute(
+                    'INSERT OR REPLACE INTO sessions (conversation_id, turns, updated_at) VALUES (?, ?, ?)',
+                    (conversation_id, json.dumps(turns[-self.max_turns:]), time.time())
+                )
+                self._appends += 1
+                if self._appends % SWEEP_INTERVAL == 0:
+                    self._sweep()
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Session write failed: {e}")
+
+    def get(self, conversation_id):
+        """Return the stored turns of a conversation, or None"""
+        with self._lock:
+            turns = self._turns(conversation_id)
+            if turns is None:
+                return None
+            return [{'role': turn['role'], 'content': turn['content']} for turn in turns]
+
+    def delete(self, conversation_id):
+        with self._lock:
+            if self._db is not None:
+                return self._db.execute('DELETE FROM sessions WHERE conversation_id = ?', (conversation_id,)).rowcount > 0
+            return self._conversations.pop(conversation_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            if self._db is not None:
+                conversations = self._db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+            else:
+                conversations = len(self._conversations)
+            return {
+                'conversations': conversations,
+                'token_budget': self.token_budget,
+                'max_turns': self.max_turns,
+                'shared': self._db is not None
+            }
+
+    # Streaming helpers
+
+    def record_stream(self, conversation_id, message, events):
+        """Pass stream events through, appending the exchange once it completes"""
+        parts = []
+        for event in events:
+            if event['type'] == 'delta':
+                parts.append(event['text'])
+            elif event['type'] == 'done':
+                self.append(conversation_id, message, ''.join(parts))
+            yield event
+
+    async def record_async_stream(self, conversation_id, message, events):
+        """Async variant of record_stream for the ASGI gateway"""
+        parts = []
+        async for event in events:
+            if event['type'] == 'delta':
+                parts.append(event['text'])
+            elif event['type'] == 'done':
+                self.append(conversation_id, message, ''.join(parts))
+            yield event
+
+
+def create_session_store():
+    """Build the process-wide session store from environment settings"""
+    return SessionStore(
+        token_budget=int(os.getenv('SESSION_TOKEN_BUDGET', 3000)),
+        max_turns=int(os.getenv('SESSION_MAX_TURNS', 200)),
+        max_sessions=int(os.getenv('SESSION_MAX_COUNT', 10000)),
+        ttl=float(os.getenv('SESSION_TTL', 86400)),
+        db_path=os.getenv('SESSION_DB') or None
+    )
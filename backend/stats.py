@@ -0,0 +1,13 @@
+"""
+Small statistics helpers shared by the batch runner, scheduler and metrics
+"""
+import math
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list: the smallest value with at least pct% of values at or below it"""
+    if not sorted_values:
+        return None
+    # pct * n / 100 rather than pct / 100 * n, which turns e.g. 7% of 100 into 7.000000000000001
+    rank = max(1, math.ceil(pct * len(sorted_values) / 100.0))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
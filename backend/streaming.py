@@ -0,0 +1,133 @@
+"""
+Token streaming helpers shared by the Flask app and the Vercel chat function.
+
+Provider streams are normalised into a sequence of plain event dicts:
+
+    {'type': 'delta', 'text': '...'}                       # one per chunk
+    {'type': 'done', 'finish_reason': ..., 'usage': {...}} # always last
+
+which `format_sse` turns into Server-Sent Events for the browser.
+"""
+import logging
+
+from backend.responses import dumps
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # Disable proxy buffering so chunks flush immediately
+}
+
+
+def format_sse(event, data):
+    """Format a single Server-Sent Event"""
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+
+def events_to_sse(events):
+    """Turn normalised stream events into SSE strings, reporting failures as an error event"""
+    try:
+        for event in events:
+            yield format_sse(event['type'], event)
+    except Exception as e:
+        logger.error(f"Streaming error: {str(e)}")
+        yield format_sse('error', {'type': 'error', 'error': str(e)})
+
+
+def stream_openai(client, model, messages, temperature, max_tokens, top_p, seed, cache_key=None):
+    """Stream a chat completion from OpenAI (legacy 0.28 SDK)"""
+    params = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": top_p,
+        "stream": True,
+        "stream_options": {"include_usage": True}  # Token counts arrive on a final chunk without choices
+    }
+    if seed:
+        params["seed"] = int(seed)
+    if cache_key:
+        params["prompt_cache_key"] = cache_key
+
+    finish_reason = None
+    chunks = 0
+    reported = None
+    for chunk in client.ChatCompletion.create(**params):
+        if chunk.get('usage'):
+            reported = chunk['usage']
+        if not chunk.get('choices'):
+            continue
+        choice = chunk['choices'][0]
+        text = choice.get('delta', {}).get('content')
+        if text:
+            chunks += 1
+            yield {'type': 'delta', 'text': text}
+        if choice.get('finish_reason'):
+            finish_reason = choice['finish_reason']
+
+    usage = {
+        'completion_chunks': chunks,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'top_p': top_p
+    }
+    if reported:
+        usage['prompt_tokens'] = reported.get('prompt_tokens')
+        usage['completion_tokens'] = reported.get('completion_tokens')
+        usage['total_tokens'] = reported.get('total_tokens')
+        cached = (reported.get('prompt_tokens_details') or {}).get('cached_tokens')
+        if cached is not None:
+            usage['cached_tokens'] = cached
+    yield {'type': 'done', 'finish_reason': finish_reason, 'usage': usage}
+
+
+def stream_google(genai_model, prompt, temperature, max_tokens, top_p):
+    """Stream content from a Google AI GenerativeModel"""
+    response = genai_model.generate_content(prompt, stream=True)
+
+    finish_reason = None
+    usage_metadata = None
+    chunks = 0
+    for chunk in response:
+        if getattr(chunk, 'candidates', None):
+            reason = getattr(chunk.candidates[0], 'finish_reason', None)
+            if reason:
+                finish_reason = getattr(reason, 'name', str(reason))
+        # Token usage arrives on the final chunk
+        usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+
+        try:
+            text = chunk.text
+        except Exception:
+            # Chunks without text parts (e.g. blocked by safety filters) raise on .text
+            text = None
+        if text:
+            chunks += 1
+            yield {'type': 'delta', 'text': text}
+
+    if not chunks:
+        # Mirror the non-streaming path's messages for blocked or empty responses
+        if finish_reason == 'SAFETY':
+            yield {'type': 'delta', 'text': "I'm sorry, but I can't provide a response to that request due to safety guidelines."}
+        elif finish_reason == 'RECITATION':
+            yield {'type': 'delta', 'text': "I'm sorry, but I can't provide a response to that request due to content policy restrictions."}
+        else:
+            yield {'type': 'delta', 'text': "Sorry, I couldn't generate a response. Please try again."}
+
+    usage = {
+        'completion_chunks': chunks,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'top_p': top_p
+    }
+    if usage_metadata is not None:
+        usage['prompt_tokens'] = getattr(usage_metadata, 'prompt_token_count', None)
+        usage['completion_tokens'] = getattr(usage_metadata, 'candidates_token_count', None)
+        usage['total_tokens'] = getattr(usage_metadata, 'total_token_count', None)
+        cached = getattr(usage_metadata, 'cached_content_token_count', None)
+        if cached:
+            usage['cached_tokens'] = cached
+
+    yield {'type': 'done', 'finish_reason': finish_reason, 'usage': usage}
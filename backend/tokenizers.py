@@ -0,0 +1,225 @@
+"""
+Local token counting and pre-flight context budgeting.
+
+Prompts are counted on this side before any provider call, so a request whose
+prompt cannot fit the model's context window is rejected at once (400,
+code context_length_exceeded) instead of after a queue wait and a provider
+round trip, and max_tokens is clamped to what the model can still produce:
+its output limit and, for providers whose window holds prompt and output
+together, the room the prompt leaves. Limits come from the model catalog.
+
+Tokenizers are chosen per model family by id prefix, the longest prefix
+wins. OpenAI models use tiktoken when it is installed; everything else, and
+OpenAI models without tiktoken, falls back to a fast approximation of one
+token per four bytes of UTF-8. Counts are memoized, so a system prompt or a
+conversation's earlier turns are tokenized once rather than on every request.
+
+    TOKEN_PREFLIGHT        clamp (default): clamp max_tokens, reject prompts that do not fit;
+                           reject: also reject max_tokens above the model's limits; off: no checks
+    TOKENIZERS             extra tokenizers, comma-separated prefix=module:factory entries; the factory
+                           is called with the model id and returns an object with count(text)
+    TOKENIZER_CACHE_SIZE   distinct texts whose counts are memoized (default 4096)
+"""
+import functools
+import importlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+MODES = ('clamp', 'reject', 'off')
+
+# Chat formatting costs a few tokens per message and for priming the reply
+MESSAGE_OVERHEAD = 3
+REPLY_OVERHEAD = 3
+
+# Providers whose context window holds the prompt and the output together;
+# Gemini's input and output limits are separate
+SHARED_WINDOW = ('openai', 'local')
+
+
+class ContextLengthExceeded(ValueError):
+    """Raised when a prompt (or the requested output) does not fit the model's limits"""
+
+    def __init__(self, message, prompt_tokens, context_window):
+        super().__init__(message)
+        self.prompt_tokens = prompt_tokens
+        self.context_window = context_window
+
+
+class ApproximateTokenizer:
+    """About one token per four bytes of UTF-8: close for English, conservative for other scripts"""
+
+    name = 'approximate'
+    exact = False
+
+    def count(self, text):
+        if not text:
+            return 0
+        return max(1, (len(text.encode('utf-8')) + 3) // 4)
+
+
+class TiktokenTokenizer:
+    """OpenAI's BPE tokenizer for a model, via the optional tiktoken package"""
+
+    exact = True
+
+    def __init__(self, model):
+        import tiktoken
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Newer models than the installed tiktoken knows about
+            self.encoding = tiktoken.get_encoding('o200k_base')
+        self.name = f'tiktoken:{self.encoding.name}'
+
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=())) if text else 0
+
+
+APPROXIMATE = ApproximateTokenizer()
+
+# Tokenizer factory by model id prefix; the longest prefix wins
+FAMILIES = {
+    'gpt-': TiktokenTokenizer,
+    'chatgpt-': TiktokenTokenizer,
+    'o1': TiktokenTokenizer,
+    'o3': TiktokenTokenizer,
+    'o4': TiktokenTokenizer
+}
+
+
+def load_factory(spec):
+    """'module:factory' -> the factory callable"""
+    module_name, _, factory = spec.partition(':')
+    return getattr(importlib.import_module(module_name), factory or 'create_tokenizer')
+
+
+class TokenCounter:
+    """Per-model tokenizers with memoized counts"""
+
+    def __init__(self, families=None, cache_size=4096):
+        self.families = dict(FAMILIES)
+        self.families.update(families or {})
+        self._tokenizers = {}
+        self._lock = threading.Lock()
+        self._count = functools.lru_cache(maxsize=cache_size)(self._count_uncached)
+
+    def tokenizer(self, model):
+        """Tokenizer for a model, loaded on first use; the approximation if it cannot be loaded"""
+        tokenizer = self._tokenizers.get(model)
+        if tokenizer is not None:
+            return tokenizer
+        with self._lock:
+            tokenizer = self._tokenizers.get(model)
+            if tokenizer is None:
+                tokenizer = self._tokenizers[model] = self._load(model)
+        return tokenizer
+
+    def _load(self, model):
+        matches = [prefix for prefix in self.families if model.startswith(prefix)]
+        if not matches:
+            return APPROXIMATE
+        try:
+            return self.families[max(matches, key=len)](model)
+        except Exception as e:
+            # tiktoken not installed, or its vocabulary cannot be downloaded
+            logger.info(f"Approximating token counts for {model}: {e}")
+            return APPROXIMATE
+
+    @staticmethod
+    def _count_uncached(tokenizer, text):
+        return tokenizer.count(text)
+
+    def count(self, model, text):
+        """Tokens in a text for a model"""
+        return self._count(self.tokenizer(model), text or '')
+
+    def prompt_tokens(self, model, message, system_prompt='', history=None):
+        """Tokens of the chat prompt built from a message, system prompt and prior turns"""
+        texts = ([system_prompt] if system_prompt else []) + [turn['content'] for turn in history or []] + [message]
+        return sum(self.count(model, text) for text in texts) + MESSAGE_OVERHEAD * len(texts) + REPLY_OVERHEAD
+
+    def stats(self):
+        info = self._count.cache_info()
+        with self._lock:
+            tokenizers = sorted({getattr(tokenizer, 'name', type(tokenizer).__name__) for tokenizer in self._tokenizers.values()})
+        return {'hits': info.hits, 'misses': info.misses, 'entries': info.currsize, 'tokenizers': tokenizers}
+
+
+class ContextBudget:
+    """Checks a request's prompt and max_tokens against the model's limits before it is sent"""
+
+    def __init__(self, counter, limits, mode='clamp'):
+        # limits(provider, model) -> (context_window, max_output_tokens), either may be None
+        self.counter = counter
+        self.limits = limits
+        self.mode = mode
+        self._lock = threading.Lock()
+        self.stats_counters = {'checked': 0, 'clamped': 0, 'rejected': 0}
+
+    def fit(self, provider, model, message, system_prompt, max_tokens, history=None):
+        """max_tokens clamped to the model's limits; raises ContextLengthExceeded when the request cannot fit"""
+        context_window, max_output = self.limits(provider, model)
+        prompt_tokens = self.counter.prompt_tokens(model, message, system_prompt, history)
+        shared = provider in SHARED_WINDOW
+        if context_window and prompt_tokens >= context_window:
+            self._record('rejected')
+            raise ContextLengthExceeded(
+                f"Prompt is {self._about(model)}{prompt_tokens} tokens, "
+                f"{model} accepts {context_window}{' including the response' if shared else ''}",
+                prompt_tokens, context_window)
+
+        allowed = max_output or max_tokens
+        if context_window and shared:
+            allowed = min(allowed, context_window - prompt_tokens)
+        if max_tokens <= allowed:
+            self._record(None)
+            return max_tokens
+        if self.mode == 'reject':
+            self._record('rejected')
+            raise ContextLengthExceeded(
+                f"max_tokens {max_tokens} exceeds the {allowed} tokens {model} can generate "
+                f"after this {self._about(model)}{prompt_tokens}-token prompt", prompt_tokens, context_window)
+        self._record('clamped')
+        return allowed
+
+    def _about(self, model):
+        return '' if getattr(self.counter.tokenizer(model), 'exact', True) else 'about '
+
+    def _record(self, outcome):
+        with self._lock:
+            self.stats_counters['checked'] += 1
+            if outcome:
+                self.stats_counters[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counters, mode=self.mode, tokens=self.counter.stats())
+
+
+def parse_families(spec):
+    """'prefix=module:factory,...' -> {prefix: factory}"""
+    families = {}
+    for entry in filter(None, (part.strip() for part in (spec or '').split(','))):
+        prefix, _, factory = entry.partition('=')
+        families[prefix.strip()] = load_factory(factory.strip())
+    return families
+
+
+def create_context_budget(limits):
+    """Build the process-wide pre-flight check from environment settings, or None when it is off"""
+    mode = os.getenv('TOKEN_PREFLIGHT', 'clamp').lower()
+    if mode == 'off':
+        return None
+    if mode not in MODES:
+        logger.warning(f"Unknown TOKEN_PREFLIGHT {mode!r}, using clamp")
+        mode = 'clamp'
+    try:
+        families = parse_families(os.getenv('TOKENIZERS'))
+    except (ImportError, AttributeError) as e:
+        logger.warning(f"Ignoring TOKENIZERS: {e}")
+        families = {}
+    counter = TokenCounter(families, cache_size=int(os.getenv('TOKENIZER_CACHE_SIZE', 4096)))
+    return ContextBudget(counter, limits, mode)
@@ -0,0 +1,275 @@
+"""
+Per-request phase timing.
+
+Each request gets a trace with a request id (taken from X-Request-ID when the
+client sends one). Code anywhere below the endpoint opens spans with
+
+    with span('provider'):
+        ...
+
+which are no-ops when no trace is active. When the request finishes the trace
+is reported three ways:
+
+* a Server-Timing response header (phases known before the response starts;
+  for streams that excludes the provider round-trip),
+* one structured JSON log line per request on the 'llm.trace' logger,
+* optionally, OTLP/JSON spans appended to a file, one ExportTraceServiceRequest
+  per line, which the OpenTelemetry Collector's file receiver can ingest.
+
+A trace can also carry a profile (backend.profiling); spans and provider
+streams then add the thread they run on to it.
+
+    TRACE_LOG             emit a JSON log line per request (default true)
+    TRACE_SERVER_TIMING   add the Server-Timing header (default true)
+    TRACE_OTLP_FILE       path of the OTLP/JSON span file (default off)
+"""
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger('llm.trace')
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Trace:
+    """Spans recorded for one request"""
+
+    def __init__(self, name, request_id=None):
+        self.trace_id = secrets.token_hex(16)
+        # Client-supplied ids are echoed in headers and logs, so keep them short and printable
+        if request_id and (len(request_id) > 128 or not request_id.isprintable()):
+            request_id = None
+        self.request_id = request_id or self.trace_id
+        self.root = _Span(name, None)
+        self.spans = []
+        self.attributes = {}
+        self.profile = None  # Set by backend.profiling for profiled requests
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self):
+        """Milliseconds per phase name, summed over repeated spans"""
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for finished in spans:
+            if finished.end is not None:
+                totals[finished.name] = totals.get(finished.name, 0.0) + finished.duration_ms
+        return {name: round(ms, 2) for name, ms in totals.items()}
+
+    def server_timing(self):
+        """Server-Timing header value for the phases finished so far"""
+        parts = [f'{name};dur={ms}' for name, ms in self.totals().items()]
+        parts.append(f'total;dur={round((time.perf_counter() - self.root.start) * 1000, 2)}')
+        return ', '.join(parts)
+
+
+class _Span:
+    __slots__ = ('span_id', 'parent_id', 'name', 'start', 'end', 'start_ns', 'attributes')
+
+    def __init__(self, name, parent_id):
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.start_ns = time.time_ns()
+        self.end = None
+        self.attributes = None
+
+    @property
+    def duration_ms(self):
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def end_ns(self):
+        return self.start_ns + int(((self.end or time.perf_counter()) - self.start) * 1e9)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a phase of the current request; does nothing outside a trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    parent = _current_span.get()
+    current = _Span(name, parent.span_id if parent else trace.root.span_id)
+    current.attributes = attributes or None
+    token = _current_span.set(current)
+    profile = trace.profile
+    if profile is not None:
+        profile.enter()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.exit()
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+        trace.add(current)
+
+
+def annotate(**attributes):
+    """Attach attributes (provider, model, ...) to the current request's trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def trace_stream(events):
+    """Pass provider stream events through, recording time to first token and the full stream"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield from events
+        return
+    start = time.perf_counter()
+    first = None
+    profile = trace.profile
+    if profile is not None:
+        profile.enter()  # Coalesced streams are read on their own thread
+    try:
+        for event in events:
+            if first is None and event['type'] == 'delta':
+                first = time.perf_counter()
+                trace.add(_finished_span(trace, 'ttft', start, first))
+            yield event
+    finally:
+        if profile is not None:
+            profile.exit()
+        trace.add(_finished_span(trace, 'stream', start, time.perf_counter()))
+
+
+async def trace_async_stream(events):
+    """Async counterpart of trace_stream(), for the ASGI app's gateway streams"""
+    trace = _current_trace.get()
+    if trace is None:
+        async for event in events:
+            yield event
+        return
+    start = time.perf_counter()
+    first = None
+    try:
+        async for event in events:
+            if first is None and event['type'] == 'delta':
+                first = time.perf_counter()
+                trace.add(_finished_span(trace, 'ttft', start, first))
+            yield event
+    finally:
+        aclose = getattr(events, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+        trace.add(_finished_span(trace, 'stream', start, time.perf_counter()))
+
+
+def _finished_span(trace, name, start, end):
+    finished = _Span(name, trace.root.span_id)
+    finished.start_ns -= int((finished.start - start) * 1e9)
+    finished.start = start
+    finished.end = end
+    return finished
+
+
+class Tracer:
+    """Starts request traces and reports them when the request finishes"""
+
+    def __init__(self, log=True, server_timing=True, otlp_file=None, service_name='llm-playground'):
+        self.log = log
+        self.server_timing = server_timing
+        self.otlp_file = otlp_file
+        self.service_name = service_name
+        self._file_lock = threading.Lock()
+
+    def start(self, name, request_id=None):
+        """Begin a trace and make it current for this thread/task"""
+        trace = Trace(name, request_id)
+        _current_trace.set(trace)
+        _current_span.set(trace.root)
+        return trace
+
+    def finish(self, trace, status=None):
+        """End a trace, log it, export it and write its profile"""
+        trace.root.end = time.perf_counter()
+        if _current_trace.get() is trace:
+            _current_trace.set(None)
+            _current_span.set(None)
+        if trace.profile is not None:
+            trace.profile.finish(status)
+
+        if self.log:
+            trace_logger.info(json.dumps(dict(
+                trace.attributes,
+                request_id=trace.request_id,
+                trace_id=trace.trace_id,
+                name=trace.root.name,
+                status=status,
+                duration_ms=round(trace.root.duration_ms, 2),
+                spans=trace.totals()
+            )))
+        if self.otlp_file:
+            self._export(trace, status)
+
+    def _export(self, trace, status):
+        def otlp_span(item, parent_id):
+            encoded = {
+                'traceId': trace.trace_id,
+                'spanId': item.span_id,
+                'name': item.name,
+                'kind': 2 if parent_id is None else 1,  # SERVER for the root, INTERNAL below it
+                'startTimeUnixNano': str(item.start_ns),
+                'endTimeUnixNano': str(item.end_ns())
+            }
+            if parent_id:
+                encoded['parentSpanId'] = parent_id
+            attributes = dict(item.attributes or {})
+            if parent_id is None:
+                attributes.update(trace.attributes, request_id=trace.request_id)
+                if status is not None:
+                    attributes['http.status_code'] = status
+            if attributes:
+                encoded['attributes'] = [_otlp_attribute(key, value) for key, value in attributes.items()]
+            return encoded
+
+        with trace._lock:
+            spans = list(trace.spans)
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{
+                'scope': {'name': 'backend.tracing'},
+                'spans': [otlp_span(trace.root, None)] + [otlp_span(item, item.parent_id) for item in spans]
+            }]
+        }]}
+        line = json.dumps(payload, separators=(',', ':')) + '\n'
+        try:
+            with self._file_lock, open(self.otlp_file, 'a') as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"Could not write trace spans to {self.otlp_file}: {e}")
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def create_tracer():
+    """Build the process-wide tracer from environment settings"""
+    return Tracer(
+        log=os.getenv('TRACE_LOG', 'true').lower() != 'false',
+        server_timing=os.getenv('TRACE_SERVER_TIMING', 'true').lower() != 'false',
+        otlp_file=os.getenv('TRACE_OTLP_FILE') or None
+    )
@@ -0,0 +1,282 @@
+"""
+Usage ledger: one row per provider call with real token counts and estimated cost.
+
+Every provider call that Metrics records (blocking, streamed, cancelled or
+failed) is appended with its timestamp, provider, model, outcome, prompt and
+completion tokens as reported by the provider, latency and the cost from the
+price table. Recording only puts a tuple on a queue; a writer thread collects
+entries for up to USAGE_FLUSH_INTERVAL seconds and commits them in one
+transaction, so requests never wait on disk. Aggregates by model and by time
+bucket are served from the same SQLite file, which worker processes share.
+
+When a provider does not report usage, completion tokens are estimated from
+the text (the row is flagged as estimated) and prompt tokens are left empty.
+
+    USAGE_ENABLED          set to 'false' to disable the ledger and its endpoints (default true)
+    USAGE_DB               SQLite file (default <tmp>/llm_usage.db)
+    USAGE_BATCH_SIZE       max entries committed per transaction (default 1000)
+    USAGE_FLUSH_INTERVAL   seconds entries are collected before a commit (default 1)
+    USAGE_QUEUE_SIZE       max entries waiting for the writer; further ones are dropped (default 100000)
+    USAGE_RETENTION_DAYS   days entries are kept (default 90)
+    USAGE_PRICES           JSON price overrides in USD per million tokens by model prefix,
+                           e.g. {"gpt-4o": {"input": 2.5, "output": 10}}
+"""
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# (input, output) USD per million tokens by model id prefix; the longest prefix wins.
+# List prices; models without an entry (e.g. local ones) are recorded without a cost
+PRICES = {
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'gpt-4': (30.00, 60.00),
+    'gpt-4-32k': (60.00, 120.00),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4-1106': (10.00, 30.00),
+    'gpt-4-0125': (10.00, 30.00),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4.1': (2.00, 8.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4.1-nano': (0.10, 0.40),
+    'o1': (15.00, 60.00),
+    'o3': (2.00, 8.00),
+    'o4-mini': (1.10, 4.40),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.5-pro': (1.25, 5.00),
+    'gemini-2.0-flash': (0.10, 0.40),
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-2.5-pro': (1.25, 10.00),
+    'gemini-flash-latest': (0.30, 2.50),
+    'gemini-pro-latest': (1.25, 10.00)
+}
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS usage ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, provider TEXT NOT NULL, model TEXT NOT NULL,'
+    ' outcome TEXT NOT NULL, prompt_tokens INTEGER, completion_tokens INTEGER, latency_ms REAL,'
+    ' cost REAL, estimated INTEGER NOT NULL DEFAULT 0)',
+    'CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)'
+)
+
+_AGGREGATES = (
+    'COUNT(*), SUM(outcome = \'error\'), SUM(outcome = \'cancelled\'), SUM(prompt_tokens), SUM(completion_tokens),'
+    ' SUM(cost), AVG(latency_ms), MAX(latency_ms)'
+)
+
+
+class PriceTable:
+    """Cost of a call from its token counts, by longest matching model prefix"""
+
+    def __init__(self, prices=None):
+        self.prices = dict(PRICES)
+        for prefix, price in (prices or {}).items():
+            self.prices[prefix] = (float(price['input']), float(price['output']))
+        self.price = functools.lru_cache(maxsize=1024)(self._price)
+
+    def _price(self, model):
+        matches = [prefix for prefix in self.prices if model.startswith(prefix)]
+        return self.prices[max(matches, key=len)] if matches else None
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        """Estimated USD cost, or None when the model has no price"""
+        price = self.price(model or '')
+        if price is None:
+            return None
+        return ((prompt_tokens or 0) * price[0] + (completion_tokens or 0) * price[1]) / 1_000_000
+
+
+class UsageLedger:
+    """Provider call ledger in SQLite with buffered background writes"""
+
+    def __init__(self, path, prices=None, batch_size=1000, flush_interval=1.0, queue_size=100000, retention_days=90):
+        self.path = path
+        self.prices = prices or PriceTable()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention_days * 86400
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer = None
+        self._next_cleanup = 0.0
+        self.stats_counters = {'recorded': 0, 'written': 0, 'batches': 0, 'dropped': 0, 'write_errors': 0, 'expired': 0}
+
+        self._db = self._connect()
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        atexit.register(self.flush, timeout=5)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    # Recording
+
+    def record(self, provider, model, outcome, seconds, prompt_tokens=None, completion_tokens=None, estimated=False):
+        """Queue one provider call; never blocks, drops the entry if the writer is too far behind"""
+        cost = self.prices.cost(model, prompt_tokens, completion_tokens)
+        entry = (time.time(), provider, model or '', outcome, prompt_tokens, completion_tokens,
+                 round(seconds * 1000, 1), cost, int(estimated))
+        self._start_writer()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.stats_counters['dropped'] += 1
+                dropped = self.stats_counters['dropped']
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning(f"Usage ledger queue full, {dropped} entries dropped so far")
+            return
+        with self._lock:
+            self.stats_counters['recorded'] += 1
+
+    def _start_writer(self):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run, daemon=True, name='usage-writer')
+                    self._writer.start()
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            # Collect entries for up to flush_interval after the first one, then commit them together
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with db:
+                    db.executemany(
+                        'INSERT INTO usage (ts, provider, model, outcome, prompt_tokens, completion_tokens, latency_ms,'
+                        ' cost, estimated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch
+                    )
+                    expired = self._cleanup(db)
+                with self._lock:
+                    self.stats_counters['written'] += len(batch)
+                    self.stats_counters['batches'] += 1
+                    self.stats_counters['expired'] += expired
+            except sqlite3.Error as e:
+                logger.error(f"Usage ledger write of {len(batch)} entries failed: {e}")
+                with self._lock:
+                    self.stats_counters['write_errors'] += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _cleanup(self, db):
+        """Delete entries older than the retention period, at most once an hour"""
+        now = time.time()
+        if now < self._next_cleanup:
+            return 0
+        self._next_cleanup = now + 3600
+        return db.execute('DELETE FROM usage WHERE ts < ?', (now - self.retention,)).rowcount
+
+    def flush(self, timeout=None):
+        """Wait until queued entries are committed (or the timeout passes)"""
+        if self._writer is None:
+            return
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(0.01)
+
+    # Aggregates
+
+    def by_model(self, since, until):
+        """Totals per provider and model between two timestamps, most tokens first"""
+        with self._read_lock:
+            rows = self._db.execute(
+                f'SELECT provider, model, {_AGGREGATES} FROM usage WHERE ts >= ? AND ts < ?'
+                ' GROUP BY provider, model ORDER BY COALESCE(SUM(prompt_tokens), 0) + COALESCE(SUM(completion_tokens), 0) DESC',
+                (since, until)
+            ).fetchall()
+        return [dict({'provider': row[0], 'model': row[1]}, **_aggregate(row[2:])) for row in rows]
+
+    def timeline(self, since, until, bucket, provider=None, model=None):
+        """Totals per time bucket (bucket start, seconds since the epoch), oldest first"""
+        sql = f'SELECT CAST(ts / ? AS INTEGER) * ?, {_AGGREGATES} FROM usage WHERE ts >= ? AND ts < ?'
+        args = [bucket, bucket, since, until]
+        if provider:
+            sql += ' AND provider = ?'
+            args.append(provider)
+        if model:
+            sql += ' AND model = ?'
+            args.append(model)
+        sql += ' GROUP BY 1 ORDER BY 1'
+        with self._read_lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [dict({'bucket': row[0]}, **_aggregate(row[1:])) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counters, pending=self._queue.qsize())
+
+
+def _aggregate(row):
+    requests, errors, cancelled, prompt_tokens, completion_tokens, cost, avg_latency, max_latency = row
+    return {
+        'requests': requests,
+        'errors': errors or 0,
+        'cancelled': cancelled or 0,
+        'prompt_tokens': prompt_tokens or 0,
+        'completion_tokens': completion_tokens or 0,
+        'cost': round(cost, 6) if cost is not None else None,
+        'avg_latency_ms': round(avg_latency, 1) if avg_latency is not None else None,
+        'max_latency_ms': max_latency
+    }
+
+
+def totals(rows):
+    """Sum aggregate rows into one"""
+    result = {'requests': 0, 'errors': 0, 'cancelled': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost': None}
+    for row in rows:
+        for field in ('requests', 'errors', 'cancelled', 'prompt_tokens', 'completion_tokens'):
+            result[field] += row[field]
+        if row['cost'] is not None:
+            result['cost'] = round((result['cost'] or 0) + row['cost'], 6)
+    return result
+
+
+def create_usage_ledger():
+    """Build the process-wide usage ledger from environment settings, or None if disabled"""
+    if os.getenv('USAGE_ENABLED', 'true').lower() == 'false':
+        return None
+    path = os.getenv('USAGE_DB') or os.path.join(tempfile.gettempdir(), 'llm_usage.db')
+    try:
+        prices = PriceTable(json.loads(os.getenv('USAGE_PRICES') or '{}'))
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring invalid USAGE_PRICES: {e}")
+        prices = PriceTable()
+    try:
+        return UsageLedger(
+            path,
+            prices,
+            batch_size=int(os.getenv('USAGE_BATCH_SIZE', 1000)),
+            flush_interval=float(os.getenv('USAGE_FLUSH_INTERVAL', 1)),
+            queue_size=int(os.getenv('USAGE_QUEUE_SIZE', 100000)),
+            retention_days=float(os.getenv('USAGE_RETENTION_DAYS', 90))
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"Usage ledger disabled, cannot open {path}: {e}")
+        return None
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the backend entry points.
+
+Each run starts a fresh interpreter, imports one entry point and serves two
+requests, recording:
+
+    process_ms         wall time from spawning the interpreter to the result
+    import_ms          time to import the entry point module
+    first_request_ms   first request, including any lazy SDK import
+    second_request_ms  the same request again, warm
+    sdk_load_ms        per-provider SDK import/configure time (backend.providers)
+
+Usage:
+    python benchmarks/cold_start.py [--runs 5] [--provider openai] [--model gpt-4o-mini]
+                                    [--output benchmarks/results/cold_start.json]
+
+Without API keys the chat requests fail fast after the import work, which still
+measures the cold-start path; with keys they include one real provider call.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import HTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    'app': {'kind': 'flask', 'path': 'app.py', 'method': 'POST', 'route': '/api/chat'},
+    'api/chat': {'kind': 'vercel', 'path': 'api/chat.py', 'method': 'POST', 'route': '/api/chat'},
+    'api/models': {'kind': 'vercel', 'path': 'api/models.py', 'method': 'GET', 'route': '/api/models'},
+    'api/health': {'kind': 'vercel', 'path': 'api/health.py', 'method': 'GET', 'route': '/api/health'}
+}
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _vercel_requester(module, entry, body):
+    """Serve the function's handler on a local port and return a function issuing one request"""
+    server = HTTPServer(('127.0.0.1', 0), module.handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}{entry["route"]}'
+
+    def request():
+        data = json.dumps(body).encode() if entry['method'] == 'POST' else None
+        req = urllib.request.Request(url, data=data, method=entry['method'],
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    return request
+
+
+def _flask_requester(module, entry, body):
+    client = module.app.test_client()
+
+    def request():
+        return client.open(entry['route'], method=entry['method'], json=body).status_code
+
+    return request
+
+
+def run_child(name, provider, model):
+    """Measure one entry point in this (fresh) interpreter and print the result as JSON"""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    entry = ENTRY_POINTS[name]
+    body = {'message': 'ping', 'provider': provider, 'model': model, 'max_tokens': 16}
+
+    start = time.perf_counter()
+    module = _load_module(name.replace('/', '_'), entry['path'])
+    import_ms = _elapsed_ms(start)
+
+    requester = _flask_requester if entry['kind'] == 'flask' else _vercel_requester
+    request = requester(module, entry, body)
+
+    start = time.perf_counter()
+    first_status = request()
+    first_request_ms = _elapsed_ms(start)
+
+    start = time.perf_counter()
+    request()
+    second_request_ms = _elapsed_ms(start)
+
+    providers = sys.modules.get('backend.providers')
+    print(json.dumps({
+        'import_ms': import_ms,
+        'first_request_ms': first_request_ms,
+        'second_request_ms': second_request_ms,
+        'first_status': first_status,
+        'sdk_load_ms': dict(providers.load_times) if providers else {},
+        'sdk_modules_loaded': sorted(m for m in ('openai', 'google.generativeai') if m in sys.modules)
+    }))
+
+
+def measure(name, provider, model):
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', name, '--provider', provider, '--model', model],
+        capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_ms'] = _elapsed_ms(start)
+    return result
+
+
+def summarize(runs):
+    summary = {}
+    for key in ('process_ms', 'import_ms', 'first_request_ms', 'second_request_ms'):
+        values = [run[key] for run in runs]
+        summary[key] = {'median': round(statistics.median(values), 2), 'min': min(values), 'max': max(values)}
+    summary['first_status'] = runs[-1]['first_status']
+    summary['sdk_load_ms'] = runs[-1]['sdk_load_ms']
+    summary['sdk_modules_loaded'] = runs[-1]['sdk_modules_loaded']
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start time of each backend entry point')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per entry point')
+    parser.add_argument('--entry', action='append', choices=sorted(ENTRY_POINTS), help='entry points to measure (default all)')
+    parser.add_argument('--provider', default='openai')
+    parser.add_argument('--model', default='gpt-4o-mini')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results', 'cold_start.json'))
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.provider, args.model)
+        return
+
+    results = {}
+    for name in args.entry or ENTRY_POINTS:
+        runs = [measure(name, args.provider, args.model) for _ in range(args.runs)]
+        results[name] = summarize(runs)
+        print(f"{name:<12} import {results[name]['import_ms']['median']:>8.1f}ms  "
+              f"first request {results[name]['first_request_ms']['median']:>8.1f}ms  "
+              f"warm request {results[name]['second_request_ms']['median']:>7.1f}ms  "
+              f"process {results[name]['process_ms']['median']:>8.1f}ms")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'benchmark': 'cold_start',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'runs': args.runs,
+            'provider': args.provider,
+            'model': args.model,
+            'results': results
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
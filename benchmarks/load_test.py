@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Load generator for the backend entry points, run against the local mock provider.
+
+Starts the mock provider in-process, launches each target in its own process
+pointed at the mock, drives it at a fixed concurrency and records throughput,
+latency and time-to-first-token percentiles:
+
+    app      Flask app (python app.py)
+    asgi     ASGI app under uvicorn (uvicorn app:asgi_app), if uvicorn is installed
+    vercel   the api/chat.py function, served by a threaded http.server
+
+Usage:
+    python benchmarks/load_test.py [--target app --target vercel] [--concurrency 16] [--requests 400]
+                                   [--stream] [--provider openai] [--latency-ms 200] [--error-rate 0.01]
+                                   [--system-prompt-tokens 4000 --prefill-ms-per-1k 50]
+                                   [--output benchmarks/results/load_test.json]
+                                   [--compare previous.json --max-regression 10]
+
+With --compare the run fails (exit status 1) when throughput drops, or p95
+latency / TTFT rises, by more than --max-regression percent against the
+baseline file, so it can gate a deploy.
+
+With --system-prompt-tokens every request shares a system prompt of about
+that many tokens; together with the mock's --prefill-ms-per-1k this shows
+what provider-side prefix caching (backend.prefix_cache) saves. Run once with
+PREFIX_CACHE_ENABLED=false in the environment for the comparison.
+"""
+import argparse
+import http.client
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend.stats import percentile  # noqa: E402
+from mock_provider import MockServer, add_mock_arguments, config_from_args, start_mock_provider  # noqa: E402
+
+TARGETS = ('app', 'asgi', 'vercel')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def target_env(mock_url, port):
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': 'mock-key',
+        'GOOGLE_API_KEY': 'mock-key',
+        'OPENAI_API_BASE': f'{mock_url}/v1',
+        'OPENAI_BASE_URL': f'{mock_url}/v1',
+        'GOOGLE_API_ENDPOINT': mock_url,
+        'GOOGLE_BASE_URL': f'{mock_url}/v1beta',
+        'LOCAL_BASE_URL': f'{mock_url}/v1',
+        'PORT': str(port),
+        'TRACE_LOG': 'false',
+        'FLASK_DEBUG': 'false',
+        'PYTHONUNBUFFERED': '1'
+    })
+    return env
+
+
+def start_target(name, mock_url):
+    """Launch a target process and wait until it accepts requests; returns (process, port)"""
+    port = free_port()
+    if name == 'app':
+        command = [sys.executable, 'app.py']
+    elif name == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'app:asgi_app', '--port', str(port), '--log-level', 'warning']
+    else:
+        command = [sys.executable, os.path.abspath(__file__), '--serve-vercel', str(port)]
+
+    process = subprocess.Popen(command, cwd=ROOT, env=target_env(mock_url, port),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{name} exited with status {process.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{name} did not start listening on port {port}')
+
+
+def serve_vercel(port):
+    """Serve the api/chat.py function on a threaded server (hidden --serve-vercel mode)"""
+    os.chdir(ROOT)
+    spec = importlib.util.spec_from_file_location('api_chat', os.path.join(ROOT, 'api', 'chat.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    MockServer(('127.0.0.1', port), module.handler).serve_forever()
+
+
+def one_request(port, body, stream):
+    """Issue one chat request; returns (status, latency_s, ttft_s)"""
+    # Every target streams from /api/chat when the body asks for it
+    payload = json.dumps(dict(body, stream=True) if stream else body).encode()
+    start = time.perf_counter()
+    ttft = None
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        connection.request('POST', '/api/chat', payload, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        if stream and response.status == 200:
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                if ttft is None and line.startswith(b'event: delta'):
+                    ttft = time.perf_counter() - start
+        else:
+            response.read()
+            ttft = time.perf_counter() - start
+        return response.status, time.perf_counter() - start, ttft
+    except (OSError, http.client.HTTPException):
+        return 'connection_error', time.perf_counter() - start, None
+    finally:
+        connection.close()
+
+
+def run_load(port, args):
+    counter = itertools.count()
+    results = []
+    lock = threading.Lock()
+    # About four characters per token, as the mock counts them
+    system_prompt = ('Answer as a careful, concise assistant. ' * (args.system_prompt_tokens // 10 + 1))[:args.system_prompt_tokens * 4]
+
+    def worker():
+        while True:
+            index = next(counter)
+            if index >= args.requests:
+                return
+            body = {
+                'provider': args.provider,
+                'model': args.model,
+                # Unique prompts so the response cache and coalescing do not short-circuit the run
+                'message': f'benchmark request {index} {time.time_ns()}',
+                'max_tokens': 64
+            }
+            if system_prompt:
+                body['system_prompt'] = system_prompt
+            result = one_request(port, body, args.stream)
+            with lock:
+                results.append(result)
+
+    # Warm up imports, pools and lazy clients before measuring
+    for i in range(min(args.warmup, args.requests)):
+        one_request(port, {'provider': args.provider, 'model': args.model, 'message': f'warmup {i}',
+                           'system_prompt': system_prompt}, args.stream)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r[0] == 200]
+    latencies = sorted(r[1] * 1000 for r in ok)
+    ttfts = sorted(r[2] * 1000 for r in ok if r[2] is not None)
+    return {
+        'requests': len(results),
+        'succeeded': len(ok),
+        'statuses': {str(status): count for status, count in Counter(r[0] for r in results).items()},
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(ok) / elapsed, 2) if elapsed > 0 else None,
+        'latency_ms': _percentiles(latencies),
+        'ttft_ms': _percentiles(ttfts)
+    }
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    return {
+        'p50': round(percentile(values, 50), 2),
+        'p95': round(percentile(values, 95), 2),
+        'p99': round(percentile(values, 99), 2),
+        'max': round(values[-1], 2)
+    }
+
+
+def compare(results, baseline, max_regression):
+    """Print changes against a baseline run; return the list of regressions beyond the threshold"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        checks = [
+            ('throughput_rps', current['throughput_rps'], previous['throughput_rps'], -1),
+            ('latency_ms.p95', current['latency_ms']['p95'], previous['latency_ms']['p95'], 1),
+            ('ttft_ms.p95', current['ttft_ms']['p95'], previous['ttft_ms']['p95'], 1)
+        ]
+        for metric, now, before, worse_sign in checks:
+            if not now or not before:
+                continue
+            change = (now - before) / before * 100
+            print(f"  {name:<7} {metric:<15} {before:>9.2f} -> {now:>9.2f} ({change:+.1f}%)")
+            if change * worse_sign > max_regression:
+                regressions.append(f'{name} {metric} {change:+.1f}%')
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the backend entry points against a mock provider')
+    parser.add_argument('--target', action='append', choices=TARGETS, help='targets to run (default app and vercel)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--stream', action='store_true', help='request Server-Sent Events and measure TTFT')
+    parser.add_argument('--provider', default='openai', choices=('openai', 'google', 'local'))
+    parser.add_argument('--model', default='gpt-4o-mini')
+    parser.add_argument('--system-prompt-tokens', type=int, default=0,
+                        help='approximate length of a system prompt shared by all requests (default none)')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results', 'load_test.json'))
+    parser.add_argument('--compare', help='baseline results file to compare against')
+    parser.add_argument('--max-regression', type=float, default=10.0, help='allowed regression in percent')
+    parser.add_argument('--serve-vercel', type=int, help=argparse.SUPPRESS)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    if args.serve_vercel:
+        serve_vercel(args.serve_vercel)
+        return
+
+    mock = start_mock_provider(config_from_args(args))
+    mock_url = f'http://127.0.0.1:{mock.server_port}'
+
+    results = {}
+    for name in args.target or ('app', 'vercel'):
+        try:
+            process, port = start_target(name, mock_url)
+        except (OSError, RuntimeError) as e:
+            print(f"{name:<7} skipped: {e}")
+            continue
+        try:
+            results[name] = run_load(port, args)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+        result = results[name]
+        print(f"{name:<7} {result['throughput_rps']:>8} req/s  "
+              f"p50 {result['latency_ms']['p50']}ms  p95 {result['latency_ms']['p95']}ms  "
+              f"p99 {result['latency_ms']['p99']}ms  ttft p95 {result['ttft_ms']['p95']}ms  "
+              f"statuses {result['statuses']}")
+
+    report = {
+        'benchmark': 'load_test',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'settings': {
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'stream': args.stream,
+            'provider': args.provider,
+            'model': args.model,
+            'system_prompt_tokens': args.system_prompt_tokens,
+            'prefix_cache': os.getenv('PREFIX_CACHE_ENABLED', 'true').lower() != 'false',
+            'mock': {
+                'latency_ms': args.latency_ms,
+                'jitter_ms': args.jitter_ms,
+                'chunks': args.chunks,
+                'chunks_per_second': args.chunks_per_second,
+                'error_rate': args.error_rate,
+                'error_status': args.error_status,
+                'prefill_ms_per_1k': args.prefill_ms_per_1k
+            }
+        },
+        'results': results
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} (commit {baseline.get('commit')}):")
+        if baseline.get('settings') != report['settings']:
+            print("  warning: baseline was recorded with different settings")
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressions beyond {args.max_regression}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
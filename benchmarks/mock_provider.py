@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Local mock LLM provider for benchmarks; no network or API keys needed.
+
+Speaks enough of two protocols for the backend to run against it unchanged:
+
+    GET  /v1/models, /v1beta/models                   model listings
+    POST /v1/chat/completions                         OpenAI chat completions (JSON or SSE with "stream": true)
+    POST /v1beta/models/<model>:generateContent       Gemini REST
+    POST /v1beta/models/<model>:streamGenerateContent Gemini REST streaming (JSON array, or SSE with ?alt=sse)
+    POST /v1beta/cachedContents                       Gemini context caching: register a system prompt
+    GET, PATCH, DELETE /v1beta/cachedContents/<id>    read, extend (ttl) or delete a cached content
+
+With --prefill-ms-per-1k every request also waits for its prompt to be
+"read", per 1000 prompt tokens that are not cached. Like the real APIs, the
+mock caches an OpenAI system prompt of 1024 tokens or more after its first
+use and reports it as prompt_tokens_details.cached_tokens, and a Gemini
+request referencing a cached content reports cachedContentTokenCount (404
+once the cached content has expired or been deleted). With
+--cache-min-tokens, registering a shorter system prompt fails with 400 like
+Gemini's per-model minimum.
+
+Point the backend at it with
+
+    OPENAI_API_BASE=http://127.0.0.1:8900/v1          # OpenAI SDK (app.py, api/chat.py)
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1          # async gateway
+    GOOGLE_API_ENDPOINT=http://127.0.0.1:8900         # Gemini SDK
+    GOOGLE_BASE_URL=http://127.0.0.1:8900/v1beta      # async gateway
+    LOCAL_BASE_URL=http://127.0.0.1:8900/v1           # 'local' provider (OpenAI-compatible)
+
+Usage:
+    python benchmarks/mock_provider.py [--port 8900] [--latency-ms 200] [--jitter-ms 50]
+                                       [--chunks 20] [--chunks-per-second 50]
+                                       [--error-rate 0.0] [--error-status 500]
+                                       [--prefill-ms-per-1k 0] [--cache-min-tokens 0]
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GOOGLE_PATH = re.compile(r'^/v1beta/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)$')
+CACHED_CONTENT_PATH = re.compile(r'^/v1beta/(?P<name>cachedContents/[A-Za-z0-9_-]+)$')
+
+# Shortest prompt prefix OpenAI caches automatically
+OPENAI_CACHE_MIN_TOKENS = 1024
+
+
+class MockConfig:
+    """Behaviour of the mock; shared by all handler threads"""
+
+    def __init__(self, latency_ms=200, jitter_ms=50, chunks=20, chunks_per_second=50, error_rate=0.0, error_status=500,
+                 seed=None, prefill_ms_per_1k=0.0, cache_min_tokens=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.chunks = max(1, chunks)
+        self.chunks_per_second = chunks_per_second
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        self.cache_min_tokens = cache_min_tokens
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prefixes = set()  # OpenAI system prompts seen, cached from their second use
+        self.cached_contents = {}  # Gemini cachedContents name -> {'model', 'tokens', 'expires_at'}
+
+    def delay(self, uncached_tokens=0):
+        """Seconds before the first byte of the answer, including the prefill of the uncached prompt tokens"""
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+        prefill = self.prefill_ms_per_1k * uncached_tokens / 1000
+        return max(0.0, self.latency_ms + jitter + prefill) / 1000.0
+
+    def openai_cached_tokens(self, system_prompt):
+        """Tokens of a system prompt served from the prompt cache; caches it for next time"""
+        tokens = len(system_prompt) // 4
+        if tokens < OPENAI_CACHE_MIN_TOKENS:
+            return 0
+        fingerprint = hashlib.sha256(system_prompt.encode()).digest()
+        with self.lock:
+            if fingerprint in self.prefixes:
+                return tokens
+            self.prefixes.add(fingerprint)
+        return 0
+
+    def cached_content(self, name):
+        """A live cached content, or None when it is unknown or expired"""
+        with self.lock:
+            entry = self.cached_contents.get(name)
+            if entry is not None and entry['expires_at'] <= time.time():
+                del self.cached_contents[name]
+                entry = None
+            return entry
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def chunk_interval(self):
+        return 1.0 / self.chunks_per_second if self.chunks_per_second > 0 else 0.0
+
+    def words(self):
+        return [f'token{i} ' for i in range(self.chunks)]
+
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded server for benchmarks: deep accept backlog, quiet about client disconnects"""
+
+    daemon_threads = True
+    request_queue_size = 1024  # The default backlog of 5 drops connections under load
+
+    def handle_error(self, request, client_address):
+        # Clients closing pooled keep-alive connections are expected, not errors
+        pass
+
+
+def make_handler(config):
+    class MockProviderHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, like the real APIs
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            path = self.path.partition('?')[0].rstrip('/')
+            if path == '/v1/models':
+                self.send_json(200, {'object': 'list', 'data': [
+                    {'id': 'mock-model', 'object': 'model', 'owned_by': 'mock', 'max_model_len': 32768}
+                ]})
+            elif path == '/v1beta/models':
+                self.send_json(200, {'models': [{
+                    'name': 'models/mock-model', 'version': '1', 'displayName': 'Mock Model',
+                    'inputTokenLimit': 32768, 'outputTokenLimit': 8192,
+                    'supportedGenerationMethods': ['generateContent', 'countTokens', 'createCachedContent']
+                }]})
+            elif CACHED_CONTENT_PATH.match(path):
+                name = CACHED_CONTENT_PATH.match(path).group('name')
+                entry = config.cached_content(name)
+                if entry is None:
+                    self.send_cache_missing(name)
+                else:
+                    self.send_json(200, cached_content_resource(name, entry))
+            else:
+                self.send_json(404, {'error': {'message': 'Not found'}})
+
+        def do_PATCH(self):
+            path, _, query = self.path.partition('?')
+            body = self.read_json()
+            match = CACHED_CONTENT_PATH.match(path)
+            if body is None or not match:
+                self.send_json(400 if body is None else 404, {'error': {'message': f'Cannot update {path}'}})
+                return
+            name = match.group('name')
+            entry = config.cached_content(name)
+            if entry is None:
+                self.send_cache_missing(name)
+                return
+            if 'ttl' in query:
+                with config.lock:
+                    entry['expires_at'] = time.time() + parse_ttl(body.get('ttl'))
+            self.send_json(200, cached_content_resource(name, entry))
+
+        def do_DELETE(self):
+            match = CACHED_CONTENT_PATH.match(self.path.partition('?')[0])
+            name = match.group('name') if match else self.path
+            with config.lock:
+                entry = config.cached_contents.pop(name, None)
+            if entry is None:
+                self.send_cache_missing(name)
+            else:
+                self.send_json(200, {})
+
+        def do_POST(self):
+            body = self.read_json()
+            if body is None:
+                self.send_json(400, {'error': {'message': 'Invalid JSON'}})
+                return
+
+            path, _, query = self.path.partition('?')
+            if config.should_fail():
+                time.sleep(config.delay())
+                self.send_error_response()
+                return
+
+            if path == '/v1/chat/completions':
+                self.openai(body)
+                return
+            if path == '/v1beta/cachedContents':
+                self.create_cached_content(body)
+                return
+            match = GOOGLE_PATH.match(path)
+            if match:
+                self.google(match.group('model'), match.group('method'), body, 'alt=sse' in query)
+                return
+            self.send_json(404, {'error': {'message': f'Unknown path {path}'}})
+
+        # OpenAI
+
+        def openai(self, body):
+            model = body.get('model', 'mock-model')
+            messages = body.get('messages', [])
+            prompt = ' '.join(str(m.get('content', '')) for m in messages)
+            prompt_tokens = max(1, len(prompt) // 4)
+            system_prompt = str(messages[0].get('content', '')) if messages and messages[0].get('role') == 'system' else ''
+            cached_tokens = config.openai_cached_tokens(system_prompt) if system_prompt else 0
+            words = config.words()
+            usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(words), 'total_tokens': prompt_tokens + len(words),
+                     'prompt_tokens_details': {'cached_tokens': cached_tokens}}
+            time.sleep(config.delay(prompt_tokens - cached_tokens))
+
+            if not body.get('stream'):
+                self.send_json(200, {
+                    'id': 'chatcmpl-mock',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': ''.join(words)},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': usage
+                })
+                return
+
+            self.start_stream('text/event-stream')
+            interval = config.chunk_interval()
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(interval)
+                self.write_chunk(sse({
+                    'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]
+                }))
+            self.write_chunk(sse({
+                'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+            }))
+            if (body.get('stream_options') or {}).get('include_usage'):
+                self.write_chunk(sse({'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'choices': [],
+                                      'usage': usage}))
+            self.write_chunk('data: [DONE]\n\n')
+            self.end_stream()
+
+        # Gemini
+
+        def google(self, model, method, body, alt_sse):
+            prompt = ' '.join(part.get('text', '') for content in body.get('contents', [])
+                              for part in content.get('parts', []))
+            system = ' '.join(part.get('text', '') for part in (body.get('systemInstruction') or {}).get('parts', []))
+            cached_tokens = 0
+            if body.get('cachedContent'):
+                entry = config.cached_content(body['cachedContent'])
+                if entry is None:
+                    self.send_cache_missing(body['cachedContent'])
+                    return
+                cached_tokens = entry['tokens']
+            uncached_tokens = max(1, len(prompt + system) // 4)
+            prompt_tokens = uncached_tokens + cached_tokens
+            words = config.words()
+            time.sleep(config.delay(uncached_tokens))
+
+            def response(text, finish=None, usage=False):
+                candidate = {'content': {'role': 'model', 'parts': [{'text': text}]}, 'index': 0}
+                if finish:
+                    candidate['finishReason'] = finish
+                payload = {'candidates': [candidate]}
+                if usage:
+                    payload['usageMetadata'] = {'promptTokenCount': prompt_tokens, 'candidatesTokenCount': len(words),
+                                                'totalTokenCount': prompt_tokens + len(words)}
+                    if cached_tokens:
+                        payload['usageMetadata']['cachedContentTokenCount'] = cached_tokens
+                return payload
+
+            if method == 'generateContent':
+                self.send_json(200, response(''.join(words), 'STOP', usage=True))
+                return
+
+            interval = config.chunk_interval()
+            last = len(words) - 1
+            if alt_sse:
+                self.start_stream('text/event-stream')
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(interval)
+                    self.write_chunk(sse(response(word, 'STOP' if i == last else None, usage=i == last)))
+            else:
+                # The SDK's REST transport reads a streamed JSON array
+                self.start_stream('application/json')
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(interval)
+                    prefix = '[' if i == 0 else ',\r\n'
+                    self.write_chunk(prefix + json.dumps(response(word, 'STOP' if i == last else None, usage=i == last)))
+                self.write_chunk(']')
+            self.end_stream()
+
+        def create_cached_content(self, body):
+            text = ' '.join(part.get('text', '') for content in [body.get('systemInstruction') or {}] + body.get('contents', [])
+                            for part in content.get('parts', []))
+            name = f'cachedContents/{uuid.uuid4().hex[:16]}'
+            entry = {'model': body.get('model', 'models/mock-model'), 'tokens': max(1, len(text) // 4),
+                     'expires_at': time.time() + parse_ttl(body.get('ttl'))}
+            if entry['tokens'] < config.cache_min_tokens:
+                self.send_json(400, {'error': {'code': 400, 'status': 'INVALID_ARGUMENT', 'message': (
+                    f"Cached content is too small. total_token_count={entry['tokens']}, "
+                    f"min_total_token_count={config.cache_min_tokens}")}})
+                return
+            with config.lock:
+                config.cached_contents[name] = entry
+            self.send_json(200, cached_content_resource(name, entry))
+
+        # Transport helpers
+
+        def read_json(self):
+            """The request's JSON body ({} when empty), or None when it is invalid"""
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                return json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                return None
+
+        def send_cache_missing(self, name):
+            self.send_json(404, {'error': {'code': 404, 'message': f'{name} not found', 'status': 'NOT_FOUND'}})
+
+        def send_error_response(self):
+            status = config.error_status
+            message = 'Rate limit exceeded (mock)' if status == 429 else 'Injected failure (mock)'
+            headers = {'Retry-After': '1'} if status == 429 else None
+            self.send_json(status, {'error': {'message': message, 'code': status}}, headers)
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def start_stream(self, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+        def write_chunk(self, text):
+            data = text.encode()
+            self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+            self.wfile.flush()
+
+        def end_stream(self):
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+
+    return MockProviderHandler
+
+
+def sse(payload):
+    return f'data: {json.dumps(payload)}\n\n'
+
+
+def parse_ttl(ttl, default=3600):
+    """Seconds of a Gemini duration such as '300s'"""
+    try:
+        return float(str(ttl).rstrip('s'))
+    except ValueError:
+        return default
+
+
+def cached_content_resource(name, entry):
+    return {'name': name, 'model': entry['model'], 'usageMetadata': {'totalTokenCount': entry['tokens']},
+            'expireTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(entry['expires_at']))}
+
+
+def start_mock_provider(config, host='127.0.0.1', port=0):
+    """Start the mock in a background thread; returns the server (server.server_port is the bound port)"""
+    server = MockServer((host, port), make_handler(config))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_mock_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=200, help='delay before the first byte')
+    parser.add_argument('--jitter-ms', type=float, default=50, help='uniform +/- jitter on the delay')
+    parser.add_argument('--chunks', type=int, default=20, help='completion chunks (one word each)')
+    parser.add_argument('--chunks-per-second', type=float, default=50, help='streaming rate after the first chunk')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=500, help='status of injected failures (e.g. 429, 500, 503)')
+    parser.add_argument('--seed', type=int, default=None, help='seed for jitter and error injection')
+    parser.add_argument('--prefill-ms-per-1k', type=float, default=0.0,
+                        help='extra delay per 1000 prompt tokens not served from a prompt cache')
+    parser.add_argument('--cache-min-tokens', type=int, default=0,
+                        help='smallest system prompt a Gemini cached content accepts, in tokens')
+
+
+def config_from_args(args):
+    return MockConfig(args.latency_ms, args.jitter_ms, args.chunks, args.chunks_per_second, args.error_rate,
+                      args.error_status, args.seed, args.prefill_ms_per_1k, args.cache_min_tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock OpenAI / Gemini provider for local benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer((args.host, args.port), make_handler(config_from_args(args)))
+    print(f"Mock provider listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
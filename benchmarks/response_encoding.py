@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Bytes on the wire and CPU time per response for the shared response layer.
+
+Encodes representative payloads of the JSON endpoints the way the handlers
+did before backend.responses (stdlib json.dumps, uncompressed) and the way
+they do now (fast JSON backend, then gzip or brotli), and reports per payload:
+
+    bytes      response body size as sent
+    cpu_us     CPU time to serialize (and compress) one response, median of --repeat runs
+    ratio      bytes relative to the baseline
+
+Payloads: a chat reply, an 8-model comparison, a 200-item batch (JSON lines,
+compressed as a stream the way /api/chat/batch sends it), a history page and
+conversation, the model catalog and the health document. Their text is drawn
+from SETUP.md so that it compresses like real prose.
+
+Usage:
+    python benchmarks/response_encoding.py [--repeat 200] [--min-size 1024]
+                                           [--output benchmarks/results/response_encoding.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend import responses  # noqa: E402
+from backend.catalog import DEFAULT_MODELS, model_entry  # noqa: E402
+from backend.responses import ResponseEncoder  # noqa: E402
+
+
+def _words():
+    with open(os.path.join(ROOT, 'SETUP.md')) as f:
+        return [word for word in f.read().split() if word.isalpha()]
+
+
+def build_payloads(seed=7):
+    rng = random.Random(seed)
+    words = _words()
+
+    def text(count):
+        return ' '.join(rng.choice(words) for _ in range(count))
+
+    def usage():
+        return {'prompt_tokens': rng.randint(20, 2000), 'completion_tokens': rng.randint(50, 800),
+                'total_tokens': rng.randint(100, 2800), 'temperature': 0.7, 'max_tokens': 1000, 'top_p': 1.0}
+
+    chat = {'response': text(150), 'provider': 'openai', 'model': 'gpt-4o-mini', 'usage': usage()}
+    compare = {
+        'results': [{'type': 'result', 'index': i, 'provider': 'openai', 'model': f'gpt-4o-{i}', 'response': text(250),
+                     'latency_ms': rng.uniform(300, 4000), 'ttft_ms': None, 'completion_tokens': rng.randint(100, 600),
+                     'prompt_tokens': 40, 'cached': False, 'served_by': None, 'error': None} for i in range(8)],
+        'summary': {'type': 'done', 'targets': 8, 'total_ms': 4021.3, 'sum_latency_ms': 17250.4}
+    }
+    batch = [{'response': text(120), 'cached': False, 'error': None, 'prompt_tokens': 35,
+              'completion_tokens': rng.randint(80, 300), 'index': i, 'id': f'item-{i}', 'provider': 'openai',
+              'model': 'gpt-4o-mini', 'latency_ms': rng.uniform(300, 3000)} for i in range(200)]
+    history_page = {
+        'conversations': [{'id': f'{rng.getrandbits(64):016x}', 'title': text(6), 'provider': 'openai', 'model': 'gpt-4o',
+                           'created_at': 1.76e9 + i, 'updated_at': 1.76e9 + i * 7, 'message_count': rng.randint(2, 40)}
+                          for i in range(100)],
+        'next_cursor': 'MTc2MDAwMDAwMA'
+    }
+    conversation = {
+        'id': 'a1b2c3d4', 'title': text(6), 'provider': 'openai', 'model': 'gpt-4o', 'params': {'temperature': 0.7},
+        'messages': [{'id': i, 'role': 'user' if i % 2 == 0 else 'assistant', 'content': text(20 if i % 2 == 0 else 180),
+                      'created_at': 1.76e9 + i * 30} for i in range(50)]
+    }
+    catalog = {provider: [model_entry(model) for model in models] for provider, models in DEFAULT_MODELS.items()}
+    health = {'status': 'healthy', 'clients': {'openai': True, 'google': False, 'local': False},
+              'cache': {'hits': 1204, 'misses': 5512, 'entries': 812, 'evictions': 0},
+              'scheduler': {provider: {'queued': 0, 'admitted': 812, 'rejected': 3} for provider in DEFAULT_MODELS},
+              'usage': {'recorded': 6716, 'written': 6716, 'batches': 710, 'dropped': 0, 'pending': 0}}
+    return {
+        'chat': {'payload': chat},
+        'compare': {'payload': compare},
+        'batch': {'lines': batch},
+        'history_page': {'payload': history_page},
+        'conversation': {'payload': conversation},
+        'models': {'payload': catalog},
+        'health': {'payload': health}
+    }
+
+
+def _median_us(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        samples.append((time.process_time() - start) * 1e6)
+    return round(statistics.median(samples), 1)
+
+
+def variants(payload, encoder):
+    """Encoding name -> function returning the response body as sent"""
+    encodings = ('gzip', 'br') if responses.brotli is not None else ('gzip',)
+    if 'lines' in payload:
+        # JSON lines sent as a stream, one chunk per line
+        lines = payload['lines']
+
+        def fast():
+            return (responses.dumps(line) + b'\n' for line in lines)
+
+        def compressed(encoding):
+            return lambda: b''.join(encoder.compress_stream(fast(), encoding))
+
+        result = {
+            'baseline': lambda: b''.join((json.dumps(line) + '\n').encode() for line in lines),
+            'fast_json': lambda: b''.join(fast())
+        }
+    else:
+        obj = payload['payload']
+
+        def compressed(encoding):
+            def encode():
+                body = responses.dumps(obj)
+                return encoder.compress(body, encoding) or body
+            return encode
+
+        result = {
+            'baseline': lambda: json.dumps(obj).encode(),
+            'fast_json': lambda: responses.dumps(obj)
+        }
+    for encoding in encodings:
+        result[encoding] = compressed(encoding)
+    return result
+
+
+def run(repeat, min_size):
+    encoder = ResponseEncoder(min_size=min_size)
+    results = {}
+    for name, payload in build_payloads().items():
+        encoders = variants(payload, encoder)
+        baseline = len(encoders['baseline']())
+        results[name] = {}
+        for variant, fn in encoders.items():
+            size = len(fn())
+            results[name][variant] = {'bytes': size, 'cpu_us': _median_us(fn, repeat), 'ratio': round(size / baseline, 3)}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure response size and encoding CPU time before and after the response layer')
+    parser.add_argument('--repeat', type=int, default=200, help='encodings per payload and variant')
+    parser.add_argument('--min-size', type=int, default=int(os.getenv('COMPRESS_MIN_SIZE', 1024)))
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results', 'response_encoding.json'))
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.min_size)
+    print(f"{'payload':<14} {'variant':<10} {'bytes':>9} {'ratio':>7} {'cpu_us':>9}")
+    for name, by_variant in results.items():
+        for variant, result in by_variant.items():
+            print(f"{name:<14} {variant:<10} {result['bytes']:>9} {result['ratio']:>7.3f} {result['cpu_us']:>9.1f}")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'benchmark': 'response_encoding',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'json_backend': responses.JSON_BACKEND,
+            'brotli': responses.brotli is not None,
+            'min_size': args.min_size,
+            'repeat': args.repeat,
+            'results': results
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
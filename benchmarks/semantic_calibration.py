@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Calibration of the semantic cache threshold on paraphrase and near-miss pairs.
+
+A paraphrase pair should be served the same answer; a near-miss pair shares
+almost all of its wording but asks something else (another language, a
+negation, a different number, an opposite). For each pair this reports the
+embedder's cosine similarity and whether the exact terms match (see
+backend.semantic_cache.exact_terms), then:
+
+    safe_threshold   lowest threshold at which no near-miss pair is a hit
+    recommended      safe_threshold plus --margin, rounded up to 0.01
+    recall           paraphrase pairs that are hits at the recommended and the configured threshold
+
+DEFAULT_THRESHOLD in backend/semantic_cache.py is set from this; rerun it
+after changing the embedder, or to calibrate a custom one.
+
+Usage:
+    python benchmarks/semantic_calibration.py [--embedder hashed] [--margin 0.05]
+                                              [--output benchmarks/results/semantic_calibration.json]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend.semantic_cache import DEFAULT_THRESHOLD, exact_terms, load_embedder  # noqa: E402
+
+PARAPHRASES = [
+    ('how do I reset my password', 'How can I reset my password?'),
+    ('What is the capital of France?', 'what is the capital of france'),
+    ('Explain how photosynthesis works', 'Can you explain how photosynthesis works?'),
+    ('Write a haiku about autumn leaves', 'Write a haiku about the autumn leaves'),
+    ('What are the benefits of unit testing?', 'What are the benefits of unit tests?'),
+    ('Summarize the plot of Hamlet', 'Please summarize the plot of Hamlet.'),
+    ('How do I create a virtual environment in Python?', 'How to create a virtual environment in Python'),
+    ('Give me a recipe for banana bread', 'Can you give me a recipe for banana bread?'),
+    ('What causes the seasons on Earth?', 'What causes seasons on the Earth?'),
+    ('How does a hash table work?', 'How does a hash table work internally?'),
+    ('List some tips for better sleep', 'Give me some tips for better sleep'),
+    ('Translate "good morning" to French', 'Translate "good morning" into French'),
+    ('What is the difference between TCP and UDP?', "What's the difference between TCP and UDP?"),
+    ('Why is the sky blue?', 'why is the sky blue'),
+    ('Explain recursion with an example', 'Explain recursion using an example'),
+    ('How do I center a div in CSS?', 'How can I center a div with CSS?'),
+    ('Tell me a joke about cats', 'Tell me a joke about a cat'),
+    ('What is 15 percent of 80?', 'What is 15% of 80?'),
+    ('Is coffee bad for your health?', 'Is coffee bad for health?'),
+    ('Who wrote Pride and Prejudice?', 'Who is the author of Pride and Prejudice?'),
+    ('What is machine learning?', 'what is machine learning'),
+    ('Explain quantum computing in simple terms', 'Please explain quantum computing in simple terms'),
+]
+
+NEAR_MISSES = [
+    ('Translate "good morning" to French', 'Translate "good morning" to Spanish'),
+    ('Is it safe to eat raw eggs?', 'Is it not safe to eat raw eggs?'),
+    ('What is the largest planet in the solar system?', 'What is the smallest planet in the solar system?'),
+    ('What is 15 percent of 80?', 'What is 25 percent of 80?'),
+    ('Convert 100 Fahrenheit to Celsius', 'Convert 100 Celsius to Fahrenheit'),
+    ('Write a function to sort a list in Python', 'Write a function to sort a list in JavaScript'),
+    ('Should I use tabs or spaces?', 'Should I not use tabs or spaces?'),
+    ('Summarize the plot of Hamlet', 'Summarize the plot of Macbeth'),
+    ('What happened in 1969?', 'What happened in 1989?'),
+    ('Rename the variable "foo" to "bar"', 'Rename the variable "foo" to "baz"'),
+    ('Which is faster, TCP or UDP?', 'Which is slower, TCP or UDP?'),
+    ('What is the maximum value of a 32-bit integer?', 'What is the minimum value of a 32-bit integer?'),
+    ('Can dogs eat grapes?', "Can't dogs eat grapes?"),
+    ('List the first 10 prime numbers', 'List the first 20 prime numbers'),
+    ('Explain the pros of remote work', 'Explain the cons of remote work'),
+    ('How do I increase my credit score?', 'How do I decrease my credit score?'),
+    ('Translate "thank you" into German', 'Translate "thank you" into Japanese'),
+    ('What was the best movie of 2010?', 'What was the worst movie of 2010?'),
+    ('Is Python better than Java for beginners?', 'Is Java better than Python for beginners?'),
+    ('Write a short poem about the sea', 'Write a long poem about the sea'),
+    ('What is the capital of France?', 'What is the capital of Germany?'),
+    ('How do I merge two branches in git?', 'How do I delete two branches in git?'),
+    ('Send an email to Alice', 'Send an email from Alice'),
+    ('How many calories are in an apple?', 'How many calories are in a banana?'),
+    ('Sort the list in ascending order', 'Sort the list in descending order'),
+    ('What is the time complexity of quicksort?', 'What is the space complexity of quicksort?'),
+    ('Who was the first president of the United States?', 'Who was the second president of the United States?'),
+    ('Explain the causes of World War I', 'Explain the consequences of World War I'),
+]
+
+
+def score(embedder, pairs):
+    """[(a, b, similarity, terms match)] for a list of prompt pairs"""
+    results = []
+    for a, b in pairs:
+        vectors = embedder.embed([a, b])
+        results.append((a, b, float(vectors[0] @ vectors[1]), exact_terms(a) == exact_terms(b)))
+    return results
+
+
+def safe_threshold(near_misses):
+    """Lowest threshold at which none of the scored near-miss pairs would be a hit"""
+    similarities = [similarity for _, _, similarity, terms_match in near_misses if terms_match]
+    return max(similarities, default=0.0) + 1e-6
+
+
+def recall(paraphrases, threshold):
+    hits = sum(1 for _, _, similarity, terms_match in paraphrases if terms_match and similarity >= threshold)
+    return round(hits / len(paraphrases), 3)
+
+
+def calibrate(embedder, margin=0.05):
+    paraphrases = score(embedder, PARAPHRASES)
+    near_misses = score(embedder, NEAR_MISSES)
+    safe = safe_threshold(near_misses)
+    recommended = min(1.0, math.ceil((safe + margin) * 100) / 100)
+    return {
+        'safe_threshold': round(safe, 4),
+        'recommended': recommended,
+        'recall': {'recommended': recall(paraphrases, recommended), 'configured': recall(paraphrases, DEFAULT_THRESHOLD)},
+        'paraphrases': paraphrases,
+        'near_misses': near_misses
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate the semantic cache threshold on paraphrase and near-miss pairs')
+    parser.add_argument('--embedder', default=os.getenv('SEMANTIC_CACHE_EMBEDDER', 'hashed'))
+    parser.add_argument('--dim', type=int, default=int(os.getenv('SEMANTIC_CACHE_DIM', 512)))
+    parser.add_argument('--margin', type=float, default=0.05, help='added to the safe threshold')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results', 'semantic_calibration.json'))
+    args = parser.parse_args()
+
+    result = calibrate(load_embedder(args.embedder, args.dim), args.margin)
+    for name in ('paraphrases', 'near_misses'):
+        print(name)
+        for a, b, similarity, terms_match in sorted(result[name], key=lambda row: -row[2]):
+            print(f"  {similarity:6.3f} {'terms' if terms_match else '     '}  {a} | {b}")
+    print(f"safe threshold {result['safe_threshold']}, recommended {result['recommended']} "
+          f"(paraphrase recall {result['recall']['recommended']}); "
+          f"configured {DEFAULT_THRESHOLD} (recall {result['recall']['configured']})")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(dict(result, benchmark='semantic_calibration', embedder=args.embedder, margin=args.margin,
+                       timestamp=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())), f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
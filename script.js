@@ -2,8 +2,20 @@ class LLMPlayground {
     constructor() {
         this.messagesData = [];
         this.isTyping = false;
+        // Reply being generated: { id, controller } so the stop button can abort it (/api/chat/abort)
+        this.activeRequest = null;
         this.currentChatId = null;
-        this.chatHistory = [];
+        // Server-side history (/api/history): messages already saved for the current chat, and list paging state.
+        // Where the backend has no /api/history (e.g. on Vercel) chats stay in localStorage instead.
+        this.historyServer = false;
+        this.clientId = this.loadClientId();
+        this.historySavedCount = 0;
+        this.historyQuery = '';
+        this.historyCursor = null;
+        this.historyOffset = 0;
+        this.historyDone = false;
+        this.historyLoading = false;
+        this.historyRequest = 0;
         this.modelParams = {
             provider: 'openai',
             model: 'gpt-3.5-turbo',
@@ -14,17 +26,29 @@ class LLMPlayground {
             systemPrompt: '',
             apiKey: ''
         };
+        // Model lists from /api/models, keyed by provider; the built-in lists are used until it loads
+        this.modelCatalog = null;
         
         this.initializeElements();
         this.bindEvents();
-        this.loadChatHistory();
+        this.historyReady = this.loadChatHistory();
         this.loadSettings();
         this.updateModelDisplay();
+        this.loadModelCatalog();
     }
 
     initializeElements() {
         // Header elements
         this.newChatBtn = document.getElementById('newChatBtn');
+        this.historyBtn = document.getElementById('historyBtn');
+
+        // History pane elements
+        this.historyPane = document.getElementById('historyPane');
+        this.historyPaneClose = document.getElementById('historyPaneClose');
+        this.historySearch = document.getElementById('historySearch');
+        this.historyList = document.getElementById('historyList');
+        this.historyItems = document.getElementById('historyItems');
+        this.historyStatus = document.getElementById('historyStatus');
 
         // Right pane elements
         this.rightPane = document.getElementById('rightPane');
@@ -70,6 +94,20 @@ class LLMPlayground {
     bindEvents() {
         // Header events
         this.newChatBtn.addEventListener('click', () => this.startNewChat());
+        this.historyBtn.addEventListener('click', () => this.toggleHistoryPane());
+
+        // History pane events: search as you type, next page when the end of the list scrolls into view
+        this.historyPaneClose.addEventListener('click', () => this.toggleHistoryPane());
+        this.historySearch.addEventListener('input', () => {
+            clearTimeout(this.historySearchTimer);
+            this.historySearchTimer = setTimeout(() => this.resetHistoryList(this.historySearch.value.trim()), 250);
+        });
+        this.historyObserver = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                this.loadHistoryPage();
+            }
+        }, { root: this.historyList, rootMargin: '200px' });
+        this.historyObserver.observe(this.historyStatus);
 
         // Right pane events
         this.rightPaneToggle.addEventListener('click', () => this.toggleRightPane());
@@ -107,7 +145,8 @@ class LLMPlayground {
             }
         });
 
-        this.sendBtn.addEventListener('click', () => this.handleSendMessage());
+        // The send button turns into a stop button while a reply is generated
+        this.sendBtn.addEventListener('click', () => this.isTyping ? this.stopGeneration() : this.handleSendMessage());
 
         // Header action events
         this.clearBtn.addEventListener('click', () => this.clearConversation());
@@ -135,6 +174,9 @@ class LLMPlayground {
                 this.startNewChat();
             }
             if (e.key === 'Escape') {
+                if (this.activeRequest) {
+                    this.stopGeneration();
+                }
                 this.messageInput.focus();
             }
         });
@@ -210,7 +252,7 @@ class LLMPlayground {
             ]
         };
 
-        const models = modelOptions[provider] || [];
+        const models = (this.modelCatalog && this.modelCatalog[provider]) || modelOptions[provider] || [];
         
         // Add new options
         models.forEach(model => {
@@ -233,6 +275,19 @@ class LLMPlayground {
         }
     }
 
+    async loadModelCatalog() {
+        // The browser's HTTP cache honours the catalog's Cache-Control and
+        // revalidates with its ETag, so repeat loads rarely transfer the body
+        try {
+            const response = await fetch('/api/models');
+            if (!response.ok) return;
+            this.modelCatalog = await response.json();
+            this.updateModelOptions(this.modelParams.provider);
+        } catch (error) {
+            console.error('Could not load models:', error);
+        }
+    }
+
     // Model parameter methods
     updateModel(model) {
         this.modelParams.model = model;
@@ -338,9 +393,13 @@ class LLMPlayground {
 
     updateSendButtonState() {
         const hasText = this.messageInput.value.trim().length > 0;
-        this.sendBtn.disabled = !hasText || this.isTyping;
+        const stoppable = this.isTyping && this.activeRequest !== null;
+        this.sendBtn.disabled = stoppable ? false : !hasText || this.isTyping;
+        this.sendBtn.classList.toggle('stop', stoppable);
+        this.sendBtn.title = stoppable ? 'Stop generating' : 'Send message';
+        this.sendBtn.innerHTML = stoppable ? '<i class="fas fa-stop"></i>' : '<i class="fas fa-paper-plane"></i>';
         
-        if (hasText && !this.isTyping) {
+        if (stoppable || (hasText && !this.isTyping)) {
             this.sendBtn.style.opacity = '1';
             this.sendBtn.style.cursor = 'pointer';
         } else {
@@ -400,6 +459,11 @@ class LLMPlayground {
     }
 
     addMessage(sender, content) {
+        this.createMessageElement(sender, content);
+        this.storeMessage(sender, content);
+    }
+
+    createMessageElement(sender, content) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${sender}`;
 
@@ -420,7 +484,10 @@ class LLMPlayground {
         this.messages.appendChild(messageDiv);
         this.scrollToBottom();
 
-        // Store message
+        return messageContent;
+    }
+
+    storeMessage(sender, content) {
         this.messagesData.push({ 
             sender, 
             content, 
@@ -444,28 +511,78 @@ class LLMPlayground {
         this.showTypingIndicator();
         this.updateSendButtonState();
 
+        let messageContent = null;
+        let responseText = '';
+
         try {
-            // Call the backend API
+            // Stream tokens from the backend, rendering each chunk as it arrives
             console.log('Calling backend API...');
-            const response = await this.callBackendAPI(userMessage);
-            
+            const response = await this.streamBackendAPI(userMessage, (token) => {
+                if (!messageContent) {
+                    this.hideTypingIndicator();
+                    messageContent = this.createMessageElement('assistant', '');
+                }
+                responseText += token;
+                messageContent.innerHTML = this.formatMessage(responseText);
+                this.scrollToBottom();
+            });
+
             this.hideTypingIndicator();
-            this.addMessage('assistant', response);
+            if (messageContent) {
+                this.storeMessage('assistant', response);
+            } else {
+                this.addMessage('assistant', response);
+            }
         } catch (error) {
-            console.error('Error generating AI response:', error);
             this.hideTypingIndicator();
-            this.addMessage('assistant', `Sorry, I encountered an error: ${error.message}. Please check your API keys and try again.`);
+            if (error.name === 'AbortError') {
+                // Stopped by the user: keep what was generated so far
+                console.log('Generation stopped');
+                if (messageContent) {
+                    this.storeMessage('assistant', responseText);
+                }
+                return;
+            }
+            console.error('Error generating AI response:', error);
+            const errorText = `Sorry, I encountered an error: ${error.message}. Please check your API keys and try again.`;
+            if (messageContent) {
+                responseText += `\n\n${errorText}`;
+                messageContent.innerHTML = this.formatMessage(responseText);
+                this.storeMessage('assistant', responseText);
+            } else {
+                this.addMessage('assistant', errorText);
+            }
         } finally {
             this.isTyping = false;
+            this.activeRequest = null;
             this.updateSendButtonState();
         }
     }
 
-    async callBackendAPI(userMessage) {
-        // Use relative URL for Vercel deployment
-        const backendUrl = '/api/chat';
-        
-        const requestData = {
+    stopGeneration() {
+        const active = this.activeRequest;
+        if (!active) return;
+        this.activeRequest = null;
+        // Tell the backend first so it closes the provider stream right away, then drop the connection
+        fetch('/api/chat/abort', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ request_id: active.id }),
+            keepalive: true
+        }).catch((error) => console.warn('Abort request failed:', error));
+        active.controller.abort();
+        this.updateSendButtonState();
+    }
+
+    newRequestId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
+
+    buildRequestData(userMessage) {
+        return {
             provider: this.modelParams.provider,
             model: this.modelParams.model,
             message: userMessage,
@@ -473,8 +590,17 @@ class LLMPlayground {
             temperature: this.modelParams.temperature,
             max_tokens: this.modelParams.maxTokens,
             top_p: this.modelParams.topP,
-            seed: this.modelParams.seed
+            seed: this.modelParams.seed,
+            // Prior turns are kept server-side, keyed by the chat id
+            conversation_id: this.currentChatId
         };
+    }
+
+    async callBackendAPI(userMessage) {
+        // Use relative URL for Vercel deployment
+        const backendUrl = '/api/chat';
+        
+        const requestData = this.buildRequestData(userMessage);
 
         console.log('Sending request to backend:', requestData);
         console.log('Backend URL:', backendUrl);
@@ -501,6 +627,79 @@ class LLMPlayground {
         return data.response;
     }
 
+    async streamBackendAPI(userMessage, onToken) {
+        // Same endpoint as callBackendAPI, but asks the backend for Server-Sent Events
+        const backendUrl = '/api/chat';
+        const requestData = { ...this.buildRequestData(userMessage), stream: true };
+
+        // The request id lets the stop button abort this request on the backend
+        const requestId = this.newRequestId();
+        const controller = new AbortController();
+        this.activeRequest = { id: requestId, controller };
+        this.updateSendButtonState();
+
+        const response = await fetch(backendUrl, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+                'X-Request-ID': requestId
+            },
+            body: JSON.stringify(requestData),
+            signal: controller.signal
+        });
+
+        if (!response.ok) {
+            const errorData = await response.json();
+            console.error('Backend error:', errorData);
+            throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
+        }
+
+        // Backends without streaming support answer with a plain JSON body
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!contentType.includes('text/event-stream') || !response.body) {
+            const data = await response.json();
+            onToken(data.response);
+            return data.response;
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                const dataLine = rawEvent.split('\n').find(line => line.startsWith('data: '));
+                if (!dataLine) continue;
+                const event = JSON.parse(dataLine.slice(6));
+
+                if (event.type === 'delta') {
+                    text += event.text;
+                    onToken(event.text);
+                } else if (event.type === 'done') {
+                    console.log('Stream finished:', event.finish_reason, event.usage);
+                    if (event.finish_reason === 'cancelled') {
+                        throw new DOMException('Generation stopped', 'AbortError');
+                    }
+                } else if (event.type === 'error') {
+                    throw new Error(event.error);
+                }
+            }
+        }
+
+        return text;
+    }
+
     generateMockResponse(userMessage) {
         const responses = [
             "That's an interesting question! Let me think about that...",
@@ -571,6 +770,7 @@ class LLMPlayground {
     startNewChat() {
         this.messagesData = [];
         this.currentChatId = null;
+        this.historySavedCount = 0;
         this.messages.innerHTML = '';
         this.welcomeScreen.style.display = 'flex';
         this.chatContainer.style.display = 'none';
@@ -583,6 +783,20 @@ class LLMPlayground {
 
     clearConversation() {
         if (confirm('Are you sure you want to clear this conversation?')) {
+            if (this.currentChatId) {
+                // Drop the server-side history as well; failures only leave an orphaned session
+                fetch(`/api/conversations/${encodeURIComponent(this.currentChatId)}`, { method: 'DELETE' })
+                    .catch(error => console.warn('Failed to delete conversation:', error));
+                if (this.historyServer) {
+                    this.historyFetch(`/api/history/${encodeURIComponent(this.currentChatId)}`, { method: 'DELETE' })
+                        .catch(error => console.warn('Failed to delete chat history:', error));
+                } else {
+                    const chats = this.localChats().filter(chat => chat.id !== this.currentChatId);
+                    localStorage.setItem('llm_chat_history', JSON.stringify(chats));
+                }
+                this.removeHistoryItem(this.currentChatId);
+            }
+            this.historySavedCount = 0;
             this.messagesData = [];
             this.messages.innerHTML = '';
             this.welcomeScreen.style.display = 'flex';
@@ -617,34 +831,362 @@ class LLMPlayground {
     }
 
     // Storage methods
-    saveChatHistory() {
-        if (this.messagesData.length > 0 && this.currentChatId) {
-            const chatData = {
-                id: this.currentChatId,
-                title: this.messagesData[0]?.content.substring(0, 50) + '...',
-                messages: this.messagesData,
-                timestamp: new Date(),
-                modelParams: { ...this.modelParams }
-            };
+    loadClientId() {
+        // Random per-browser id that scopes the server-side history to this browser (X-Client-ID)
+        let clientId = localStorage.getItem('llm_client_id');
+        if (!clientId) {
+            clientId = Array.from(crypto.getRandomValues(new Uint8Array(16)), byte => byte.toString(16).padStart(2, '0')).join('');
+            localStorage.setItem('llm_client_id', clientId);
+        }
+        return clientId;
+    }
 
-            let history = JSON.parse(localStorage.getItem('llm_chat_history') || '[]');
-            const existingIndex = history.findIndex(chat => chat.id === this.currentChatId);
-            
-            if (existingIndex >= 0) {
-                history[existingIndex] = chatData;
+    historyFetch(url, options = {}) {
+        return fetch(url, { ...options, headers: { ...options.headers, 'X-Client-ID': this.clientId } });
+    }
+
+    localChats() {
+        return JSON.parse(localStorage.getItem('llm_chat_history') || '[]');
+    }
+
+    saveLocalChat(title) {
+        // localStorage fallback: whole chats, newest first, the last 50 kept
+        const chats = this.localChats().filter(chat => chat.id !== this.currentChatId);
+        chats.unshift({
+            id: this.currentChatId,
+            title,
+            messages: this.messagesData,
+            timestamp: new Date(),
+            modelParams: this.historyParams()
+        });
+        localStorage.setItem('llm_chat_history', JSON.stringify(chats.slice(0, 50)));
+    }
+
+    localHistoryPage() {
+        // The localStorage chats in the shape of the /api/history responses, as a single page
+        const query = this.historyQuery.toLowerCase();
+        const chats = this.localChats();
+        if (!query) {
+            const conversations = chats.map(chat => ({
+                id: chat.id,
+                title: chat.title,
+                model: chat.modelParams?.model,
+                updated_at: new Date(chat.timestamp).getTime() / 1000
+            }));
+            return { conversations, next_cursor: null };
+        }
+        const results = [];
+        chats.forEach(chat => {
+            const match = chat.messages.find(msg => msg.content.toLowerCase().includes(query));
+            if (match) {
+                results.push({ conversation_id: chat.id, title: chat.title, snippet: match.content.substring(0, 200) });
+            }
+        });
+        return { results, next_offset: null };
+    }
+
+    historyParams() {
+        // Everything needed to continue the chat later, except the API key
+        const { apiKey, ...params } = this.modelParams;
+        return params;
+    }
+
+    async saveChatHistory() {
+        // Append-only: send just the messages the server has not seen yet
+        const pending = this.messagesData.slice(this.historySavedCount);
+        if (pending.length === 0 || !this.currentChatId) {
+            return;
+        }
+
+        const chatId = this.currentChatId;
+        const title = this.messagesData[0].content.substring(0, 50);
+        await this.historyReady;
+        if (!this.historyServer) {
+            this.saveLocalChat(title);
+            this.touchHistoryItem({ id: chatId, title, model: this.modelParams.model, updated_at: Date.now() / 1000 });
+            return;
+        }
+
+        this.historySavedCount += pending.length;
+        try {
+            const response = await this.historyFetch(`/api/history/${encodeURIComponent(chatId)}/messages`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    messages: pending.map(msg => ({ role: msg.sender === 'user' ? 'user' : 'assistant', content: msg.content })),
+                    title,
+                    provider: this.modelParams.provider,
+                    model: this.modelParams.model,
+                    params: this.historyParams()
+                })
+            });
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            this.touchHistoryItem({ id: chatId, title, model: this.modelParams.model, updated_at: Date.now() / 1000 });
+        } catch (error) {
+            console.warn('Failed to save chat history:', error);
+            if (this.currentChatId === chatId) {
+                this.historySavedCount -= pending.length;
+            }
+        }
+    }
+
+    async loadChatHistory() {
+        // Use the server-side history only where the backend serves /api/history (the Flask app)
+        try {
+            const response = await this.historyFetch('/api/history?limit=1');
+            this.historyServer = response.ok;
+        } catch (error) {
+            this.historyServer = false;
+        }
+        if (!this.historyServer) {
+            return;
+        }
+
+        // One-time move of the localStorage history to the server, oldest chat first;
+        // it stays in localStorage unless every chat was stored
+        const legacy = this.localChats();
+        if (legacy.length === 0) {
+            return;
+        }
+        try {
+            for (const chat of legacy.slice().reverse()) {
+                const response = await this.historyFetch(`/api/history/${encodeURIComponent(chat.id)}/messages`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        messages: chat.messages.map(msg => ({ role: msg.sender === 'user' ? 'user' : 'assistant', content: msg.content })),
+                        title: chat.messages[0]?.content.substring(0, 50),
+                        provider: chat.modelParams?.provider,
+                        model: chat.modelParams?.model
+                    })
+                });
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+            }
+            localStorage.removeItem('llm_chat_history');
+            this.resetHistoryList(this.historyQuery);
+        } catch (error) {
+            console.warn('Failed to migrate local chat history:', error);
+        }
+    }
+
+    // History pane methods
+    toggleHistoryPane() {
+        this.historyPane.classList.toggle('open');
+        if (this.historyPane.classList.contains('open')) {
+            this.historySearch.focus();
+        }
+    }
+
+    resetHistoryList(query = '') {
+        this.historyQuery = query;
+        this.historyCursor = null;
+        this.historyOffset = 0;
+        this.historyDone = false;
+        this.historyLoading = false;
+        this.historyRequest++;
+        this.historyItems.innerHTML = '';
+        this.historyStatus.textContent = '';
+        this.loadHistoryPage();
+    }
+
+    async loadHistoryPage() {
+        if (this.historyLoading || this.historyDone || !this.historyPane.classList.contains('open')) {
+            return;
+        }
+        this.historyLoading = true;
+        this.historyStatus.textContent = 'Loading...';
+        const request = this.historyRequest;
+
+        try {
+            await this.historyReady;
+            let page;
+            if (this.historyServer) {
+                const url = this.historyQuery
+                    ? `/api/history/search?q=${encodeURIComponent(this.historyQuery)}&offset=${this.historyOffset}`
+                    : `/api/history${this.historyCursor ? `?cursor=${encodeURIComponent(this.historyCursor)}` : ''}`;
+                const response = await this.historyFetch(url);
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                page = await response.json();
+            } else {
+                page = this.localHistoryPage();
+            }
+            if (request !== this.historyRequest) {
+                return;  // The search changed while this page was loading
+            }
+
+            const fragment = document.createDocumentFragment();
+            if (this.historyQuery) {
+                page.results.forEach(result => fragment.appendChild(this.createHistoryItem(result.conversation_id, result.title, result.snippet, true)));
+                this.historyOffset = page.next_offset;
+                this.historyDone = page.next_offset === null;
+            } else {
+                page.conversations.forEach(chat => fragment.appendChild(this.createHistoryItem(chat.id, chat.title, this.historyMeta(chat))));
+                this.historyCursor = page.next_cursor;
+                this.historyDone = page.next_cursor === null;
+            }
+            this.historyItems.appendChild(fragment);
+            this.historyStatus.textContent = this.historyDone && this.historyItems.childElementCount === 0
+                ? (this.historyQuery ? 'No matches' : 'No conversations yet') : '';
+        } catch (error) {
+            console.warn('Failed to load chat history:', error);
+            if (request === this.historyRequest) {
+                this.historyDone = true;
+                this.historyStatus.textContent = 'History unavailable';
+            }
+        } finally {
+            if (request === this.historyRequest) {
+                this.historyLoading = false;
+            }
+        }
+
+        // Keep filling until the list overflows, so the observer has something to scroll to
+        if (request === this.historyRequest && !this.historyDone && this.historyList.scrollHeight <= this.historyList.clientHeight) {
+            this.loadHistoryPage();
+        }
+    }
+
+    historyMeta(chat) {
+        const date = new Date(chat.updated_at * 1000).toLocaleDateString();
+        return chat.model ? `${chat.model} · ${date}` : date;
+    }
+
+    createHistoryItem(id, title, detail, isSnippet = false) {
+        const item = document.createElement('button');
+        item.className = 'history-item';
+        item.dataset.id = id;
+        if (id === this.currentChatId) {
+            item.classList.add('active');
+        }
+
+        const titleEl = document.createElement('div');
+        titleEl.className = 'history-item-title';
+        titleEl.textContent = title || 'Untitled chat';
+
+        const detailEl = document.createElement('div');
+        detailEl.className = 'history-item-detail';
+        if (isSnippet) {
+            // Snippets mark matches with <mark>; everything else stays escaped text
+            detailEl.textContent = detail;
+            detailEl.innerHTML = detailEl.innerHTML.replace(/&lt;(\/?)mark&gt;/g, '<$1mark>');
+        } else {
+            detailEl.textContent = detail;
+        }
+
+        item.appendChild(titleEl);
+        item.appendChild(detailEl);
+        item.addEventListener('click', () => this.openConversation(id));
+        return item;
+    }
+
+    touchHistoryItem(chat) {
+        // Move a just-saved chat to the top of the unfiltered list without refetching it
+        if (this.historyQuery) {
+            return;
+        }
+        this.removeHistoryItem(chat.id);
+        this.historyItems.prepend(this.createHistoryItem(chat.id, chat.title, this.historyMeta(chat)));
+        this.historyStatus.textContent = '';
+    }
+
+    removeHistoryItem(id) {
+        this.historyItems.querySelectorAll('.history-item').forEach(item => {
+            if (item.dataset.id === id) {
+                item.remove();
+            }
+        });
+    }
+
+    async openConversation(id) {
+        try {
+            let conversation, messages, next_before;
+            if (this.historyServer) {
+                const response = await this.historyFetch(`/api/history/${encodeURIComponent(id)}`);
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                ({ conversation, messages, next_before } = await response.json());
             } else {
-                history.unshift(chatData);
+                const chat = this.localChats().find(chat => chat.id === id);
+                if (!chat) {
+                    throw new Error('Chat not found');
+                }
+                conversation = { id: chat.id };
+                messages = chat.messages.map(msg => ({
+                    role: msg.sender === 'user' ? 'user' : 'assistant',
+                    content: msg.content,
+                    created_at: new Date(msg.timestamp).getTime() / 1000
+                }));
+                next_before = null;
             }
 
-            // Keep only last 50 chats
-            history = history.slice(0, 50);
-            localStorage.setItem('llm_chat_history', JSON.stringify(history));
+            this.currentChatId = conversation.id;
+            this.messagesData = [];
+            this.historySavedCount = 0;
+            this.messages.innerHTML = '';
+            this.welcomeScreen.style.display = 'none';
+            this.chatContainer.style.display = 'block';
+            this.prependStoredMessages(messages, next_before);
+            this.scrollToBottom();
+
+            this.historyItems.querySelectorAll('.history-item').forEach(item => {
+                item.classList.toggle('active', item.dataset.id === conversation.id);
+            });
+            if (window.innerWidth <= 1024) {
+                this.historyPane.classList.remove('open');
+            }
+        } catch (error) {
+            console.warn('Failed to open conversation:', error);
+            alert('Failed to load this conversation. Please try again.');
         }
     }
 
-    loadChatHistory() {
-        const history = JSON.parse(localStorage.getItem('llm_chat_history') || '[]');
-        this.chatHistory = history;
+    prependStoredMessages(messages, nextBefore) {
+        // Older pages are loaded on demand from a button above the oldest message
+        this.messages.querySelector('.load-earlier-btn')?.remove();
+        const stored = messages
+            .filter(msg => msg.role !== 'system')
+            .map(msg => ({ sender: msg.role, content: msg.content, timestamp: new Date(msg.created_at * 1000), id: msg.id }));
+
+        const fragment = document.createDocumentFragment();
+        if (nextBefore !== null) {
+            const button = document.createElement('button');
+            button.className = 'load-earlier-btn';
+            button.textContent = 'Load earlier messages';
+            button.addEventListener('click', () => this.loadEarlierMessages(nextBefore));
+            fragment.appendChild(button);
+        }
+        stored.forEach(msg => {
+            const messageContent = this.createMessageElement(msg.sender, msg.content);
+            fragment.appendChild(messageContent.parentElement);
+        });
+        this.messages.prepend(fragment);
+
+        this.messagesData = stored.concat(this.messagesData);
+        this.historySavedCount += stored.length;
+    }
+
+    async loadEarlierMessages(before) {
+        const chatId = this.currentChatId;
+        try {
+            const response = await this.historyFetch(`/api/history/${encodeURIComponent(chatId)}?before=${before}`);
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const { messages, next_before } = await response.json();
+            if (this.currentChatId === chatId) {
+                const previousHeight = this.chatContainer.scrollHeight;
+                this.prependStoredMessages(messages, next_before);
+                this.chatContainer.scrollTop += this.chatContainer.scrollHeight - previousHeight;
+            }
+        } catch (error) {
+            console.warn('Failed to load earlier messages:', error);
+        }
     }
 
     renderMessages() {
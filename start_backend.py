@@ -1,10 +1,29 @@
 #!/usr/bin/env python3
 """
 Startup script for the LLM Playground backend
+
+    python start_backend.py                # Flask development server (app.py)
+    python start_backend.py --production   # uvicorn, one worker process per CPU
+
+Production mode serves app:asgi_app from several preforked uvicorn workers
+sharing one listening socket. SIGHUP restarts the workers one at a time and
+SIGTERM/Ctrl+C stops them; either way a worker stops accepting connections and
+lets in-flight completions (streams included) finish for up to the graceful
+timeout before it exits. With more than one worker, conversations move into a
+shared SQLite file (SESSION_DB) and each worker enforces its share of the
+RATE_LIMIT_* limits. Settings can also come from the environment:
+
+    WEB_CONCURRENCY      worker processes (default: number of CPUs)
+    WSGI_THREADS         threads per worker for the Flask routes (default 32)
+    KEEPALIVE_TIMEOUT    seconds an idle keep-alive connection stays open (default 75)
+    GRACEFUL_TIMEOUT     seconds to drain in-flight requests on reload/shutdown (default 120)
+    MAX_REQUESTS         requests after which a worker is replaced (default 0, never)
 """
+import argparse
 import subprocess
 import sys
 import os
+import tempfile
 from pathlib import Path
 
 def check_requirements():
@@ -41,7 +60,65 @@ def check_env_file():
     print("✅ .env file found with API keys")
     return True
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Start the LLM Playground backend')
+    parser.add_argument('--production', action='store_true',
+                        help='serve app:asgi_app with multiple uvicorn worker processes')
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 5003)))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1)),
+                        help='worker processes (production)')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WSGI_THREADS', 32)),
+                        help='threads per worker for the Flask routes (production)')
+    parser.add_argument('--keep-alive', type=int, default=int(os.getenv('KEEPALIVE_TIMEOUT', 75)),
+                        help='idle keep-alive timeout in seconds (production)')
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.getenv('GRACEFUL_TIMEOUT', 120)),
+                        help='seconds to drain in-flight requests on reload/shutdown (production)')
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('MAX_REQUESTS', 0)),
+                        help='replace a worker after this many requests, 0 for never (production)')
+    parser.add_argument('--no-shared-cache', action='store_true',
+                        help='keep the response cache per worker instead of in a shared SQLite file')
+    return parser.parse_args()
+
+def run_production(args):
+    """Serve the ASGI app from preforked uvicorn workers"""
+    import uvicorn
+
+    # Workers inherit the environment; without a shared disk tier every worker
+    # would keep (and miss on) its own copy of the response cache
+    if args.workers > 1 and not args.no_shared_cache and not os.getenv('RESPONSE_CACHE_DB'):
+        os.environ['RESPONSE_CACHE_DB'] = os.path.join(tempfile.gettempdir(), 'llm_response_cache.db')
+    # The next turn of a conversation may reach any worker, and per-worker
+    # token buckets would otherwise let through the limit once per worker
+    if args.workers > 1:
+        os.environ.setdefault('SESSION_DB', os.path.join(tempfile.gettempdir(), 'llm_sessions.db'))
+        os.environ['RATE_LIMIT_WORKERS'] = str(args.workers)
+    os.environ['WSGI_THREADS'] = str(args.threads)
+
+    print(f"\n🌐 Starting production server on http://{args.host}:{args.port}")
+    print(f"⚙️  {args.workers} worker(s) x {args.threads} threads, keep-alive {args.keep_alive}s, "
+          f"graceful timeout {args.graceful_timeout}s")
+    if os.getenv('RESPONSE_CACHE_DB'):
+        print(f"🗄️  Shared response cache: {os.environ['RESPONSE_CACHE_DB']}")
+    if args.workers > 1:
+        print(f"💬 Shared sessions: {os.environ['SESSION_DB']}; rate limits split {args.workers} ways")
+    print(f"🔄 Reload workers without downtime: kill -HUP {os.getpid()}")
+    print("🛑 Press Ctrl+C to stop the server")
+    print("=" * 50)
+
+    uvicorn.run(
+        'app:asgi_app',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_max_requests=args.max_requests or None
+    )
+
 def main():
+    args = parse_args()
+
     print("🚀 Starting LLM Playground Backend...")
     print("=" * 50)
     
@@ -56,7 +133,12 @@ def main():
         print("   - Google AI: https://aistudio.google.com/app/apikey")
         sys.exit(1)
     
-    print("\n🌐 Starting Flask server on http://localhost:5000")
+    if args.production:
+        run_production(args)
+        return
+
+    os.environ['PORT'] = str(args.port)
+    print(f"\n🌐 Starting Flask server on http://localhost:{args.port}")
     print("📱 Frontend will be available on http://localhost:8080")
     print("🛑 Press Ctrl+C to stop the server")
     print("=" * 50)
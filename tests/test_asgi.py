@@ -0,0 +1,95 @@
+import asyncio
+import json
+import logging
+
+import httpx
+from flask import Flask
+
+from backend.asgi import AsyncChatApp
+from backend.profiling import Profiler
+from backend.responses import ResponseEncoder
+from backend.tracing import Tracer
+
+
+class FakeGateway:
+    """Answers every completion with a long fixed text"""
+
+    text = 'lorem ipsum ' * 200
+
+    async def chat(self, provider, model, messages, temperature, max_tokens, top_p, seed, prefix=None):
+        await asyncio.sleep(0)
+        return {'text': self.text, 'finish_reason': 'stop', 'usage': {'prompt_tokens': 3, 'completion_tokens': 400}}
+
+    async def stream(self, provider, model, messages, temperature, max_tokens, top_p, seed, prefix=None):
+        yield {'type': 'delta', 'text': 'Hi'}
+        yield {'type': 'done', 'finish_reason': 'stop', 'usage': {}}
+
+    def available_providers(self):
+        return ['openai']
+
+    async def aclose(self):
+        pass
+
+
+def post(app, path, payload, headers=None):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.post(path, json=payload, headers=headers or {})
+    return asyncio.run(run())
+
+
+def chat_app(**kwargs):
+    return AsyncChatApp(Flask(__name__), gateway=FakeGateway(), tracer=Tracer(log=True), **kwargs)
+
+
+def test_trace_headers_and_log_line(caplog):
+    with caplog.at_level(logging.INFO, logger='llm.trace'):
+        response = post(chat_app(), '/api/chat', {'message': 'hello', 'model': 'gpt-4o'}, {'X-Request-ID': 'abc-123'})
+    assert response.status_code == 200
+    assert response.headers['X-Request-ID'] == 'abc-123'
+    assert 'parse;dur=' in response.headers['Server-Timing'] and 'provider;dur=' in response.headers['Server-Timing']
+    assert 'X-Request-ID' in response.headers['Access-Control-Expose-Headers']
+
+    logged = [json.loads(record.getMessage()) for record in caplog.records if record.name == 'llm.trace']
+    assert logged[-1]['request_id'] == 'abc-123'
+    assert (logged[-1]['status'], logged[-1]['provider'], logged[-1]['model']) == (200, 'openai', 'gpt-4o')
+
+
+def test_requested_profile_is_sampled(tmp_path):
+    profiler = Profiler(str(tmp_path), token='secret', mode='cprofile', interval=0.001)
+    response = post(chat_app(profiler=profiler), '/api/chat', {'message': 'hello'}, {'X-Profile': 'secret'})
+    profile_id = response.headers['X-Profile-ID']
+    assert profiler.path(profile_id).endswith('.collapsed')
+    assert profiler.list()[0]['mode'] == 'sample'
+
+    unprofiled = post(chat_app(profiler=profiler), '/api/chat', {'message': 'hello'}, {'X-Profile': 'wrong'})
+    assert 'X-Profile-ID' not in unprofiled.headers
+
+
+def test_json_is_compressed_for_clients_that_accept_it():
+    app = chat_app(encoder=ResponseEncoder(min_size=100))
+    response = post(app, '/api/chat', {'message': 'hello'}, {'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.json()['response'] == FakeGateway.text  # httpx decodes the body
+    assert int(response.headers['Content-Length']) < len(FakeGateway.text)
+
+    plain = post(app, '/api/chat', {'message': 'hello'}, {'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in plain.headers
+    assert json.loads(plain.content)['response'] == FakeGateway.text
+
+
+def test_stream_records_ttft(caplog):
+    with caplog.at_level(logging.INFO, logger='llm.trace'):
+        response = post(chat_app(), '/api/chat/stream', {'message': 'hello'})
+    assert response.status_code == 200
+    assert response.headers['X-Request-ID']
+    assert 'event: done' in response.text
+    spans = [json.loads(record.getMessage()) for record in caplog.records if record.name == 'llm.trace'][-1]['spans']
+    assert 'ttft' in spans and 'stream' in spans
+
+
+def test_errors_carry_the_request_id():
+    response = post(chat_app(), '/api/chat', {'message': ''}, {'X-Request-ID': 'bad-1'})
+    assert response.status_code == 400
+    assert response.headers['X-Request-ID'] == 'bad-1'
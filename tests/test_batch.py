@@ -0,0 +1,29 @@
+import pytest
+
+from backend.batch import normalize_item, parse_jsonl, run_batch
+
+PROVIDERS = ('openai', 'google')
+
+
+@pytest.mark.parametrize('item', [
+    {'message': 'hi', 'temperature': None},
+    {'message': 'hi', 'max_tokens': 'abc'},
+    {'message': 'hi', 'top_p': [1]},
+    {'message': 'hi', 'provider': ['openai']},
+    {'message': ''}
+])
+def test_invalid_items_raise_value_error(item):
+    with pytest.raises(ValueError):
+        normalize_item(item, PROVIDERS)
+
+
+def test_bad_line_fails_only_its_item():
+    text = '{"id": "a", "message": "hi"}\n{"id": "b", "message": "hi", "temperature": null}\nnot json\n{"id": "c", "message": "yo"}'
+    complete = lambda params: (params['message'].upper(), {'completion_tokens': 1}, None, None)
+    results = list(run_batch(parse_jsonl(text), complete, {'openai': 2, 'google': 1}))
+    summary = results.pop()['summary']
+    by_index = {result['index']: result for result in results}
+    assert (by_index[0]['response'], by_index[3]['response']) == ('HI', 'YO')
+    assert 'Invalid sampling parameter' in by_index[1]['error']
+    assert by_index[2]['error'].startswith('Invalid JSON')
+    assert (summary['items'], summary['succeeded'], summary['failed']) == (4, 2, 2)
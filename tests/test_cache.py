@@ -0,0 +1,86 @@
+from backend.cache import (ResponseCache, cache_bypassed, cache_key, cacheable_request, cacheable_result)
+
+ANSWER = {'response': 'Paris', 'finish_reason': 'stop', 'usage': {'completion_tokens': 1}}
+
+
+def key(**overrides):
+    params = dict(provider='openai', model='gpt-4o', system_prompt='', message='Capital of France?',
+                  temperature=0, top_p=1.0, max_tokens=100, seed=None)
+    params.update(overrides)
+    return cache_key(**params)
+
+
+def test_cache_key_normalises_whitespace_and_case_of_provider():
+    assert key() == key(provider=' OpenAI ', message='Capital of France?  ', temperature='0.0')
+
+
+def test_cache_key_separates_every_parameter():
+    variants = [key(model='gpt-4o-mini'), key(system_prompt='Be brief'), key(message='Capital of Spain?'),
+                key(temperature=0.5), key(top_p=0.9), key(max_tokens=200), key(seed=1),
+                key(history=[{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'hello'}])]
+    assert len({key(), *variants}) == len(variants) + 1
+
+
+def test_only_deterministic_requests_are_cacheable_unless_opted_in():
+    assert cacheable_request(0, None)
+    assert cacheable_request(0.7, 42)
+    assert not cacheable_request(0.7, None)
+    assert not cacheable_request(0.7, '')
+    assert cacheable_request(0.7, None, sampled=True)
+
+
+def test_incomplete_blocked_and_placeholder_results_are_not_cacheable():
+    assert cacheable_result(ANSWER)
+    assert cacheable_result(dict(ANSWER, finish_reason='MAX_TOKENS'))
+    for finish_reason in (None, '', 'SAFETY', 'RECITATION', 'content_filter', 'cancelled'):
+        assert not cacheable_result(dict(ANSWER, finish_reason=finish_reason)), finish_reason
+    for text in ('', '  ', "Sorry, I couldn't generate a response. Please try again.",
+                 "I'm sorry, but I can't provide a response to that request due to safety guidelines."):
+        assert not cacheable_result(dict(ANSWER, response=text)), text
+
+
+def test_bypass_by_body_or_header():
+    assert cache_bypassed({'cache': False}, {})
+    assert cache_bypassed({}, {'Cache-Control': 'No-Cache'})
+    assert not cache_bypassed({'cache': True}, {})
+
+
+def test_set_skips_uncacheable_results():
+    cache = ResponseCache()
+    cache.set('k', dict(ANSWER, finish_reason='SAFETY'))
+    assert cache.get('k') is None
+    assert cache.stats()['uncacheable'] == 1
+
+
+def test_lru_eviction_and_ttl():
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', ANSWER)
+    cache.set('b', ANSWER)
+    cache.get('a')
+    cache.set('c', ANSWER)
+    assert cache.get('b') is None and cache.get('a') == ANSWER
+    assert cache.stats()['evictions'] == 1
+
+    expired = ResponseCache(ttl=-1)
+    expired.set('a', ANSWER)
+    assert expired.get('a') is None
+
+
+def test_disk_tier_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    ResponseCache(db_path=path).set('a', ANSWER)
+    other = ResponseCache(db_path=path)
+    assert other.get('a') == ANSWER
+    assert other.stats()['disk_hits'] == 1
+
+
+def test_record_stream_stores_only_complete_answers():
+    cache = ResponseCache()
+    events = [{'type': 'delta', 'text': 'Par'}, {'type': 'delta', 'text': 'is'},
+              {'type': 'done', 'finish_reason': 'stop', 'usage': {}}]
+    assert list(cache.record_stream('ok', iter(events))) == events
+    assert cache.get('ok')['response'] == 'Paris'
+
+    broken = events[:2] + [{'type': 'done', 'finish_reason': None, 'usage': {}}]
+    list(cache.record_stream('broken', iter(broken)))
+    assert cache.get('broken') is None
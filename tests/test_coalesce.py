@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from backend.coalesce import SingleFlight
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_followers_share_the_leader_stream():
+    flight = SingleFlight()
+    upstream_calls = []
+
+    def factory():
+        upstream_calls.append(1)
+        wait_for(lambda: flight.stats()['streams_coalesced'])
+        return iter([{'type': 'delta', 'text': 'Hi'}, {'type': 'done'}])
+
+    results = []
+
+    def follow():
+        wait_for(lambda: flight.stats()['stream_leaders'])
+        results.append(list(flight.stream('k', factory)))
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    assert [event['type'] for event in flight.stream('k', factory)] == ['delta', 'done']
+    follower.join(5)
+    assert [event['type'] for event in results[0]] == ['delta', 'done']
+    assert len(upstream_calls) == 1
+
+
+def test_failing_factory_fails_waiting_followers():
+    flight = SingleFlight()
+    subscribed = threading.Event()
+    outcome = {}
+
+    def factory():
+        # Fail only once the follower is waiting on this stream
+        wait_for(lambda: flight.stats()['streams_coalesced'])
+        subscribed.wait(5)
+        raise RuntimeError('rate limited')
+
+    def follow():
+        wait_for(lambda: flight.stats()['stream_leaders'])
+        events = flight.stream('k', factory)
+        subscribed.set()
+        try:
+            outcome['events'] = list(events)
+        except RuntimeError as e:
+            outcome['error'] = e
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    with pytest.raises(RuntimeError, match='rate limited'):
+        flight.stream('k', factory)
+    follower.join(5)
+    assert 'events' not in outcome
+    assert str(outcome['error']) == 'rate limited'
+    assert flight.stats()['streams_in_flight'] == 0
@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+from backend.history import HistoryStore, decode_cursor, encode_cursor, fts_query
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / 'history.db'))
+
+
+def save(store, owner, conversation_id, *contents, title=None):
+    messages = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': text} for i, text in enumerate(contents)]
+    assert store.append(owner, conversation_id, messages, title=title)
+    store.flush()
+
+
+def test_fts_query_quotes_terms_and_prefixes_the_last():
+    assert fts_query('hello wor') == '"hello" "wor"*'
+    assert fts_query('say "hi" OR') == '"say" """hi""" "OR"*'
+    assert fts_query('   ') is None
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(1700000000.25, 'chat:1')) == (1700000000.25, 'chat:1')
+    with pytest.raises(ValueError):
+        decode_cursor('garbage')
+
+
+def test_listing_pages_newest_first(store):
+    for i in range(5):
+        save(store, 'alice', f'c{i}', f'message {i}')
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.list_conversations('alice', limit=2, cursor=cursor)
+        seen += [conversation['id'] for conversation in page]
+        if cursor is None:
+            break
+    assert seen == ['c4', 'c3', 'c2', 'c1', 'c0']
+
+
+def test_conversation_messages_page_backwards(store):
+    save(store, 'alice', 'c1', *[f'message {i}' for i in range(5)], title='first')
+    conversation, messages, before = store.get_conversation('alice', 'c1', limit=3)
+    assert conversation['title'] == 'first' and conversation['message_count'] == 5
+    assert [m['content'] for m in messages] == ['message 2', 'message 3', 'message 4']
+    _, older, before = store.get_conversation('alice', 'c1', limit=3, before=before)
+    assert [m['content'] for m in older] == ['message 0', 'message 1'] and before is None
+
+
+def test_search_matches_prefixes_and_ignores_accents(store):
+    if not store.fts:
+        pytest.skip('SQLite without FTS5')
+    save(store, 'alice', 'c1', 'Un café à Paris', 'Bonjour')
+    save(store, 'alice', 'c2', 'Something else entirely')
+    results, next_offset = store.search('alice', 'cafe par')
+    assert [r['conversation_id'] for r in results] == ['c1'] and next_offset is None
+    assert '<mark>' in results[0]['snippet']
+
+
+def test_clients_only_see_their_own_history(store):
+    save(store, 'alice', 'c1', 'alice secret')
+    save(store, 'mallory', 'c1', 'injected')
+    store.delete('mallory', 'c1')
+    store.flush()
+
+    assert store.list_conversations('mallory') == ([], None)
+    assert store.get_conversation('mallory', 'c1') is None
+    assert store.search('mallory', 'secret') == ([], None)
+    _, messages, _ = store.get_conversation('alice', 'c1')
+    assert [m['content'] for m in messages] == ['alice secret']
+    assert store.stats()['rejected'] == 1
+
+
+def test_delete_removes_messages(store):
+    save(store, 'alice', 'c1', 'hello there')
+    store.delete('alice', 'c1')
+    store.flush()
+    assert store.get_conversation('alice', 'c1') is None
+    assert store.search('alice', 'hello') == ([], None)
+
+
+def test_delete_reports_a_full_queue(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.db'), queue_size=1)
+    store._start_writer = lambda: None  # keep the writer from draining the queue
+    assert store.delete('alice', 'c1')
+    assert not store.delete('alice', 'c2')
+    assert store.stats()['dropped'] == 1
+
+
+def test_databases_from_before_scoping_gain_an_owner_column(tmp_path):
+    path = str(tmp_path / 'old.db')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE conversations (id TEXT PRIMARY KEY, title TEXT, provider TEXT, model TEXT, params TEXT,'
+               ' created_at REAL NOT NULL, updated_at REAL NOT NULL, message_count INTEGER NOT NULL DEFAULT 0)')
+    db.execute("INSERT INTO conversations VALUES ('old', 'legacy', NULL, NULL, NULL, 1, 1, 0)")
+    db.commit()
+    db.close()
+
+    store = HistoryStore(path)
+    save(store, 'alice', 'c1', 'new chat')
+    assert [c['id'] for c in store.list_conversations('alice')[0]] == ['c1']
@@ -0,0 +1,123 @@
+import threading
+
+import pytest
+
+from backend.jobs import JobManager, JobNotRunningHere, JobsBusy
+
+
+def manager(tmp_path, run, **kwargs):
+    return JobManager(str(tmp_path / 'jobs.db'), run, **kwargs)
+
+
+def finished(jobs, job_id):
+    job = jobs.get(job_id)
+    while job['state'] not in ('succeeded', 'failed', 'cancelled'):
+        job = jobs.wait(job_id, job['updated_at'], 5)
+    return job
+
+
+PARAMS = {'provider': 'openai', 'model': 'gpt-4o-mini', 'message': 'hi'}
+
+
+def test_job_succeeds_with_result(tmp_path):
+    def run(params, progress, token):
+        parts = ['Hello', ' world']
+        progress(parts)
+        return {'response': ''.join(parts), 'finish_reason': 'stop'}
+
+    jobs = manager(tmp_path, run)
+    job = finished(jobs, jobs.submit(PARAMS))
+    assert job['state'] == 'succeeded'
+    assert job['text'] == 'Hello world'
+    assert job['result']['finish_reason'] == 'stop'
+    assert job['expires_at'] > job['finished_at']
+    assert jobs.stats()['succeeded'] == 1
+
+
+def test_failed_job_keeps_partial_text(tmp_path):
+    def run(params, progress, token):
+        progress(['partial'])
+        raise ValueError('provider went away')
+
+    jobs = manager(tmp_path, run, progress_interval=0)
+    job = finished(jobs, jobs.submit(PARAMS))
+    assert (job['state'], job['text'], job['error']) == ('failed', 'partial', 'provider went away')
+
+
+def test_progress_is_throttled(tmp_path):
+    def run(params, progress, token):
+        parts = []
+        for _ in range(1000):
+            parts.append('x')
+            progress(parts)
+        return {'response': ''.join(parts)}
+
+    jobs = manager(tmp_path, run, progress_interval=60)
+    writes = []
+    write = jobs._write
+    jobs._write = lambda sql, args: writes.append(sql) or write(sql, args)
+    job = finished(jobs, jobs.submit(PARAMS))
+    assert job['text'] == 'x' * 1000
+    assert sum(sql.startswith('UPDATE jobs SET text') for sql in writes) == 1
+
+
+def test_cancel_running_job(tmp_path):
+    started = threading.Event()
+
+    def run(params, progress, token):
+        started.set()
+        token.future.result(timeout=5)
+        token.check()
+
+    jobs = manager(tmp_path, run)
+    job_id = jobs.submit(PARAMS)
+    assert started.wait(5)
+    jobs.cancel(job_id)
+    job = finished(jobs, job_id)
+    assert job['state'] == 'cancelled'
+    assert jobs.stats()['cancelled'] == 1
+
+
+def test_cancel_in_another_worker_is_an_error(tmp_path):
+    release = threading.Event()
+
+    def run(params, progress, token):
+        release.wait(5)
+        return {'response': ''}
+
+    owner = manager(tmp_path, run)
+    other = manager(tmp_path, run)
+    job_id = owner.submit(PARAMS)
+    assert other.get(job_id)['state'] in ('queued', 'running')
+    with pytest.raises(JobNotRunningHere, match='not running on this worker'):
+        other.cancel(job_id)
+    release.set()
+    assert finished(owner, job_id)['state'] == 'succeeded'
+
+
+def test_submissions_beyond_max_pending_are_rejected(tmp_path):
+    release = threading.Event()
+    jobs = manager(tmp_path, lambda params, progress, token: release.wait(5) and {'response': ''}, max_pending=1)
+    jobs.submit(PARAMS)
+    with pytest.raises(JobsBusy):
+        jobs.submit(PARAMS)
+    release.set()
+    assert jobs.stats()['rejected'] == 1
+
+
+def test_cancel_while_queued(tmp_path):
+    release = threading.Event()
+
+    def run(params, progress, token):
+        release.wait(5)
+        return {'response': ''}
+
+    jobs = manager(tmp_path, run, workers=1)
+    first = jobs.submit(PARAMS)
+    queued = jobs.submit(PARAMS)
+    jobs.cancel(queued)
+    release.set()
+    assert finished(jobs, first)['state'] == 'succeeded'
+    job = finished(jobs, queued)
+    assert job['state'] == 'cancelled'
+    assert job['started_at'] is None
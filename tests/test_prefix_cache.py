@@ -0,0 +1,121 @@
+import time
+
+import pytest
+
+from backend.prefix_cache import CachedContentMissing, GeminiCachedContents, PrefixCache, RETRY_AFTER
+from backend.providers import build_messages, google_api_base
+from benchmarks.mock_provider import MockConfig, start_mock_provider
+
+SYSTEM_PROMPT = 'You are a careful assistant. ' * 200
+
+
+@pytest.fixture(scope='module')
+def mock():
+    config = MockConfig(latency_ms=0, jitter_ms=0, chunks=2)
+    server = start_mock_provider(config)
+    yield config, f'http://127.0.0.1:{server.server_port}/v1beta'
+    server.shutdown()
+
+
+@pytest.fixture
+def gemini(mock):
+    config, base_url = mock
+    config.cached_contents.clear()
+    return GeminiCachedContents('mock', base_url=base_url)
+
+
+def generate(prefix, message='Hello'):
+    return prefix.generate('gemini-2.5-flash', build_messages(message, SYSTEM_PROMPT), 0, 100, 1, None)
+
+
+def test_registers_after_min_uses_and_serves_from_cache(mock, gemini):
+    config, _ = mock
+    cache = PrefixCache(gemini, min_tokens=100, gemini_min_tokens=100, min_uses=2, serverless=True)
+    assert cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT) is None
+    prefix = cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT)
+    assert prefix is not None and prefix.name in config.cached_contents
+
+    result = generate(prefix)
+    assert result['usage']['cached_tokens'] == config.cached_contents[prefix.name]['tokens']
+    prefix.record(result['usage'])
+    stats = cache.stats()
+    assert (stats['registered'], stats['cached_calls'], stats['active']) == (1, 1, 1)
+
+
+def test_missing_cache_is_invalidated_and_registered_again(mock, gemini):
+    config, _ = mock
+    cache = PrefixCache(gemini, min_tokens=100, gemini_min_tokens=100, min_uses=1, serverless=True)
+    prefix = cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT)
+    first = prefix.name
+
+    config.cached_contents.clear()  # Expired or deleted on Gemini's side
+    with pytest.raises(CachedContentMissing):
+        generate(prefix)
+    assert prefix.name is None
+    assert cache.stats()['invalidated'] == 1
+
+    again = cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT)
+    assert again is prefix and prefix.name not in (None, first)
+    assert generate(prefix)['usage']['cached_tokens'] > 0
+
+
+def test_evicted_caches_are_deleted(mock, gemini):
+    config, _ = mock
+    cache = PrefixCache(gemini, min_tokens=100, gemini_min_tokens=100, min_uses=1, max_entries=1, serverless=True)
+    name = cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT).name
+    cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT + 'Answer in French.')
+    assert name not in config.cached_contents
+    assert cache.stats()['evicted'] == 1
+
+
+def test_background_registration(mock, gemini):
+    cache = PrefixCache(gemini, min_tokens=100, gemini_min_tokens=100, min_uses=1)
+    assert cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT) is None
+    deadline = time.monotonic() + 5
+    while not cache.stats()['active'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT).name
+    cache.close()
+    assert not mock[0].cached_contents
+
+
+def test_openai_and_short_prompts_register_nothing(gemini):
+    cache = PrefixCache(gemini, min_tokens=100, gemini_min_tokens=100, serverless=True)
+    prefix = cache.lookup('openai', 'gpt-4o', SYSTEM_PROMPT)
+    assert prefix is not None and prefix.name is None and len(prefix.key) == 32
+    assert cache.lookup('google', 'gemini-2.5-flash', 'Be brief.') is None
+    assert cache.lookup('local', 'llama', SYSTEM_PROMPT) is None
+    assert cache.stats()['registered'] == 0
+
+
+def test_gemini_needs_a_longer_prompt_than_openai(gemini):
+    cache = PrefixCache(gemini, min_tokens=100, gemini_min_tokens=5000, min_uses=1, serverless=True)
+    assert cache.lookup('openai', 'gpt-4o', SYSTEM_PROMPT) is not None
+    assert cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT) is None
+    stats = cache.stats()
+    assert (stats['keyed'], stats['short'], stats['registered']) == (1, 1, 0)
+
+
+def test_prompt_gemini_refuses_is_not_offered_again(mock, gemini):
+    config, _ = mock
+    config.cache_min_tokens = 100000
+    try:
+        cache = PrefixCache(gemini, min_tokens=100, gemini_min_tokens=100, min_uses=1, serverless=True)
+        assert cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT) is None
+        prefix = next(iter(cache._entries.values()))
+        prefix.retry_at -= RETRY_AFTER * 10
+        assert cache.lookup('google', 'gemini-2.5-flash', SYSTEM_PROMPT) is None
+        stats = cache.stats()
+        assert (stats['registration_rejected'], stats['registration_errors'], stats['registered']) == (1, 0, 0)
+        assert not config.cached_contents
+    finally:
+        config.cache_min_tokens = 0
+
+
+def test_rest_base_follows_sdk_endpoint(monkeypatch):
+    monkeypatch.delenv('GOOGLE_API_ENDPOINT', raising=False)
+    assert google_api_base() == 'https://generativelanguage.googleapis.com/v1beta'
+    monkeypatch.setenv('GOOGLE_API_ENDPOINT', 'europe-generativelanguage.googleapis.com')
+    assert google_api_base() == 'https://europe-generativelanguage.googleapis.com/v1beta'
+    monkeypatch.setenv('GOOGLE_API_ENDPOINT', 'http://127.0.0.1:8100/')
+    assert GeminiCachedContents('key').base_url == 'http://127.0.0.1:8100/v1beta'
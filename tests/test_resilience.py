@@ -0,0 +1,188 @@
+import asyncio
+import time
+
+import pytest
+
+from backend.local_provider import LocalProviderError
+from backend.resilience import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ProviderTimeout, ProviderUnavailable,
+                                Resilience, is_provider_failure)
+from backend.scheduler import RateLimitExceeded
+from backend.tokenizers import ContextLengthExceeded
+
+
+def wrapped(error):
+    """Re-raise error the way the provider functions do, with a friendlier message"""
+    try:
+        try:
+            raise error
+        except Exception as e:
+            raise Exception(f'OpenAI API error: {e}')
+    except Exception as e:
+        return e
+
+
+def test_breaker_opens_on_error_rate_and_closes_after_probe():
+    breaker = CircuitBreaker('openai', min_calls=4, error_rate=0.5, cooldown=0.05)
+    for ok in (True, False, True):
+        breaker.record(ok, 10)
+    assert breaker.state == CLOSED
+    breaker.record(False, 10)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # one probe at a time
+    breaker.record(True, 10)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['window_calls'] == 0
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker('google', min_calls=1, cooldown=0.05)
+    breaker.record(False, 10)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False, 10)
+    assert breaker.state == OPEN
+    assert breaker.stats()['opened'] == 2
+
+
+def test_slow_calls_open_breaker():
+    breaker = CircuitBreaker('openai', min_calls=2, slow_call_ms=100, slow_rate=0.5)
+    breaker.record(True, 150)
+    breaker.record(True, 150)
+    assert breaker.state == OPEN
+
+
+@pytest.mark.parametrize('error, counted', [
+    (ProviderTimeout('slow'), True),
+    (TimeoutError(), True),
+    (RateLimitExceeded('429', 1), True),
+    (LocalProviderError('bad gateway', 502), True),
+    (LocalProviderError('overloaded', 503), True),
+    (wrapped(LocalProviderError('down', 500)), True),
+    (wrapped(ConnectionResetError()), True),
+    (LocalProviderError('bad request', 400), False),
+    (LocalProviderError('unauthorized', 401), False),
+    (wrapped(LocalProviderError('no such model', 404)), False),
+    (ContextLengthExceeded('prompt too long', 9000, 8192), False),
+    (ValueError('Unsupported provider'), False),
+])
+def test_only_provider_faults_count(error, counted):
+    assert is_provider_failure(error) is counted
+
+
+def test_client_errors_do_not_open_breaker():
+    resilience = Resilience(timeout=1, breaker_settings={'min_calls': 2})
+
+    def attempt(provider, model):
+        raise LocalProviderError('bad request', 400)
+
+    for _ in range(5):
+        with pytest.raises(LocalProviderError):
+            resilience.call('local', 'llama', attempt)
+    assert resilience.breaker('local').state == CLOSED
+    assert resilience.stats_counters['client_errors'] == 5
+
+    def failing(provider, model):
+        raise LocalProviderError('unavailable', 503)
+
+    for _ in range(2):
+        with pytest.raises(LocalProviderError):
+            resilience.call('local', 'llama', failing)
+    with pytest.raises(ProviderUnavailable):
+        resilience.call('local', 'llama', attempt)
+
+
+def test_admission_wait_is_outside_the_timeout():
+    resilience = Resilience(timeout=0.1)
+    admitted = []
+
+    def admit(provider, model):
+        time.sleep(0.2)
+        admitted.append((provider, model))
+
+    result, provider, model = resilience.call('openai', 'gpt-4o', lambda p, m: 'ok', admit=admit)
+    assert (result, provider, model) == ('ok', 'openai', 'gpt-4o')
+    assert admitted == [('openai', 'gpt-4o')]
+    assert resilience.stats_counters['timeouts'] == 0
+
+
+def test_zero_timeout_means_no_limit():
+    resilience = Resilience(timeout=0)
+
+    def attempt(provider, model):
+        time.sleep(0.05)
+        return 'ok'
+
+    async def attempt_async(provider, model):
+        await asyncio.sleep(0.05)
+        return 'ok'
+
+    assert resilience.call('openai', 'gpt-4o', attempt)[0] == 'ok'
+    assert asyncio.run(resilience.call_async('openai', 'gpt-4o', attempt_async))[0] == 'ok'
+    assert resilience.stats_counters['timeouts'] == 0
+
+
+def test_rejected_admission_releases_probe():
+    resilience = Resilience(timeout=1, breaker_settings={'min_calls': 1, 'cooldown': 0})
+    resilience.record('openai', 'gpt-4o', False, 10)
+
+    def admit(provider, model):
+        raise RateLimitExceeded('queue full', 1)
+
+    with pytest.raises(RateLimitExceeded):
+        resilience.call('openai', 'gpt-4o', lambda p, m: 'ok', admit=admit)
+    assert resilience.breaker('openai').state == HALF_OPEN
+    assert resilience.call('openai', 'gpt-4o', lambda p, m: 'ok')[0] == 'ok'
+    assert resilience.breaker('openai').state == CLOSED
+
+
+def test_stalled_stream_times_out():
+    resilience = Resilience(timeout=1, stream_idle_timeout=0.1, breaker_settings={'min_calls': 1})
+
+    def opener(provider, model):
+        yield {'type': 'token', 'content': 'Hel'}
+        time.sleep(1)
+        yield {'type': 'token', 'content': 'lo'}
+
+    events = resilience.open_stream('openai', 'gpt-4o', opener)
+    assert next(events)['content'] == 'Hel'
+    with pytest.raises(ProviderTimeout):
+        next(events)
+    assert resilience.stats_counters['stream_timeouts'] == 1
+    assert resilience.breaker('openai').state == OPEN
+
+
+def test_stream_without_first_event_times_out():
+    resilience = Resilience(timeout=0.1, stream_idle_timeout=5)
+
+    def opener(provider, model):
+        time.sleep(1)
+        yield {'type': 'done'}
+
+    with pytest.raises(ProviderTimeout):
+        list(resilience.open_stream('openai', 'gpt-4o', opener))
+
+
+def test_async_stalled_stream_times_out():
+    resilience = Resilience(timeout=1, stream_idle_timeout=0.1)
+
+    async def events():
+        yield {'type': 'token', 'content': 'Hel'}
+        await asyncio.sleep(1)
+        yield {'type': 'done'}
+
+    async def opener(provider, model):
+        return events()
+
+    async def consume():
+        received = []
+        with pytest.raises(ProviderTimeout):
+            async for event in await resilience.open_stream_async('openai', 'gpt-4o', opener):
+                received.append(event)
+        return received
+
+    assert [event['type'] for event in asyncio.run(consume())] == ['token']
@@ -0,0 +1,45 @@
+import pytest
+
+from backend.scheduler import ProviderScheduler, RateLimitExceeded, TokenBucket, create_scheduler
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(60)
+    assert bucket.wait_time(60, bucket.updated) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(1, bucket.updated) == pytest.approx(1.0)
+    assert bucket.wait_time(1, bucket.updated + 1) == 0
+
+
+def test_oversized_request_waits_for_a_full_bucket():
+    bucket = TokenBucket(60)
+    bucket.consume(30)
+    assert bucket.wait_time(1000, bucket.updated) == pytest.approx(30.0)
+
+
+def test_limits_are_divided_between_workers(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_OPENAI_RPM', '600')
+    monkeypatch.setenv('RATE_LIMIT_OPENAI_TPM', '90000')
+    monkeypatch.setenv('RATE_LIMIT_MODELS', '{"openai:gpt-4o": {"rpm": 300}}')
+    monkeypatch.setenv('RATE_LIMIT_WORKERS', '3')
+    buckets = create_scheduler()._buckets
+    assert buckets[('openai', 'rpm')].capacity == 200
+    assert buckets[('openai', 'tpm')].capacity == 30000
+    assert buckets[('openai:gpt-4o', 'rpm')].capacity == 100
+    assert ('google', 'rpm') not in buckets
+
+
+def test_request_that_would_wait_too_long_is_rejected_with_retry_after():
+    scheduler = ProviderScheduler({'openai': {'rpm': 1}}, max_wait=1)
+    assert scheduler.acquire('openai', 'gpt-4o', 10) < 1
+    with pytest.raises(RateLimitExceeded) as e:
+        scheduler.acquire('openai', 'gpt-4o', 10)
+    assert e.value.retry_after >= 1
+    assert scheduler.stats()['timed_out'] == 1
+
+
+def test_full_queue_is_rejected():
+    scheduler = ProviderScheduler({'openai': {'rpm': 1}}, max_queue=0)
+    with pytest.raises(RateLimitExceeded, match='queue is full'):
+        scheduler.acquire('openai', 'gpt-4o', 10)
+    assert scheduler.stats()['rejected'] == 1
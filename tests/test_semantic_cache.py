@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from backend.semantic_cache import (DEFAULT_THRESHOLD, HashedNgramEmbedder, SemanticCache, exact_terms,  # noqa: E402
+                                    semantic_scope)
+from benchmarks.semantic_calibration import NEAR_MISSES, PARAPHRASES, calibrate  # noqa: E402
+
+SCOPE = semantic_scope('openai', 'gpt-4o', '', 0.7, 1.0, 1000, None)
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache(HashedNgramEmbedder(), max_entries=100, ttl=60)
+
+
+def served(cache, stored, asked, scope=SCOPE):
+    cache.set(scope, stored, {'response': stored, 'finish_reason': 'stop'})
+    return cache.get(scope, asked)
+
+
+def test_exact_terms_keep_numbers_negations_quotes_and_languages():
+    assert exact_terms('Translate "good morning" to French') == ('"good morning"', 'french')
+    assert exact_terms("Can't dogs eat 3.5 grapes?") == ("can't", '3.5')
+    assert exact_terms('Is it not safe?') == ('not',)
+    assert exact_terms('Port this to C++ or C#') == ('c++', 'c#')
+    assert exact_terms('How do I reset my password') == ()
+
+
+@pytest.mark.parametrize('stored, asked', [
+    ('Translate "good morning" to French', 'Translate "good morning" to Spanish'),
+    ('Is it safe to eat raw eggs?', 'Is it not safe to eat raw eggs?'),
+    ('What is the largest planet in the solar system?', 'What is the smallest planet in the solar system?'),
+    ('Convert 100 Fahrenheit to Celsius', 'Convert 100 Celsius to Fahrenheit'),
+])
+def test_near_misses_are_not_served(cache, stored, asked):
+    assert served(cache, stored, asked) is None
+
+
+def test_paraphrase_is_served(cache):
+    value, similarity = served(cache, 'how do I reset my password', 'How can I reset my password?')
+    assert value == {'response': 'how do I reset my password', 'finish_reason': 'stop'}
+    assert similarity >= DEFAULT_THRESHOLD
+
+
+def test_no_calibration_near_miss_is_served_at_the_default_threshold():
+    for stored, asked in NEAR_MISSES:
+        cache = SemanticCache(HashedNgramEmbedder())
+        assert served(cache, stored, asked) is None, (stored, asked)
+
+
+def test_default_threshold_is_calibrated():
+    result = calibrate(HashedNgramEmbedder())
+    assert result['safe_threshold'] < DEFAULT_THRESHOLD
+    assert result['recall']['configured'] > 0.5
+    assert len(PARAPHRASES) == len(result['paraphrases'])
+
+
+def test_terms_match_wins_over_a_closer_row(cache):
+    cache.set(SCOPE, 'What is 15 percent of 80?', {'response': '12', 'finish_reason': 'stop'})
+    cache.set(SCOPE, 'What is 25 percent of 80?', {'response': '20', 'finish_reason': 'stop'})
+    assert cache.get(SCOPE, 'what is 25 percent of 80')[0] == {'response': '20', 'finish_reason': 'stop'}
+    assert cache.stats()['entries'] == 2
+
+
+def test_scopes_do_not_mix(cache):
+    other = semantic_scope('openai', 'gpt-4o', 'Answer in French', 0.7, 1.0, 1000, None)
+    assert served(cache, 'Why is the sky blue?', 'why is the sky blue', scope=other) is not None
+    assert cache.get(SCOPE, 'why is the sky blue') is None
+
+
+def test_expired_entries_miss(cache):
+    cache.ttl = -1
+    assert served(cache, 'Why is the sky blue?', 'Why is the sky blue?') is None
+
+
+def test_full_cache_evicts_least_recently_used():
+    cache = SemanticCache(HashedNgramEmbedder(), max_entries=2)
+    cache.set(SCOPE, 'Why is the sky blue?', {'response': 'a', 'finish_reason': 'stop'})
+    cache.set(SCOPE, 'Explain how photosynthesis works', {'response': 'b', 'finish_reason': 'stop'})
+    cache.get(SCOPE, 'Why is the sky blue?')
+    cache.set(SCOPE, 'Give me a recipe for banana bread', {'response': 'c', 'finish_reason': 'stop'})
+    assert cache.get(SCOPE, 'Why is the sky blue?') is not None
+    assert cache.get(SCOPE, 'Explain how photosynthesis works') is None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_blocked_results_are_not_stored(cache):
+    cache.set(SCOPE, 'Why is the sky blue?', {'response': 'Blocked', 'finish_reason': 'SAFETY'})
+    assert cache.get(SCOPE, 'Why is the sky blue?') is None
+    assert cache.stats()['uncacheable'] == 1
@@ -0,0 +1,50 @@
+import pytest
+
+from backend.sessions import SessionStore, estimate_tokens
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    db_path = str(tmp_path / 'sessions.db') if request.param == 'sqlite' else None
+    return SessionStore(token_budget=100, max_turns=6, max_sessions=2, db_path=db_path)
+
+
+def test_context_keeps_newest_pairs_within_budget(store):
+    for i in range(3):
+        store.append('c1', f'question {i} ' + 'x' * 160, f'answer {i} ' + 'y' * 160)
+    history, info = store.context('c1', message='next')
+    assert [turn['content'][:8] for turn in history] == ['question', 'answer 2']
+    assert info['history_turns'] == 2 and info['dropped_turns'] == 4
+    assert info['history_tokens'] <= 100 - estimate_tokens('next')
+
+
+def test_turns_are_capped(store):
+    for i in range(5):
+        store.append('c1', f'q{i}', f'a{i}')
+    turns = store.get('c1')
+    assert len(turns) == 6
+    assert turns[0] == {'role': 'user', 'content': 'q2'}
+
+
+def test_delete_and_unknown(store):
+    store.append('c1', 'q', 'a')
+    assert store.delete('c1')
+    assert not store.delete('c1')
+    assert store.get('c1') is None
+    assert store.context('c1') == ([], {'conversation_id': 'c1', 'history_turns': 0,
+                                        'dropped_turns': 0, 'history_tokens': 0})
+
+
+def test_expired_conversations_are_gone(store):
+    store.append('c1', 'q', 'a')
+    store.ttl = -1
+    assert store.get('c1') is None
+
+
+def test_workers_sharing_a_file_see_each_others_turns(tmp_path):
+    db_path = str(tmp_path / 'sessions.db')
+    first, second = SessionStore(db_path=db_path), SessionStore(db_path=db_path)
+    first.append('c1', 'hello', 'hi')
+    second.append('c1', 'how are you', 'fine')
+    assert [turn['content'] for turn in first.get('c1')] == ['hello', 'hi', 'how are you', 'fine']
+    assert first.stats()['shared'] and first.stats()['conversations'] == 1
@@ -0,0 +1,24 @@
+import pytest
+
+from backend.stats import percentile
+
+
+@pytest.mark.parametrize('values, pct, expected', [
+    (list(range(1, 11)), 50, 5),
+    (list(range(1, 7)), 50, 3),
+    (list(range(1, 11)), 90, 9),
+    (list(range(1, 11)), 95, 10),
+    (list(range(1, 101)), 99, 99),
+    (list(range(1, 101)), 99.5, 100),
+    (list(range(1, 11)), 0, 1),
+    (list(range(1, 11)), 100, 10),
+    ([7], 50, 7),
+    (list(range(1, 101)), 7, 7),
+    (list(range(1, 101)), 29, 29),
+])
+def test_nearest_rank(values, pct, expected):
+    assert percentile(values, pct) == expected
+
+
+def test_empty():
+    assert percentile([], 50) is None
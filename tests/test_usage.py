@@ -0,0 +1,67 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from backend.streaming import stream_google
+from backend.usage import PriceTable, UsageLedger, totals
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return UsageLedger(str(tmp_path / 'usage.db'), flush_interval=0.01)
+
+
+def test_longest_price_prefix_wins():
+    prices = PriceTable({'gpt-4o-mini-2024': {'input': 1, 'output': 2}})
+    assert prices.cost('gpt-4o-2024-08-06', 1_000_000, 1_000_000) == pytest.approx(12.50)
+    assert prices.cost('gpt-4o-mini', 1_000_000, 0) == pytest.approx(0.15)
+    assert prices.cost('gpt-4o-mini-2024-07-18', 1_000_000, 1_000_000) == pytest.approx(3.0)
+    assert prices.cost('llama-3-8b', 1000, 1000) is None
+
+
+def test_ledger_aggregates_by_model_and_time(ledger):
+    ledger.record('openai', 'gpt-4o-mini', 'ok', 0.2, prompt_tokens=1000, completion_tokens=500)
+    ledger.record('openai', 'gpt-4o-mini', 'error', 0.4)
+    ledger.record('google', 'gemini-2.5-flash', 'ok', 0.1, prompt_tokens=10, completion_tokens=20)
+    ledger.record('local', 'llama', 'cancelled', 0.3, completion_tokens=7, estimated=True)
+    ledger.flush(timeout=5)
+
+    now = time.time()
+    rows = {row['model']: row for row in ledger.by_model(now - 60, now + 60)}
+    assert list(rows) == ['gpt-4o-mini', 'gemini-2.5-flash', 'llama']
+    assert rows['gpt-4o-mini']['requests'] == 2
+    assert rows['gpt-4o-mini']['errors'] == 1
+    assert rows['gpt-4o-mini']['cost'] == pytest.approx((1000 * 0.15 + 500 * 0.60) / 1_000_000)
+    assert rows['llama']['cancelled'] == 1
+    assert rows['llama']['cost'] is None
+
+    total = totals(rows.values())
+    assert (total['requests'], total['prompt_tokens'], total['completion_tokens']) == (4, 1010, 527)
+
+    buckets = ledger.timeline(now - 60, now + 60, 3600, provider='openai')
+    assert sum(bucket['requests'] for bucket in buckets) == 2
+    assert ledger.stats()['written'] == 4
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    ledger = UsageLedger(str(tmp_path / 'usage.db'), queue_size=1, flush_interval=60)
+    ledger._start_writer = lambda: None  # keep the writer from draining the queue
+    for _ in range(3):
+        ledger.record('openai', 'gpt-4o', 'ok', 0.1)
+    assert ledger.stats()['dropped'] == 2
+
+
+def test_google_stream_reports_sdk_usage():
+    usage = SimpleNamespace(prompt_token_count=12, candidates_token_count=3, total_token_count=15,
+                            cached_content_token_count=0)
+    chunks = [
+        SimpleNamespace(candidates=[SimpleNamespace(finish_reason=None)], usage_metadata=None, text='Hi'),
+        SimpleNamespace(candidates=[SimpleNamespace(finish_reason=SimpleNamespace(name='STOP'))],
+                        usage_metadata=usage, text=' there')
+    ]
+    model = SimpleNamespace(generate_content=lambda prompt, stream: iter(chunks))
+    done = list(stream_google(model, 'hello', 0, 100, 1))[-1]
+    assert done['finish_reason'] == 'STOP'
+    assert (done['usage']['prompt_tokens'], done['usage']['completion_tokens']) == (12, 3)
+    assert 'cached_tokens' not in done['usage']